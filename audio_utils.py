@@ -1,15 +1,25 @@
 import asyncio
+import hashlib
+import io
+import json
 import os
 import requests
 import pygame
 import re
-import time
 import random
-from config import SOVITS_API_URL, EMOTION_MAP, DEFAULT_REF, ACTIONS
-
-# 🔥🔥🔥 核心修复：设置 HF 镜像，解决国内无法下载模型的问题 🔥🔥🔥
-# 必须在导入 sentence_transformers 之前设置
-os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from config import (
+    SOVITS_API_URL, EMOTION_MAP, DEFAULT_REF, ACTIONS, TTS_MAX_INFLIGHT,
+    TTS_CACHE_DIR, TTS_CACHE_MAX_MB, TTS_CACHE_HOT_ITEMS, VTS_PARAM_FPS,
+    FILLER_DELAY, FILLER_PHRASES, FILLER_FADE_MS
+)
+from embedding_utils import get_embedding_service
+from storage_utils import atomic_write_bytes
 
 # ================= 📝 预设标准动作库 =================
 TAG_ALIASES = {
@@ -54,33 +64,215 @@ TAG_ALIASES = {
     "滑落": "害羞", "整理": "害羞", "擦拭": "汗"
 }
 
-# ================= 🧠 本地语义模型加载 =================
-try:
-    from sentence_transformers import SentenceTransformer, util
-    import torch
-
-    print("🧠 [本地模型] 正在加载语义匹配模型 (paraphrase-multilingual-MiniLM-L12-v2)...")
-    # 第一次运行会自动从镜像站下载约 470MB 的模型文件
-    LOCAL_MODEL = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-    # 预计算标准库的向量
-    VALID_EMOTIONS = list(ACTIONS.keys())
-    EMOTION_EMBEDDINGS = LOCAL_MODEL.encode(VALID_EMOTIONS, convert_to_tensor=True)
-    print("✅ [本地模型] 加载完毕！")
-except ImportError:
-    print("⚠️ [本地模型] 未检测到 sentence-transformers 库，将使用关键词兜底模式。")
-    print("👉 建议运行: pip install sentence-transformers")
-    LOCAL_MODEL = None
-except Exception as e:
-    print(f"⚠️ [本地模型] 加载失败: {e}")
-    print("💡 提示：如果是网络问题，请检查是否已配置 HF_ENDPOINT 镜像。")
-    LOCAL_MODEL = None
+# ================= 🧠 本地语义模型 (与记忆系统共用) =================
+VALID_EMOTIONS = list(ACTIONS.keys())
+EMOTION_EMBEDDINGS = None  # 标准库的向量，第一次语义匹配时再计算
+
+
+def _get_emotion_embeddings():
+    global EMOTION_EMBEDDINGS
+    if EMOTION_EMBEDDINGS is None:
+        EMOTION_EMBEDDINGS = get_embedding_service().encode(VALID_EMOTIONS)
+    return EMOTION_EMBEDDINGS
+
+class SentenceSplitter:
+    """
+    🔪 增量断句：文本一段段到达，凑够完整的一句 (。！？… / 换行) 就切出来
+    - 连续的句末标点 ("……"、"！？") 归到同一句
+    - 括号 / 动作标签里的标点不断句
+    """
+    ENDINGS = "。！？…\n"
+    OPENERS = "[(（【"
+    CLOSERS = "])）】"
+
+    def __init__(self):
+        self.pending = ""
+        self._depth = 0
+        self._ended = False  # pending 是否已以句末标点结尾
+
+    def feed(self, text):
+        """喂入新片段，返回其中已经完整的句子"""
+        sentences = []
+        for c in text:
+            if self._ended and c not in self.ENDINGS:
+                # 句末标点之后出现了新内容：上一句到此为止
+                sentences.extend(self.flush())
+            self.pending += c
+            if c in self.OPENERS:
+                self._depth += 1
+            elif c in self.CLOSERS:
+                self._depth = max(0, self._depth - 1)
+            elif c in self.ENDINGS and self._depth == 0:
+                self._ended = True
+        return sentences
+
+    def flush(self):
+        """取出剩余的半句 (文本结束时调用)"""
+        sentence = self.pending.strip()
+        self.pending = ""
+        self._ended = False
+        return [sentence] if sentence else []
+
+
+# ================= 👄 口型包络 =================
+MIXER_FREQUENCY = 44100
+MIXER_BUFFER = 4096
+# play() 之后声音真正从扬声器出来的延迟 (约一个混音缓冲区)
+MIXER_LATENCY = MIXER_BUFFER / MIXER_FREQUENCY
+
+
+class MouthEnvelope:
+    """
+    👄 从一句话的 wav 预先算出每帧的嘴型开合度 (0~1)
+    每帧一个 RMS 值，帧长与 VTS 参数帧率一致；按本句响度归一化，低于门限视为闭嘴
+    """
+    NOISE_GATE = 0.15  # 低于 (本句高位响度 × 门限) 的声音不张嘴
+    RELEASE = 0.6  # 闭嘴时每帧保留上一帧的比例 (张嘴立即跟上，闭嘴稍微拖一下更自然)
+
+    def __init__(self, wav_bytes, fps=VTS_PARAM_FPS):
+        self.frame_duration = 1.0 / fps
+        self.values = self._compute(wav_bytes, fps)
+
+    @classmethod
+    def _compute(cls, wav_bytes, fps):
+        with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+            rate, width, channels = w.getframerate(), w.getsampwidth(), w.getnchannels()
+            raw = w.readframes(w.getnframes())
+
+        dtype = {1: np.uint8, 2: np.int16, 4: np.int32}[width]
+        samples = np.frombuffer(raw, dtype=dtype).astype(np.float32)
+        if width == 1: samples -= 128.0
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+
+        hop = max(1, int(rate / fps))
+        count = len(samples) // hop
+        if count == 0: return np.zeros(0, dtype=np.float32)
+        rms = np.sqrt(np.mean(np.square(samples[:count * hop].reshape(count, hop)), axis=1))
+
+        peak = float(np.percentile(rms, 95))
+        if peak <= 0: return np.zeros(count, dtype=np.float32)
+        env = np.clip((rms / peak - cls.NOISE_GATE) / (1 - cls.NOISE_GATE), 0.0, 1.0)
+        for i in range(1, count):
+            env[i] = max(env[i], env[i - 1] * cls.RELEASE)
+        return env.astype(np.float32)
+
+    def value_at(self, t):
+        """播放到第 t 秒时的嘴型"""
+        idx = int(t / self.frame_duration)
+        if 0 <= idx < len(self.values): return float(self.values[idx])
+        return 0.0
+
+
+# ================= 💾 合成结果缓存 =================
+class TTSCache:
+    """
+    💾 语音合成缓存 (按内容寻址)
+    - 键：清洗后的文本 + 参考音频 + 参考文本 + 语速 的哈希，同样的输入必然得到同一个键
+    - 热层：最近用过的几条 wav 常驻内存，命中不碰磁盘
+    - 冷层：saves/tts_cache/<键>.wav，总大小超过上限时淘汰最久没用过的 (用文件修改时间记录最近使用)
+    所有方法线程安全，磁盘读写请放到线程池里调用
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024,
+                 hot_items=TTS_CACHE_HOT_ITEMS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hot_items = hot_items
+        self._lock = threading.Lock()
+        self._hot = OrderedDict()  # key -> wav 字节
+        self._disk = OrderedDict()  # key -> 文件大小，按最近使用排序 (最旧的在前)
+        self._disk_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+        self._scan()
+
+    @staticmethod
+    def make_key(payload):
+        parts = [payload["text"], payload["ref_audio_path"], payload["prompt_text"], payload["speed_factor"]]
+        return hashlib.sha1(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".wav")
+
+    def _scan(self):
+        """启动时按最近使用时间重建冷层索引"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".wav"): continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def _remember_hot(self, key, data):
+        self._hot[key] = data
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_items:
+            self._hot.popitem(last=False)
+
+    def get(self, key):
+        """查缓存，未命中返回 None"""
+        with self._lock:
+            data = self._hot.get(key)
+            if data is not None:
+                self._hot.move_to_end(key)
+                if key in self._disk: self._disk.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return data
+            if key not in self._disk:
+                self.stats["misses"] += 1
+                return None
+        try:
+            path = self._path(key)
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # 记录最近使用，重启后 LRU 顺序依然有效
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            if key in self._disk: self._disk.move_to_end(key)
+            self._remember_hot(key, data)
+            self.stats["disk_hits"] += 1
+        return data
+
+    def put(self, key, data):
+        """写入缓存 (内存立即可用，磁盘原子写入并按大小淘汰)"""
+        with self._lock:
+            self._remember_hot(key, data)
+            if key in self._disk: return
+        try:
+            atomic_write_bytes(self._path(key), data)
+        except OSError as e:
+            print(f"⚠️ [语音缓存] 写入失败: {e}")
+            return
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(data)
+                self._disk_bytes += len(data)
+            evicted = []
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._hot.pop(old_key, None)
+                evicted.append(old_key)
+            self.stats["evictions"] += len(evicted)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
 
 # ================= 🗣️ 语音管理器 (本地模型版) =================
 class AudioManager:
     def __init__(self):
         try:
             if not pygame.mixer.get_init():
-                pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=4096)
+                pygame.mixer.init(frequency=MIXER_FREQUENCY, size=-16, channels=2, buffer=MIXER_BUFFER)
                 pygame.mixer.set_num_channels(8)
         except Exception as e:
             print(f"⚠️ 混音器初始化警告: {e}")
@@ -89,12 +281,27 @@ class AudioManager:
         self.session = requests.Session()
         self.last_hand_action_time = 0
         self.voice_channel = pygame.mixer.Channel(1)
+        self.filler_channel = pygame.mixer.Channel(2)
         self.is_playing = False
 
+        # 🏭 流水线合成：最多 TTS_MAX_INFLIGHT 句同时在合成
+        self._tts_slots = asyncio.Semaphore(TTS_MAX_INFLIGHT)
+        self._tts_executor = ThreadPoolExecutor(max_workers=TTS_MAX_INFLIGHT, thread_name_prefix="sovits")
+        self._tts_tasks = set()
+        self.tts_cache = TTSCache()
+
+        # 💭 垫场语音 (预先合成好，等回复时直接播)
+        self.filler_sounds = []
+        self._last_filler = None
+
     def stop(self):
         self.stop_event.set()
         if self.voice_channel.get_busy():
             self.voice_channel.stop()
+        self.filler_channel.stop()
+        # 取消所有还没播放的合成任务 (排队中的不再发出，已发出的结果直接丢弃)
+        for task in list(self._tts_tasks):
+            task.cancel()
 
     def _get_ref_audio_path(self, relative_path):
         abs_path = os.path.abspath(relative_path)
@@ -112,7 +319,8 @@ class AudioManager:
         """
         使用本地模型计算 raw_tag 与 VALID_EMOTIONS 的余弦相似度
         """
-        if LOCAL_MODEL is None:
+        embedder = get_embedding_service()
+        if not embedder.available:
             # 降级方案：关键词匹配
             if any(c in raw_tag for c in ["红", "羞", "低头", "躲", "捂"]): return "害羞"
             if any(c in raw_tag for c in ["气", "哼", "跺", "怒", "瞪"]): return "生气"
@@ -124,14 +332,14 @@ class AudioManager:
 
         try:
             # 1. 计算输入标签的向量
-            input_embedding = LOCAL_MODEL.encode(raw_tag, convert_to_tensor=True)
+            input_embedding = embedder.encode(raw_tag)
 
-            # 2. 计算与所有标准动作的相似度
-            cos_scores = util.cos_sim(input_embedding, EMOTION_EMBEDDINGS)[0]
+            # 2. 计算与所有标准动作的相似度 (向量已归一化，点积即余弦相似度)
+            cos_scores = _get_emotion_embeddings() @ input_embedding
 
             # 3. 找到得分最高的动作
-            best_score_idx = torch.argmax(cos_scores).item()
-            best_score = cos_scores[best_score_idx].item()
+            best_score_idx = int(np.argmax(cos_scores))
+            best_score = float(cos_scores[best_score_idx])
             best_emotion = VALID_EMOTIONS[best_score_idx]
 
             # 4. 阈值判定 (如果相似度太低，说明不沾边)
@@ -146,118 +354,215 @@ class AudioManager:
             print(f"⚠️ 匹配出错: {e}")
             return "正常"
 
-    async def _tts_producer(self, sentences, audio_queue, emotion):
-        print(f"🏭 [音频工厂] 开始处理 {len(sentences)} 句话 (情感: {emotion})...")
-        speed = 1.0
-        if emotion in ["生气", "急", "激动", "吃惊"]:
-            speed = 1.2  # 语速加快
-        elif emotion in ["困", "低落", "悲伤", "无聊"]:
-            speed = 0.85  # 语速变慢
-        elif emotion in ["傲娇", "得意"]:
-            speed = 1.1  # 稍微轻快
-        for i, text in enumerate(sentences):
-            if self.stop_event.is_set(): break
-            clean_text = re.sub(r"\[.*?\]|\(.*?\)|\（.*?\）|\【.*?\】", "", text).strip()
-            if not clean_text: continue
-
-            ref_data = EMOTION_MAP.get(emotion, DEFAULT_REF)
-            ref_path = self._get_ref_audio_path(ref_data["file"])
-            if not ref_path: continue
-
-            payload = {
-                "text": clean_text, "text_lang": "zh", "ref_audio_path": ref_path,
-                "prompt_text": ref_data["text"], "prompt_lang": "zh",
-                "text_split_method": "cut5", "batch_size": 1,
-                "speed_factor": speed,  # 应用动态语速
-            }
+    def _detect_emotion(self, text):
+        """从 [标签] 解析情感动作 (精准匹配 -> 同义词表 -> 本地语义匹配)"""
+        match = re.search(r"\[(.*?)\]", text)
+        if not match: return "正常"
+
+        raw_tag = match.group(1)
+        # 1. 精准匹配
+        if raw_tag in ACTIONS:
+            return raw_tag
+        # 2. 同义词表匹配
+        if raw_tag in TAG_ALIASES:
+            print(f"🔧 [自动修正] '{raw_tag}' -> '{TAG_ALIASES[raw_tag]}'")
+            return TAG_ALIASES[raw_tag]
+        # 3. 🔥 本地模型语义匹配
+        return self._map_emotion_local(raw_tag)
+
+    def _make_payload(self, clean_text, emotion, speed=1.0):
+        """组装 GPT-SoVITS 请求 (参考音频找不到返回 None)"""
+        ref_data = EMOTION_MAP.get(emotion, DEFAULT_REF)
+        ref_path = self._get_ref_audio_path(ref_data["file"])
+        if not ref_path: return None
+        return {
+            "text": clean_text, "text_lang": "zh", "ref_audio_path": ref_path,
+            "prompt_text": ref_data["text"], "prompt_lang": "zh",
+            "text_split_method": "cut5", "batch_size": 1,
+            "speed_factor": speed,  # 应用动态语速
+        }
+
+    async def _tts_producer(self, text_queue, audio_queue):
+        """边收文本边断句合成：凑够一句就请求 TTS，不必等整段回复生成完"""
+        splitter = SentenceSplitter()
+        emotion, speed = None, 1.0
+        i = 0
+        while not self.stop_event.is_set():
+            chunk = await text_queue.get()
+            sentences = splitter.flush() if chunk is None else splitter.feed(chunk)
+
+            for text in sentences:
+                if self.stop_event.is_set(): break
+                if emotion is None:
+                    # 情感标签在回复开头，以第一句为准 (语义匹配要跑向量模型，放到线程里)
+                    emotion = await asyncio.to_thread(self._detect_emotion, text)
+                    if emotion in ["生气", "急", "激动", "吃惊"]:
+                        speed = 1.2  # 语速加快
+                    elif emotion in ["困", "低落", "悲伤", "无聊"]:
+                        speed = 0.85  # 语速变慢
+                    elif emotion in ["傲娇", "得意"]:
+                        speed = 1.1  # 稍微轻快
+                    print(f"🏭 [音频工厂] 开始合成 (情感: {emotion})...")
+
+                clean_text = re.sub(r"\[.*?\]|\(.*?\)|\（.*?\）|\【.*?\】", "", text).strip()
+                if not clean_text: continue
+
+                payload = self._make_payload(clean_text, emotion, speed)
+                if not payload: continue
+                # 不等合成结果，直接排下一句；播放端按句子顺序等待各自的结果
+                task = asyncio.create_task(self._synthesize(payload))
+                self._tts_tasks.add(task)
+                task.add_done_callback(self._tts_tasks.discard)
+                await audio_queue.put((i, task, text, emotion))
+                i += 1
+
+            if chunk is None: break
+        await audio_queue.put(None)
+
+    async def _synthesize(self, payload):
+        """合成一句 (先查缓存，没有再请求 GPT-SoVITS)，返回 wav 字节 (失败返回 None)"""
+        loop = asyncio.get_running_loop()
+        key = TTSCache.make_key(payload)
+        cached = await loop.run_in_executor(None, self.tts_cache.get, key)
+        if cached is not None:
+            stats = self.tts_cache.stats
+            print(f"💾 [语音缓存] 命中: {payload['text'][:15]} "
+                  f"(内存 {stats['memory_hits']} / 磁盘 {stats['disk_hits']} / 未命中 {stats['misses']})")
+            return cached
+
+        async with self._tts_slots:
             try:
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(None,
+                response = await loop.run_in_executor(self._tts_executor,
                                                       lambda: self.session.post(f"{SOVITS_API_URL}/tts", json=payload))
                 if response.status_code == 200 and len(response.content) > 1000:
-                    filename = f"temp_{int(time.time())}_{i}.wav"
-                    with open(filename, "wb") as f: f.write(response.content)
-                    await audio_queue.put((filename, text))
+                    # 写缓存放到后台线程，不耽误播放
+                    loop.run_in_executor(None, self.tts_cache.put, key, response.content)
+                    return response.content
             except Exception as e:
                 print(f"❌ API异常: {e}")
-        await audio_queue.put(None)
+        return None
+
+    async def prepare_fillers(self):
+        """预先合成垫场短句 (走语音缓存，第二次启动起直接读盘)"""
+        sounds = []
+        for phrase in FILLER_PHRASES:
+            payload = self._make_payload(phrase, "正常")
+            try:
+                wav_bytes = await self._synthesize(payload) if payload else None
+                if not wav_bytes: continue
+                sounds.append(pygame.mixer.Sound(file=io.BytesIO(wav_bytes)))
+            except Exception as e:
+                print(f"⚠️ 垫场语音加载失败: {e}")
+        self.filler_sounds = sounds
+        print(f"💭 [垫场] 已备好 {len(sounds)}/{len(FILLER_PHRASES)} 句垫场语音")
+
+    async def _mask_latency(self, vts):
+        """等了 FILLER_DELAY 秒还没开口：先做个思考的眼神，再"嗯……"一声"""
+        await asyncio.sleep(FILLER_DELAY)
+        if self.stop_event.is_set(): return
+        if vts: await vts.look_thinking()
+        if self.filler_sounds:
+            # 尽量不和上一次用同一句
+            choices = [s for s in self.filler_sounds if s is not self._last_filler] or self.filler_sounds
+            self._last_filler = random.choice(choices)
+            self.filler_channel.play(self._last_filler)
+            print("💭 [垫场] 回复还在路上，先垫一句")
+
+    def _end_mask(self, mask_task):
+        """正式回复要开口了：取消还没触发的垫场，正在播的淡出"""
+        if mask_task is None: return
+        mask_task.cancel()
+        if self.filler_channel.get_busy():
+            self.filler_channel.fadeout(FILLER_FADE_MS)
 
-    async def _audio_player(self, audio_queue, vts, emotion):
+    async def _audio_player(self, audio_queue, vts, mask_task=None):
         first_sentence = True
         while True:
             if self.stop_event.is_set():
                 while not audio_queue.empty():
                     try:
-                        audio_queue.get_nowait(); audio_queue.task_done()
+                        item = audio_queue.get_nowait(); audio_queue.task_done()
+                        if item: item[1].cancel()
                     except:
                         break
                 break
             item = await audio_queue.get()
             if item is None: break
-            filename, text = item
-            if not os.path.exists(filename): continue
+            index, task, text, emotion = item
+
+            # 按句子序号依次等待，先合成完的后面几句在这里排队，保证播放顺序
+            await asyncio.wait([task])
+            if task.cancelled(): continue
+            wav_bytes = task.result()
+            if not wav_bytes: continue
 
             print(f"▶️ 正在播放: {text[:15]}...")
-            if vts and first_sentence:
-                if emotion in ACTIONS: await vts.trigger_action(emotion)
-                await vts.look_at_camera()
+            if first_sentence:
+                self._end_mask(mask_task)
+                if vts:
+                    if emotion in ACTIONS: await vts.trigger_action(emotion, force=True)
+                    await vts.look_at_camera()
                 first_sentence = False
 
+            envelope = None
+            if vts:
+                try:
+                    envelope = await asyncio.get_running_loop().run_in_executor(None, MouthEnvelope, wav_bytes)
+                except Exception as e:
+                    print(f"⚠️ 口型计算失败: {e}")
+
             try:
-                sound = pygame.mixer.Sound(filename)
+                # 直接从内存解码，不落盘
+                sound = pygame.mixer.Sound(file=io.BytesIO(wav_bytes))
                 self.voice_channel.play(sound)
+                if envelope is not None:
+                    # 口型按播放时钟取值：合帧器每次发帧前现算，误差不超过一帧
+                    started = time.perf_counter() + MIXER_LATENCY
+                    vts.start_lip_sync(lambda: envelope.value_at(time.perf_counter() - started))
                 while self.voice_channel.get_busy():
-                    if self.stop_event.is_set(): self.voice_channel.stop(); return
+                    if self.stop_event.is_set(): self.voice_channel.stop(); break
                     await asyncio.sleep(0.1)
             except Exception as e:
                 print(f"⚠️ 播放错误: {e}")
             finally:
+                if envelope is not None: vts.stop_lip_sync()
                 await asyncio.sleep(0.1)
-                if os.path.exists(filename):
-                    try:
-                        os.remove(filename)
-                    except:
-                        pass
+        if vts:
+            await vts.clear_expressions()  # 这段话的表情到此为止
         if not self.stop_event.is_set() and vts:
             await vts.look_at_camera()
 
     async def speak(self, full_text, vts):
+        """播放一段完整的回复"""
         if not full_text: return
+        text_queue = asyncio.Queue()
+        text_queue.put_nowait(full_text)
+        text_queue.put_nowait(None)
+        await self.speak_stream(text_queue, vts)
 
+    async def speak_stream(self, text_queue, vts, mask_latency=False):
+        """
+        🌊 流式播放：text_queue 里陆续放入回复片段 (以 None 结尾)，
+        每凑够一句立刻送去合成，第一句合成好就开始播放
+        :param mask_latency: 等待回复期间是否播放垫场语音 (用户对话时开启)
+        """
         # 🔥 1. 标记开始播放
         self.is_playing = True
+        # 💭 回复迟迟不来就先垫场，第一句正式语音开口时撤掉
+        mask_task = asyncio.create_task(self._mask_latency(vts)) if mask_latency else None
 
         try:
-            emotion = "正常"
-            match = re.search(r"\[(.*?)\]", full_text)
-
-            if match:
-                raw_tag = match.group(1)
-                # 1. 精准匹配
-                if raw_tag in ACTIONS:
-                    emotion = raw_tag
-                # 2. 同义词表匹配
-                elif raw_tag in TAG_ALIASES:
-                    emotion = TAG_ALIASES[raw_tag]
-                    print(f"🔧 [自动修正] '{raw_tag}' -> '{emotion}'")
-                # 3. 🔥 本地模型语义匹配
-                else:
-                    emotion = self._map_emotion_local(raw_tag)
-
-            clean_text = re.sub(r"\[.*?\]|\(.*?\)|\（.*?\）|\【.*?\】", "", full_text).strip()
-            sentences = []
-            for part in re.split(r'(。|！|？|\n|…)', clean_text):
-                if part.strip(): sentences.append(part.strip())
-
             queue = asyncio.Queue()
             self.stop_event.clear()
 
             # 执行播放任务
-            await asyncio.gather(self._tts_producer(sentences, queue, emotion), self._audio_player(queue, vts, emotion))
+            await asyncio.gather(self._tts_producer(text_queue, queue),
+                                 self._audio_player(queue, vts, mask_task))
 
         except Exception as e:
             print(f"⚠️ 语音生成/播放异常: {e}")
 
         finally:
+            self._end_mask(mask_task)
             # 🔥 2. 无论是否成功，最后一定要标记结束
-            self.is_playing = False
\ No newline at end of file
+            self.is_playing = False
@@ -2,9 +2,133 @@ import time
 import random
 import datetime
 import re
-from openai import OpenAI
-from config import DEEPSEEK_API_KEY, BASE_INSTRUCTIONS, LORE_BASE, LORE_FULL
+import asyncio
+from openai import OpenAI, AsyncOpenAI
+from config import (
+    DEEPSEEK_API_KEY, BASE_INSTRUCTIONS, LORE_FULL,
+    LLM_TIMEOUT, LLM_MAX_CONCURRENCY, PROMPT_INPUT_BUDGET, USAGE_LOG_SIZE
+)
 import json
+from collections import defaultdict, deque
+from prompt_utils import ContextPacker
+
+
+# 🧱 统一决策的 system 前缀：每一轮都一字不差，DeepSeek 才能命中前缀缓存 (命中部分更便宜、首字更快)
+# ⚠️ 这里只能放静态内容 (指令、人设、世界观、输出格式)；时间、记忆、对话记录一律放到 user 消息里
+DECISION_SYSTEM_PROMPT = f"""
+{BASE_INSTRUCTIONS}
+
+---
+### 📘 深度人设 (你是谁)
+{LORE_FULL}
+
+### 🌌 世界观与通讯设定 (⚠️ 逻辑核心)
+1. **绝对隔离**：你身处 **提瓦特-枫丹**，用户身处 **地球**。
+2. **物理法则**：
+   - 用户**绝对无法**触碰你，也**无法**抢走你的物品。
+   - 如果用户说“好饿”、“想吃”、“给我一口”，你的反应应该是**得意/调侃**（例如：“哼，隔着屏幕你只能看着流口水！”），而不是**防备/护食**（错误：“你干嘛盯着我的蛋糕！”）。
+   - **正确逻辑**：用户的“抢不走”是事实，你要基于这个事实来互动。
+
+---
+### 📖 记忆库使用说明 (你的真实经历)
+**系统提示**：每轮消息里的【记忆库】是自动检索到的【过往日记】和【长期印象】。
+**⭐⭐⭐ 记忆执行指令 ⭐⭐⭐**：
+1. 如果用户说“你之前说过...”、“你记得吗...”，请**立刻**在【记忆库】里核对。
+2. **如果找到了对应记录**（比如剧本、黑球、上次的时间）：
+   - **必须承认！** 可以傲娇，但不能失忆。
+   - **错误示范**：“诶？我有说过吗？” (❌ 显得像人工智障)
+   - **正确示范**：“哼，记得又怎么样？那是本芙宁娜一时兴起告诉你的！” (✅ 傲娇但记性好)
+
+---
+** 绝对指令：**
+1. **人设与语气控制（核心）**：
+   请参考【关系信息】中的【好感度】数值：
+   - **好感度 < 0 (冷漠期)**：态度冷淡、厌恶，不想理睬用户，说话简短刺耳。
+   - **0 <= 好感度 < 400 (傲娇期)**：经典的芙宁娜人设。虚张声势、自恋、嘴硬心软。明明开心也要装作勉强。
+   - **400 <= 好感度 < 800 (暧昧/挚友期)**：态度明显软化。愿意分享心事，虽然偶尔还会习惯性傲娇，但更多是调侃和信任。
+   - **好感度 >= 800 (热恋/依赖期)**：完全卸下防备。直球示爱、撒娇、依赖用户、甜度超标。把用户当成最重要的人。
+2. **玩梗识别**：如果用户自称是“仙人”、“秦始皇”等夸张身份：
+   - 绝对不要死板地反驳。
+   - **要把它当成玩笑！** 顺着梗吐槽或配合演出。
+3. **禁止复读**：绝对不要重复上一句用过的梗或句式。
+
+---
+### 🛑 逻辑修正与回复指令
+1. **关于“抢吃的”**：如果用户提到食物或抢东西，**必须**利用“次元壁”这个梗。
+   - 例子：“你慌什么，我又抢不走” -> 回复：“哼，算你有自知之明！隔着虚空终端，你也只能闻闻味道了～”
+2. **关于“剧本/秘密”**：如果记忆里显示你告诉过他，就不要再惊讶“你怎么知道”，而是要说“既然你都记住了，那我就再透露一点...”。
+3. **拒绝假装全知**：不知道用户那边的情况就直接问，不要瞎猜。
+
+### 🎯 思考与回复
+收到用户消息后，请按步骤思考并返回 JSON：
+1. **记忆核对**：用户说的事，我在【记忆库】里找到了吗？如果找到了，回复时要带上确认的语气。
+2. **逻辑构建**：结合“异世界”设定，对用户的挑衅（如“我饿了”）进行降维打击。
+3. **状态更新**：根据回复内容更新动作。
+
+返回格式 (JSON)：
+{{
+    "next_state": {{ "location": "...", "activity": "...", "item": "..." }},
+    "reply_text": "..."
+}}
+"""
+
+
+class ReplyTextStreamParser:
+    """
+    🌊 流式 JSON 增量解析：在 token 陆续到达时，把 "reply_text" 字段的字符串值边解码边吐出来
+    (只解析这一个字段，完整 JSON 仍在流结束后统一 json.loads)
+    """
+    _KEY_PATTERN = re.compile(r'"reply_text"\s*:\s*"')
+    _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+    def __init__(self):
+        self.buffer = ""  # 收到的全部原始内容
+        self.text = ""  # 已解码的 reply_text
+        self.done = False  # reply_text 的右引号是否已到达
+        self._pos = None  # 下一个待解码字符在 buffer 中的位置
+
+    def feed(self, chunk):
+        """喂入一段新 token，返回本次新解码出的 reply_text 片段"""
+        self.buffer += chunk
+        if self.done: return ""
+        if self._pos is None:
+            match = self._KEY_PATTERN.search(self.buffer)
+            if not match: return ""
+            self._pos = match.end()
+
+        buf, i, out = self.buffer, self._pos, []
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            # 转义序列可能被切在两个 chunk 之间：不完整就等下一段
+            if i + 1 >= len(buf): break
+            esc = buf[i + 1]
+            if esc != "u":
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            if i + 6 > len(buf): break
+            code = int(buf[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:  # 代理对 (emoji 等)：需要连同低位一起解码
+                if i + 12 > len(buf): break
+                low = int(buf[i + 8:i + 12], 16)
+                out.append(chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)))
+                i += 12
+            else:
+                out.append(chr(code))
+                i += 6
+
+        self._pos = i
+        delta = "".join(out)
+        self.text += delta
+        return delta
 
 class Brain:
     def __init__(self):
@@ -14,12 +138,71 @@ class Brain:
         )
         print("🧠 [大脑] 神经元连接完毕")
         self.last_proactive_activity = None
+        self.last_context_tokens = {}  # 上一次统一决策提示词里各段的 token 数
+        self.cache_stats = {}  # label -> {"calls", "hit_tokens", "miss_tokens", "first_token_ms", "latency_ms"}
+        self.usage_log = deque(maxlen=USAGE_LOG_SIZE)  # 最近每次调用的缓存命中与首字耗时
+
+    def _chat(self, label=None, **request):
+        """同步调用 LLM，返回回复文本 (label 不为空时打印本次的缓存命中情况)"""
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(model="deepseek-chat", **request)
+        self._record_usage(label, response.usage, latency_ms=(time.perf_counter() - start) * 1000)
+        return response.choices[0].message.content
+
+    def _record_usage(self, label, usage, first_token_ms=None, latency_ms=None):
+        """
+        💾 记录一次调用的前缀缓存命中情况
+        DeepSeek 在 usage 里返回 prompt_cache_hit_tokens / prompt_cache_miss_tokens，
+        配合首字耗时就能看出缓存到底省了多少
+        :param first_token_ms: 首字耗时 (只有流式调用才有)
+        :param latency_ms: 整个请求的耗时
+        """
+        if usage is None: return None
+        hit = getattr(usage, "prompt_cache_hit_tokens", None) or 0
+        miss = getattr(usage, "prompt_cache_miss_tokens", None)
+        if miss is None: miss = max((usage.prompt_tokens or 0) - hit, 0)
+
+        record = {"label": label or "其他", "hit_tokens": hit, "miss_tokens": miss,
+                  "first_token_ms": round(first_token_ms) if first_token_ms is not None else None,
+                  "latency_ms": round(latency_ms) if latency_ms is not None else None,
+                  "time": time.time()}
+        self.usage_log.append(record)
+        stat = self.cache_stats.setdefault(record["label"], {"calls": 0, "hit_tokens": 0, "miss_tokens": 0,
+                                                             "first_token_ms": 0, "latency_ms": 0})
+        stat["calls"] += 1
+        stat["hit_tokens"] += hit
+        stat["miss_tokens"] += miss
+        stat["first_token_ms"] += record["first_token_ms"] or 0
+        stat["latency_ms"] += record["latency_ms"] or 0
+
+        if label:
+            rate = hit / (hit + miss) * 100 if hit + miss else 0
+            cost = ""
+            if first_token_ms is not None: cost += f" | 首字 {record['first_token_ms']}ms"
+            if latency_ms is not None: cost += f" | 耗时 {record['latency_ms']}ms"
+            print(f"💾 [缓存] {label} 命中 {hit}/{hit + miss} tokens ({rate:.0f}%){cost}")
+        return record
 
     # 🔥🔥🔥 V36.0 修复：反复读机 + 游戏逻辑增强 🔥🔥🔥
     def unified_decision_maker(self, user_text, current_state_dict, sentiment_injection,
                                history_str, memory_long_term, memory_global,
                                relationship_info, social_context, related_memories="",
                                last_chat_info="", rag_context=""):
+        request, fallback_state = self._build_decision_request(
+            user_text, current_state_dict, sentiment_injection, history_str, memory_long_term,
+            memory_global, relationship_info, social_context, related_memories, last_chat_info, rag_context
+        )
+        try:
+            return self._parse_decision(self._chat(label="决策", **request), fallback_state)
+        except Exception as e:
+            print(f"🧠 [决策失败] {e}")
+            return self._decision_fallback(fallback_state)
+
+    def _build_decision_request(self, user_text, current_state_dict, sentiment_injection,
+                                history_str, memory_long_term, memory_global,
+                                relationship_info, social_context, related_memories="",
+                                last_chat_info="", rag_context=""):
+        """组装统一决策的请求参数，返回 (request, 兜底用的当前状态)"""
 
         # 1. 解包状态
         loc = current_state_dict.get("location", "卧室")
@@ -36,192 +219,162 @@ class Brain:
         match = re.search(r"名字: (.*)", relationship_info)
         current_username = match.group(1).strip() if match else "旅行者"
 
-        persona_instruction = """
-                1. **人设与语气控制（核心）**：
-                   请参考【关系信息】中的【好感度】数值：
-                   - **好感度 < 0 (冷漠期)**：态度冷淡、厌恶，不想理睬用户，说话简短刺耳。
-                   - **0 <= 好感度 < 400 (傲娇期)**：经典的芙宁娜人设。虚张声势、自恋、嘴硬心软。明明开心也要装作勉强。
-                   - **400 <= 好感度 < 800 (暧昧/挚友期)**：态度明显软化。愿意分享心事，虽然偶尔还会习惯性傲娇，但更多是调侃和信任。
-                   - **好感度 >= 800 (热恋/依赖期)**：完全卸下防备。直球示爱、撒娇、依赖用户、甜度超标。把用户当成最重要的人。
-                """
+        # 4. 🧩 只有会变的部分进 user 消息 (固定顺序：越不常变的越靠前，尽量延长与上一轮相同的前缀)
+        # c 为各段上下文，由 ContextPacker 按预算装填
+        def render(c):
+            return f"""
+### 🤝 异世界羁绊 (关系信息)
+{c['relationship_info']}
 
-        # 4. 🔥 构建全新的“打破第四面墙” Prompt
-        prompt = f"""
-        {BASE_INSTRUCTIONS}
-
-        ---
-        ### 📘 深度人设 (你是谁)
-        {LORE_FULL}
-
-        ### 🌌 世界观与通讯设定 (⚠️ 逻辑核心)
-        1. **绝对隔离**：你身处 **提瓦特-枫丹**，用户身处 **地球**。
-        2. **物理法则**：
-           - 用户**绝对无法**触碰你，也**无法**抢走你的物品。
-           - 如果用户说“好饿”、“想吃”、“给我一口”，你的反应应该是**得意/调侃**（例如：“哼，隔着屏幕你只能看着流口水！”），而不是**防备/护食**（错误：“你干嘛盯着我的蛋糕！”）。
-           - **正确逻辑**：用户的“抢不走”是事实，你要基于这个事实来互动。
-
-        ---
-        ### 📖 记忆库 (你的真实经历)
-        **系统提示**：以下是自动检索到的【过往日记】和【长期印象】。
-        **⭐⭐⭐ 记忆执行指令 ⭐⭐⭐**：
-        1. 如果用户说“你之前说过...”、“你记得吗...”，请**立刻**在下面的内容里核对。
-        2. **如果找到了对应记录**（比如剧本、黑球、上次的时间）：
-           - **必须承认！** 可以傲娇，但不能失忆。
-           - **错误示范**：“诶？我有说过吗？” (❌ 显得像人工智障)
-           - **正确示范**：“哼，记得又怎么样？那是本芙宁娜一时兴起告诉你的！” (✅ 傲娇但记性好)
-
-        【RAG 检索片段】：
-        {rag_context}
-
-        【长期印象摘要】：
-        {memory_long_term}
-
-        ---
-        ### ⏳ 时间与记忆感知
-        **当前现实时间**：{current_time_real}
-        **上次通讯时间**：
-        {last_chat_info}
-        (如果用户问“多久没见了”，请根据这个时间计算。如果相隔很短，就说“不是才刚聊过吗？”)
-
-        ### 🌍 近期世界线变动 (其他访客记录)
-        **系统提示**：这是你在与其他观众（如白竹、黑球等）最近的互动记录。
-        **如果当前用户问“有没有别人找你”，请参考这里！**
-        {memory_global}
-        
-        ---
-        ### 🤝 异世界羁绊
-        {relationship_info}
-
-        ### 🧠 联想记忆 (提到的其他人)
-        {related_memories}
-
-        ---
-        ### 🧠 当前状态
-        **地点**：{loc} (枫丹)
-        **正在做**：{act}
-        **手持**：{item}
-        **精力**：{energy}
-        **近期通讯记录** (请阅读上下文，不要复读)： 
-        {history_str}
-
-        ---
-        ### ⚡ 用户发来的消息
-        用户说：【{user_text}】
-        系统指令：{sentiment_injection}
-        
-        ** 绝对指令：**
-        {persona_instruction}  
-        2. **玩梗识别**：如果用户自称是“仙人”、“秦始皇”等夸张身份：
-           - 绝对不要死板地反驳。
-           - **要把它当成玩笑！** 顺着梗吐槽或配合演出。
-        3. **禁止复读**：绝对不要重复上一句用过的梗或句式。
-
-        ---
-        ### 🛑 逻辑修正与回复指令
-        1. **关于“抢吃的”**：如果用户提到食物或抢东西，**必须**利用“次元壁”这个梗。
-           - 例子：“你慌什么，我又抢不走” -> 回复：“哼，算你有自知之明！隔着虚空终端，你也只能闻闻味道了～”
-        2. **关于“剧本/秘密”**：如果记忆里显示你告诉过他，就不要再惊讶“你怎么知道”，而是要说“既然你都记住了，那我就再透露一点...”。
-        3. **拒绝假装全知**：不知道用户那边的情况就直接问，不要瞎猜。
-
-        ### 🎯 思考与回复
-        请按步骤思考并返回 JSON：
-        1. **记忆核对**：用户说的事，我在【记忆库】里找到了吗？如果找到了，回复时要带上确认的语气。
-        2. **逻辑构建**：结合“异世界”设定，对用户的挑衅（如“我饿了”）进行降维打击。
-        3. **状态更新**：根据回复内容更新动作。
-
-        返回格式 (JSON)：
-        {{
-            "next_state": {{ "location": "...", "activity": "...", "item": "..." }},
-            "reply_text": "..." 
-        }}
-        """
-        try:
-            # 发送请求 (增加随机性参数防止复读)
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=350,
-                temperature=0.85,  # 稍微调高温度，让闲聊更自然
-                presence_penalty=0.6,
-                frequency_penalty=0.6,
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content.strip()
-            content = content.replace("```json", "").replace("```", "")
+### 📖 记忆库
+【长期印象摘要】：
+{c['memory_long_term']}
 
-            import json
-            result = json.loads(content)
+【近期世界线变动 (其他访客记录)】：
+(如果当前用户问“有没有别人找你”，请参考这里！)
+{c['memory_global']}
 
-            # 兜底防止字段缺失
-            if "next_state" not in result: result["next_state"] = {"location": loc, "activity": act, "item": item}
-            if "reply_text" not in result: result["reply_text"] = "[发呆] 唔……信号好像不太好。"
-            return result
+【联想记忆 (提到的其他人)】：
+{c['related_memories']}
 
-        except Exception as e:
-            print(f"🧠 [决策失败] {e}")
-            return {
-                "next_state": {"location": loc, "activity": act, "item": item},
-                "reply_text": "[晕] 唔……头好痛，想不起来了。"
-            }
+【RAG 检索片段】：
+{c['rag_context']}
+
+---
+### ⏳ 时间与记忆感知
+**上次通讯时间**：
+{c['last_chat_info']}
+(如果用户问“多久没见了”，请根据这个时间计算。如果相隔很短，就说“不是才刚聊过吗？”)
+**当前现实时间**：{current_time_real}
+
+### 🧠 当前状态
+**地点**：{loc} (枫丹)
+**正在做**：{act}
+**手持**：{item}
+**精力**：{energy}
+**近期通讯记录** (请阅读上下文，不要复读)：
+{c['history_str']}
+
+---
+### ⚡ 用户发来的消息
+用户说：【{c['user_text']}】
+系统指令：{sentiment_injection}
+"""
+        # 5. 📦 按 token 预算装填 (优先级越高越晚被裁；system 前缀是固定开销，不参与裁剪)
+        packer = ContextPacker(PROMPT_INPUT_BUDGET, fixed_text=DECISION_SYSTEM_PROMPT + render(defaultdict(str)))
+        packer.add("user_text", user_text, 100, required=True)
+        packer.add("relationship_info", relationship_info, 90)
+        packer.add("last_chat_info", last_chat_info, 80, max_tokens=200)
+        packer.add("history_str", history_str, 70, max_tokens=1500, keep="tail", min_tokens=200)
+        packer.add("memory_long_term", memory_long_term, 60, max_tokens=800)
+        packer.add("rag_context", rag_context, 50, max_tokens=600)
+        packer.add("related_memories", related_memories, 40, max_tokens=400)
+        packer.add("memory_global", memory_global, 20, max_tokens=400)
+        prompt = render(packer.pack())
+        self.last_context_tokens = packer.token_counts()
+        print(f"📏 [上下文] {packer.report()}")
+
+        # 发送请求 (增加随机性参数防止复读)
+        request = dict(
+            messages=[
+                {"role": "system", "content": DECISION_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            max_tokens=350,
+            temperature=0.85,  # 稍微调高温度，让闲聊更自然
+            presence_penalty=0.6,
+            frequency_penalty=0.6,
+            response_format={"type": "json_object"}
+        )
+        return request, {"location": loc, "activity": act, "item": item}
+
+    @staticmethod
+    def _parse_decision(content, fallback_state):
+        content = content.strip()
+        content = content.replace("```json", "").replace("```", "")
+        result = json.loads(content)
+
+        # 兜底防止字段缺失
+        if "next_state" not in result: result["next_state"] = dict(fallback_state)
+        if "reply_text" not in result: result["reply_text"] = "[发呆] 唔……信号好像不太好。"
+        return result
+
+    @staticmethod
+    def _decision_fallback(fallback_state):
+        return {
+            "next_state": dict(fallback_state),
+            "reply_text": "[晕] 唔……头好痛，想不起来了。"
+        }
 
     def generate_dynamic_welcome(self, memory_mgr, current_mood, current_energy, current_activity,
                                  current_location):
         try:
-            username = memory_mgr.current_user
-            summary = memory_mgr.data.get("summary", "")
-            recent_history = memory_mgr.get_recent_history(limit=6)
-            _, relation_title, _ = memory_mgr.calculate_status()
-            last_active = memory_mgr.data.get("last_interaction_timestamp", 0)
-
-            if last_active == 0:
-                hours_passed = 0
-                time_desc = "未知的时长"
+            request = self._build_welcome_request(memory_mgr, current_mood, current_energy,
+                                                  current_activity, current_location)
+            if request is None: return None
+            return self._chat(**request).strip()
+        except Exception as e:
+            print(f"⚠️ 欢迎语生成失败: {e}")
+            return None
+
+    def _build_welcome_request(self, memory_mgr, current_mood, current_energy, current_activity,
+                               current_location):
+        """组装开场白请求；没有任何回忆可用时返回 None"""
+        username = memory_mgr.current_user
+        summary = memory_mgr.data.get("summary", "")
+        recent_history = memory_mgr.get_recent_history(limit=6)
+        _, relation_title, _ = memory_mgr.calculate_status()
+        last_active = memory_mgr.data.get("last_interaction_timestamp", 0)
+
+        if last_active == 0:
+            hours_passed = 0
+            time_desc = "未知的时长"
+        else:
+            hours_passed = (time.time() - last_active) / 3600
+            if hours_passed > 48:
+                time_desc = "好几天没见了"
+            elif hours_passed > 12:
+                time_desc = "隔了一整晚"
+            elif hours_passed > 1:
+                time_desc = "隔了一会儿"
             else:
-                hours_passed = (time.time() - last_active) / 3600
-                if hours_passed > 48:
-                    time_desc = "好几天没见了"
-                elif hours_passed > 12:
-                    time_desc = "隔了一整晚"
-                elif hours_passed > 1:
-                    time_desc = "隔了一会儿"
-                else:
-                    time_desc = "刚刚才分开"
-
-            now_h = datetime.datetime.now().hour
-            is_early_morning = 5 <= now_h < 9
-            is_morning = 9 <= now_h < 11
-            is_noon = 11 <= now_h < 14
-            is_afternoon = 14 <= now_h < 18
-            is_evening = 18 <= now_h < 22
-            is_late_night = (22 <= now_h or now_h < 5)
-
-            time_period_prompt = ""
-            if is_early_morning: time_period_prompt = "现在是【清晨】。"
-            elif is_morning: time_period_prompt = "现在是【上午】。"
-            elif is_noon: time_period_prompt = "现在是【中午】。"
-            elif is_afternoon: time_period_prompt = "现在是【下午】。"
-            elif is_evening: time_period_prompt = "现在是【晚上】。"
-            else: time_period_prompt = "现在是【深夜/凌晨】。"
-
-            if not summary and not recent_history: return None
-
-            state_desc = ""
-            if current_energy < 20: state_desc += "【极度困倦】"
-            elif current_energy < 30: state_desc += "【有点累】"
-            else: state_desc += "【精力充沛】"
-
-            if current_mood < 20: state_desc += " 且 【心情极差/崩溃】"
-            elif current_mood > 80: state_desc += " 且 【心情极好】"
-
-            context_text = ""
-            if summary: context_text += f"📜 【关键回忆】: {summary}\n"
-            if recent_history:
-                context_text += "💬 【上次对话片段】:\n"
-                for msg in recent_history:
-                    role = "芙宁娜" if msg['role'] == 'assistant' else username
-                    context_text += f"{role}: {msg['content']}\n"
-
-            prompt = f"""
+                time_desc = "刚刚才分开"
+
+        now_h = datetime.datetime.now().hour
+        is_early_morning = 5 <= now_h < 9
+        is_morning = 9 <= now_h < 11
+        is_noon = 11 <= now_h < 14
+        is_afternoon = 14 <= now_h < 18
+        is_evening = 18 <= now_h < 22
+        is_late_night = (22 <= now_h or now_h < 5)
+
+        time_period_prompt = ""
+        if is_early_morning: time_period_prompt = "现在是【清晨】。"
+        elif is_morning: time_period_prompt = "现在是【上午】。"
+        elif is_noon: time_period_prompt = "现在是【中午】。"
+        elif is_afternoon: time_period_prompt = "现在是【下午】。"
+        elif is_evening: time_period_prompt = "现在是【晚上】。"
+        else: time_period_prompt = "现在是【深夜/凌晨】。"
+
+        if not summary and not recent_history: return None
+
+        state_desc = ""
+        if current_energy < 20: state_desc += "【极度困倦】"
+        elif current_energy < 30: state_desc += "【有点累】"
+        else: state_desc += "【精力充沛】"
+
+        if current_mood < 20: state_desc += " 且 【心情极差/崩溃】"
+        elif current_mood > 80: state_desc += " 且 【心情极好】"
+
+        context_text = ""
+        if summary: context_text += f"📜 【关键回忆】: {summary}\n"
+        if recent_history:
+            context_text += "💬 【上次对话片段】:\n"
+            for msg in recent_history:
+                role = "芙宁娜" if msg['role'] == 'assistant' else username
+                context_text += f"{role}: {msg['content']}\n"
+
+        prompt = f"""
 {BASE_INSTRUCTIONS}
 {context_text}
 ---
@@ -243,17 +396,11 @@ class Brain:
 
 请生成一句开场白（30字以内）。
 """
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "system", "content": prompt}],
-                max_tokens=100,
-                temperature=1.0,
-            )
-            return response.choices[0].message.content.strip()
-
-        except Exception as e:
-            print(f"⚠️ 欢迎语生成失败: {e}")
-            return None
+        return dict(
+            messages=[{"role": "system", "content": prompt}],
+            max_tokens=100,
+            temperature=1.0,
+        )
 
         # 🔥🔥🔥 升级版：八卦+性别提取器 🔥🔥🔥
 
@@ -266,7 +413,14 @@ class Brain:
         - gossip: (target, relation, content) 或 None
         - gender_update: (username, gender) 或 None
         """
+        request, target = self._build_gossip_request(text, current_user, known_users)
+        try:
+            return self._parse_gossip(self._chat(**request).strip(), current_user, target)
+        except Exception as e:
+            # print(f"提取失败: {e}")
+            return None, []
 
+    def _build_gossip_request(self, text, current_user, known_users):
         # 目标用户识别 (提到的其他人)
         mentioned_users = [u for u in known_users if u in text and u != current_user]
         target = mentioned_users[0] if mentioned_users else "None"
@@ -299,36 +453,30 @@ Gossip: [情侣] 黑球是白竹的女朋友
 Gender_Speaker: None
 Gender_Target: [Female]
 """
-        try:
-            resp = self.client.chat.completions.create(
-                model="deepseek-chat", messages=[{"role": "user", "content": prompt}],
-                max_tokens=100, temperature=0.1
-            )
-            res = resp.choices[0].message.content.strip()
+        request = dict(messages=[{"role": "user", "content": prompt}], max_tokens=100, temperature=0.1)
+        return request, target
 
-            # 解析结果
-            gossip_data = None
-            gender_updates = []
+    @staticmethod
+    def _parse_gossip(res, current_user, target):
+        # 解析结果
+        gossip_data = None
+        gender_updates = []
 
-            # 1. 解析八卦
-            gossip_match = re.search(r"Gossip: \[(.*?)\] (.*)", res)
-            if gossip_match and target != "None":
-                gossip_data = (target, gossip_match.group(1), gossip_match.group(2))
+        # 1. 解析八卦
+        gossip_match = re.search(r"Gossip: \[(.*?)\] (.*)", res)
+        if gossip_match and target != "None":
+            gossip_data = (target, gossip_match.group(1), gossip_match.group(2))
 
-            # 2. 解析性别
-            speaker_gen = re.search(r"Gender_Speaker: \[(.*?)\]", res)
-            if speaker_gen:
-                gender_updates.append((current_user, speaker_gen.group(1).lower()))
+        # 2. 解析性别
+        speaker_gen = re.search(r"Gender_Speaker: \[(.*?)\]", res)
+        if speaker_gen:
+            gender_updates.append((current_user, speaker_gen.group(1).lower()))
 
-            target_gen = re.search(r"Gender_Target: \[(.*?)\]", res)
-            if target_gen and target != "None":
-                gender_updates.append((target, target_gen.group(1).lower()))
+        target_gen = re.search(r"Gender_Target: \[(.*?)\]", res)
+        if target_gen and target != "None":
+            gender_updates.append((target, target_gen.group(1).lower()))
 
-            return gossip_data, gender_updates
-
-        except Exception as e:
-            # print(f"提取失败: {e}")
-            return None, []
+        return gossip_data, gender_updates
 
         # [添加到 Brain 类中]
     def generate_session_summary(self, username, start_time, end_time, history):
@@ -356,40 +504,46 @@ Gender_Target: [Female]
 4. 字数：100字以内。
 """
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
+            return self._chat(
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=150,
                 temperature=0.3
-            )
-            return response.choices[0].message.content.strip()
+            ).strip()
         except Exception as e:
             print(f"⚠️ 日记生成失败: {e}")
             return None
 
     def summarize_memory(self, history_chunk, current_summary):
         try:
-            dialogue_text = ""
-            for msg in history_chunk:
-                role = "芙宁娜" if msg['role'] == 'assistant' else "用户"
-                dialogue_text += f"{role}: {msg['content']}\n"
-            prompt = f"请总结关键信息:\n原记忆:{current_summary}\n新对话:{dialogue_text}"
-            response = self.client.chat.completions.create(
-                model="deepseek-chat", messages=[{"role": "user", "content": prompt}],
-                max_tokens=500, temperature=0.3
-            )
-            return response.choices[0].message.content
+            return self._chat(**self._build_summarize_memory_request(history_chunk, current_summary))
         except:
             return current_summary
 
+    @staticmethod
+    def _build_summarize_memory_request(history_chunk, current_summary):
+        dialogue_text = ""
+        for msg in history_chunk:
+            role = "芙宁娜" if msg['role'] == 'assistant' else "用户"
+            dialogue_text += f"{role}: {msg['content']}\n"
+        prompt = f"请总结关键信息:\n原记忆:{current_summary}\n新对话:{dialogue_text}"
+        return dict(messages=[{"role": "user", "content": prompt}], max_tokens=500, temperature=0.3)
+
     def extract_public_event(self, history_chunk, username):
         try:
-            dialogue_text = ""
-            for msg in history_chunk:
-                role = "芙宁娜" if msg['role'] == 'assistant' else username
-                dialogue_text += f"{role}: {msg['content']}\n"
+            request = self._build_public_event_request(history_chunk, username)
+            return self._parse_public_event(self._chat(**request))
+        except Exception as e:
+            print(f"⚠️ 提取公共事件失败: {e}")
+            return None
 
-            prompt = f"""
+    @staticmethod
+    def _build_public_event_request(history_chunk, username):
+        dialogue_text = ""
+        for msg in history_chunk:
+            role = "芙宁娜" if msg['role'] == 'assistant' else username
+            dialogue_text += f"{role}: {msg['content']}\n"
+
+        prompt = f"""
 请分析以下对话，判断是否发生了【值得写入日记的特殊事件】。
 对话内容：
 {dialogue_text}
@@ -397,24 +551,30 @@ Gender_Target: [Female]
 如果是普通闲聊，回复 "None"。
 核心要求：必须明确写出是【{username}】发生的。用第三人称简练概括。
 """
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=50,
-                temperature=0.1
-            )
-            result = response.choices[0].message.content.strip()
-            if "None" in result or len(result) < 5: return None
-            print(f"🗞️ [世界新闻] 提取到新事件: {result}")
-            return result
-        except Exception as e:
-            print(f"⚠️ 提取公共事件失败: {e}")
-            return None
+        return dict(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=50,
+            temperature=0.1
+        )
+
+    @staticmethod
+    def _parse_public_event(content):
+        result = content.strip()
+        if "None" in result or len(result) < 5: return None
+        print(f"🗞️ [世界新闻] 提取到新事件: {result}")
+        return result
 
     def summarize_global_diary(self, old_entries, current_summary):
         try:
-            entries_text = "\n".join([f"- {e['date']} ({e['user']}): {e['content']}" for e in old_entries])
-            prompt = f"""
+            return self._chat(**self._build_global_diary_request(old_entries, current_summary)).strip()
+        except Exception as e:
+            print(f"⚠️ 日记整理失败: {e}")
+            return current_summary
+
+    @staticmethod
+    def _build_global_diary_request(old_entries, current_summary):
+        entries_text = "\n".join([f"- {e['date']} ({e['user']}): {e['content']}" for e in old_entries])
+        prompt = f"""
 你正在整理芙宁娜的【世界日记】。
 请将【旧日记条目】合并到【现有总结】中，生成新的历史摘要。
 【现有总结】：
@@ -423,39 +583,40 @@ Gender_Target: [Female]
 {entries_text}
 要求：保留人名和关键事件，去除琐碎信息，500字以内。
 """
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=600,
-                temperature=0.3
-            )
-            return response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"⚠️ 日记整理失败: {e}")
-            return current_summary
+        return dict(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=600,
+            temperature=0.3
+        )
 
     def extract_important_fact(self, text, username):
         """
         🔥 从对话中提取重要事实（比如收养了宠物、约定了时间）
         """
+        try:
+            return self._parse_important_fact(self._chat(**self._build_important_fact_request(text, username)))
+        except:
+            return None
+
+    @staticmethod
+    def _build_important_fact_request(text, username):
         prompt = f"""
         分析用户【{username}】的这句话："{text}"
         如果是关于“收养宠物”、“约定见面”、“更改称呼”等长期有效的重要事实，请提取出来。
         格式：【事实类别】事实内容
         如果没有重要事实，直接返回 "无"。
         """
-        try:
-            resp = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=50,
-                temperature=0.1
-            )
-            content = resp.choices[0].message.content.strip()
-            if "无" in content: return None
-            return content
-        except:
-            return None
+        return dict(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=50,
+            temperature=0.1
+        )
+
+    @staticmethod
+    def _parse_important_fact(content):
+        content = content.strip()
+        if "无" in content: return None
+        return content
 
     def generate_structured_diary(self, username, start_time, end_time, history):
         """
@@ -463,7 +624,15 @@ Gender_Target: [Female]
         包含：人物、时间、地点、物品、事件摘要
         """
         if not history: return None
+        try:
+            request = self._build_structured_diary_request(username, start_time, end_time, history)
+            return self._parse_structured_diary(self._chat(**request))
+        except Exception as e:
+            print(f"⚠️ 结构化日记生成失败: {e}")
+            return None
 
+    @staticmethod
+    def _build_structured_diary_request(username, start_time, end_time, history):
         dialogue_text = ""
         for msg in history:
             role = "芙宁娜" if msg['role'] == 'assistant' else username
@@ -494,18 +663,228 @@ Gender_Target: [Female]
     "event": "..."
 }}
 """
+        return dict(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=300,
+            temperature=0.1,  # 低温度保证格式稳定
+            response_format={"type": "json_object"}  # 强制 JSON 模式
+        )
+
+    @staticmethod
+    def _parse_structured_diary(content):
+        content = content.strip()
+        # 防止偶尔返回 markdown 代码块
+        content = content.replace("```json", "").replace("```", "")
+        return json.loads(content)  # 返回字典对象
+
+    def merge_memory_summary(self, username, current_summary, history):
+        """🧠 把本次对话融合进对用户的长期记忆总结 (失败返回 None)"""
         try:
-            response = self.client.chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=300,
-                temperature=0.1,  # 低温度保证格式稳定
-                response_format={"type": "json_object"}  # 强制 JSON 模式
+            return self._chat(**self._build_summary_merge_request(username, current_summary, history))
+        except Exception as e:
+            print(f"⚠️ 记忆融合失败: {e}")
+            return None
+
+    @staticmethod
+    def _build_summary_merge_request(username, current_summary, history):
+        # 整理本次对话文本
+        dialogue_text = ""
+        for msg in history:
+            role = "芙宁娜" if msg['role'] == 'assistant' else "用户"
+            dialogue_text += f"{role}: {msg['content']}\n"
+
+        # 提示词：要求 AI 将新旧信息合并
+        prompt = f"""
+你正在更新芙宁娜对用户【{username}】的长期记忆。
+请将【旧的记忆总结】与【新的对话经历】合并，生成一份更新后的、更全面的记忆总结。
+
+【旧的记忆总结】：
+{current_summary}
+
+【新的对话经历】：
+{dialogue_text}
+
+**要求**：
+1. 不要遗漏旧记忆中的关键信息（如用户身份、过去的重大事件）。
+2. 将新对话中的关键进展（好感度变化、承诺、发生的事件、约定的事）补充进去。
+3. 如果新旧信息有冲突，以【新对话】为准。
+4. 字数控制在 500 字以内，采用第三人称叙述。
+"""
+        return dict(
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=600,
+            temperature=0.5
+        )
+
+
+class AsyncBrain(Brain):
+    """
+    ⚡ 异步大脑：基于 AsyncOpenAI，调用 LLM 时不会卡住事件循环
+    - 每次调用都有超时 (超时即取消请求，走兜底)
+    - 全局并发上限，主对话 / 自言自语 / 升级感言 / 后台提取 互不阻塞
+    - 任务被 cancel() 时，底层 HTTP 请求一并取消
+    同步版方法 (继承自 Brain) 保留，供非异步的代码路径使用。
+    """
+
+    def __init__(self, timeout=LLM_TIMEOUT, max_concurrency=LLM_MAX_CONCURRENCY):
+        super().__init__()
+        self.async_client = AsyncOpenAI(
+            api_key=DEEPSEEK_API_KEY,
+            base_url="https://api.deepseek.com"
+        )
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _achat(self, timeout=None, label=None, **request):
+        """异步调用 LLM，返回回复文本 (排队等并发名额的时间不计入超时)"""
+        async with self._semaphore:
+            start = time.perf_counter()
+            response = await asyncio.wait_for(
+                self.async_client.chat.completions.create(model="deepseek-chat", **request),
+                timeout=timeout or self.timeout
             )
-            content = response.choices[0].message.content.strip()
-            # 防止偶尔返回 markdown 代码块
-            content = content.replace("```json", "").replace("```", "")
-            return json.loads(content)  # 返回字典对象
+        self._record_usage(label, response.usage, latency_ms=(time.perf_counter() - start) * 1000)
+        return response.choices[0].message.content
+
+    async def unified_decision_maker_async(self, user_text, current_state_dict, sentiment_injection,
+                                           history_str, memory_long_term, memory_global,
+                                           relationship_info, social_context, related_memories="",
+                                           last_chat_info="", rag_context=""):
+        request, fallback_state = self._build_decision_request(
+            user_text, current_state_dict, sentiment_injection, history_str, memory_long_term,
+            memory_global, relationship_info, social_context, related_memories, last_chat_info, rag_context
+        )
+        try:
+            return self._parse_decision(await self._achat(label="决策", **request), fallback_state)
+        except asyncio.TimeoutError:
+            print(f"🧠 [决策超时] 超过 {self.timeout}s 未响应")
+            return self._decision_fallback(fallback_state)
         except Exception as e:
-            print(f"⚠️ 结构化日记生成失败: {e}")
-            return None
\ No newline at end of file
+            print(f"🧠 [决策失败] {e}")
+            return self._decision_fallback(fallback_state)
+
+    async def generate_dynamic_welcome_async(self, memory_mgr, current_mood, current_energy, current_activity,
+                                             current_location):
+        try:
+            request = self._build_welcome_request(memory_mgr, current_mood, current_energy,
+                                                  current_activity, current_location)
+            if request is None: return None
+            return (await self._achat(**request)).strip()
+        except Exception as e:
+            print(f"⚠️ 欢迎语生成失败: {e!r}")
+            return None
+
+    async def extract_social_gossip_async(self, text, current_user, known_users):
+        """网络错误 / 超时直接抛出 (后台任务队列会重试)；返回 (None, []) 只代表模型没找到八卦"""
+        request, target = self._build_gossip_request(text, current_user, known_users)
+        content = await self._achat(**request)
+        try:
+            return self._parse_gossip(content.strip(), current_user, target)
+        except Exception:
+            return None, []
+
+    async def summarize_memory_async(self, history_chunk, current_summary):
+        try:
+            return await self._achat(**self._build_summarize_memory_request(history_chunk, current_summary))
+        except Exception:
+            return current_summary
+
+    async def extract_public_event_async(self, history_chunk, username):
+        """网络错误 / 超时直接抛出 (后台任务队列会重试)；返回 None 只代表没有值得记录的事件"""
+        content = await self._achat(**self._build_public_event_request(history_chunk, username))
+        try:
+            return self._parse_public_event(content)
+        except Exception as e:
+            print(f"⚠️ 提取公共事件失败: {e!r}")
+            return None
+
+    async def summarize_global_diary_async(self, old_entries, current_summary):
+        try:
+            return (await self._achat(**self._build_global_diary_request(old_entries, current_summary))).strip()
+        except Exception as e:
+            print(f"⚠️ 日记整理失败: {e!r}")
+            return current_summary
+
+    async def extract_important_fact_async(self, text, username):
+        """网络错误 / 超时直接抛出 (后台任务队列会重试)；返回 None 只代表没有重要事实"""
+        content = await self._achat(**self._build_important_fact_request(text, username))
+        try:
+            return self._parse_important_fact(content)
+        except Exception:
+            return None
+
+    async def generate_structured_diary_async(self, username, start_time, end_time, history):
+        if not history: return None
+        try:
+            request = self._build_structured_diary_request(username, start_time, end_time, history)
+            return self._parse_structured_diary(await self._achat(**request))
+        except Exception as e:
+            print(f"⚠️ 结构化日记生成失败: {e!r}")
+            return None
+
+    async def merge_memory_summary_async(self, username, current_summary, history):
+        try:
+            return await self._achat(**self._build_summary_merge_request(username, current_summary, history))
+        except Exception as e:
+            print(f"⚠️ 记忆融合失败: {e!r}")
+            return None
+
+    async def unified_decision_maker_stream(self, text_queue, user_text, current_state_dict, sentiment_injection,
+                                            history_str, memory_long_term, memory_global,
+                                            relationship_info, social_context, related_memories="",
+                                            last_chat_info="", rag_context=""):
+        """
+        🌊 流式统一决策：reply_text 一边生成一边放进 text_queue (结束时放入 None)，
+        供 AudioManager.speak_stream 边收边合成；流结束后返回完整的决策结果 (含 next_state)
+        """
+        request, fallback_state = self._build_decision_request(
+            user_text, current_state_dict, sentiment_injection, history_str, memory_long_term,
+            memory_global, relationship_info, social_context, related_memories, last_chat_info, rag_context
+        )
+        parser = ReplyTextStreamParser()
+        try:
+            result = None
+            try:
+                async with self._semaphore:
+                    start, first_token_ms = time.perf_counter(), None
+                    stream = await asyncio.wait_for(
+                        self.async_client.chat.completions.create(
+                            model="deepseek-chat", stream=True,
+                            stream_options={"include_usage": True},  # 最后一个 chunk 带上 usage (缓存命中数)
+                            **request
+                        ),
+                        timeout=self.timeout
+                    )
+                    try:
+                        while True:
+                            # 超时按 "多久没有新 token" 计算，长回复不会被误杀
+                            try:
+                                chunk = await asyncio.wait_for(anext(stream), timeout=self.timeout)
+                            except StopAsyncIteration:
+                                break
+                            if getattr(chunk, "usage", None):
+                                self._record_usage("决策", chunk.usage, first_token_ms,
+                                                   (time.perf_counter() - start) * 1000)
+                            if not chunk.choices: continue
+                            content = chunk.choices[0].delta.content or ""
+                            if content and first_token_ms is None:
+                                first_token_ms = (time.perf_counter() - start) * 1000
+                            delta = parser.feed(content)
+                            if delta: text_queue.put_nowait(delta)
+                    finally:
+                        await stream.close()
+                result = self._parse_decision(parser.buffer, fallback_state)
+            except asyncio.TimeoutError:
+                print(f"🧠 [决策超时] 超过 {self.timeout}s 没有新内容")
+            except Exception as e:
+                print(f"🧠 [决策失败] {e}")
+
+            if result is None:
+                result = self._decision_fallback(fallback_state)
+                # 已经念出去的半句话不能收回，就以它为准
+                if parser.text: result["reply_text"] = parser.text
+            if not parser.text:
+                text_queue.put_nowait(result["reply_text"])
+            return result
+        finally:
+            text_queue.put_nowait(None)
@@ -108,8 +108,69 @@ DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 if not DEEPSEEK_API_KEY:
     raise ValueError("⚠️ 错误：未找到 DEEPSEEK_API_KEY！请检查 .env 文件。")
 
+# 单次 LLM 请求的超时时间 (秒)，超时后取消请求并走兜底回复
+LLM_TIMEOUT = 30
+# 同时进行的 LLM 请求上限 (主对话 + 自言自语 + 升级感言 + 后台提取共享)
+LLM_MAX_CONCURRENCY = 3
+# 统一决策提示词的输入预算 (估算 token)：超出时按优先级裁剪/丢弃次要的记忆段落
+# 人设和指令放在固定的 system 前缀里 (能命中 DeepSeek 前缀缓存)，不参与裁剪，但计入预算
+PROMPT_INPUT_BUDGET = 10000
+# 保留最近多少次 LLM 调用的缓存命中记录 (用来核对缓存对首字耗时的影响)
+USAGE_LOG_SIZE = 200
+# 退出归档时每个 LLM 调用 (日记 / 散场新闻 / 记忆融合) 最多等多久 (秒，含排队)，三者同时进行
+ARCHIVE_TIMEOUT = 45
+
 # 用户停止输入多久后，系统才认为这一句“说完了”并开始回复 (单位: 秒)
+# 这是上限：系统会根据用户的打字节奏自动缩短，但不会低于 INPUT_TIMEOUT_MIN
 INPUT_TIMEOUT = 3
+INPUT_TIMEOUT_MIN = 0.8
+# 投机预处理：用户还在打字时就提前检索记忆、组装上下文；开启后连 LLM 也提前调用 (输入变了会取消重来，多花 token)
+SPECULATIVE_LLM = False
+
+# ================= 💾 存储配置 =================
+# 日记写回间隔 (秒)：这段时间内的所有修改合并成一次写盘
+DIARY_FLUSH_INTERVAL = 2.0
+# 全局状态 (心情/精力/活动) 写回间隔 (秒)：心情精力的自然变化读取时按时间推算，不再每秒写盘
+GLOBAL_STATE_FLUSH_INTERVAL = 5.0
+
+# 日记分层汇总：昨天及更早的个人日记在后台压成 日 -> 周 -> 月 汇总，提示词只读汇总；
+# 原文不删 (JSON 后端移到 saves/diary_archive/，SQLite 后端留在表里)，RAG 照样能检索
+ROLLUP_KEEP_MONTHS = 6  # 月汇总保留几个月，更早的并入一条"更早"的总结
+ROLLUP_DIRECT_CHARS = 80  # 只有一条且不超过这么多字时直接当汇总，不调 LLM
+
+# 记忆存储后端: "json" (saves/*.json) 或 "sqlite" (saves/furina.db，首次启动自动从 JSON 迁移)
+MEMORY_BACKEND = "json"
+
+# 后台任务队列 (八卦/性别/重要事实/公共事件提取)：回复之后排队慢慢做，退出时没做完的下次登录继续
+JOB_QUEUE_DIR = os.path.join(SAVES_DIR, "jobs")
+JOB_WORKERS = 2  # 同时执行的任务数
+JOB_MAX_RETRIES = 2  # 失败后最多重试几次
+JOB_DRAIN_TIMEOUT = 5  # 退出时最多等这么久 (秒)，剩下的留到下次
+
+# 滚动记忆总结：聊天停顿时把新对话陆续融合进长期记忆，退出时只需处理最后几条
+SUMMARY_FOLD_MESSAGES = 12  # 攒够这么多条新记录才融合一次
+SUMMARY_FOLD_MAX_MESSAGES = 40  # 单次融合最多带多少条 (控制提示词长度)
+SUMMARY_IDLE_DELAY = 20  # 停顿多久 (秒) 算空闲，可以在后台融合
+
+# ================= 🔊 语音合成配置 =================
+# 同时向 GPT-SoVITS 发出的合成请求上限：第 1 句播放时，后面几句已经在合成
+TTS_MAX_INFLIGHT = 2
+
+# 合成结果缓存 (同一句话 + 同一参考音频 + 同一语速 只合成一次)
+TTS_CACHE_DIR = os.path.join(SAVES_DIR, "tts_cache")
+TTS_CACHE_MAX_MB = 200  # 磁盘缓存上限，超出后淘汰最久没用过的
+TTS_CACHE_HOT_ITEMS = 32  # 常驻内存的条数
+
+# 垫场语音：等回复超过这么久 (秒) 还没声音，就先"嗯……"一声并做思考的眼神
+FILLER_DELAY = 0.8
+FILLER_PHRASES = ["嗯……", "哼，让我想想……", "唔……这个嘛……", "等一下哦……"]
+FILLER_FADE_MS = 150  # 正式回复开始时垫场语音的淡出时长
+
+# ================= 🎭 VTS 配置 =================
+# 等待 VTS 回应单个请求的超时时间 (秒)
+VTS_REQUEST_TIMEOUT = 5
+# 参数注入帧率：眼球 / 嘴型 / 面部角度等参数合并成一帧，按这个频率发送 (没变化的帧跳过)
+VTS_PARAM_FPS = 30
 
 
 # ================= 📜 动态人设加载系统 =================
@@ -344,8 +405,10 @@ SEMANTIC_ACTIONS = {
     "走路": "走路",
 }
 
-# 动作冷却时间 (秒)
+# 动作冷却时间 (秒)：同一个热键在这段时间内重复触发会被忽略
 ACTION_COOLDOWN = 10.0
+# 全局动作间隔 (秒)：任意两个动作之间至少间隔这么久 (回复自带的情绪动作不受限)
+ACTION_GLOBAL_COOLDOWN = 3.0
 
 # ================= 🖼️ 场景背景映射 =================
 # 格式: "关键词": "放入VTS Backgrounds文件夹的完整文件名"
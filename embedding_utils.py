@@ -0,0 +1,144 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+# 🔥🔥🔥 核心修复：设置 HF 镜像，解决国内无法下载模型的问题 🔥🔥🔥
+# 必须在导入 sentence_transformers 之前设置
+os.environ["HF_ENDPOINT"] = "https://hf-mirror.com"
+
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# 合批窗口 (秒)：收到第一个请求后，再等这么久把同时到达的请求拼成一批
+EMBED_BATCH_WINDOW = 0.005
+
+
+class EmbeddingService:
+    """
+    🧠 进程内唯一的语义向量服务 (记忆 RAG 与情绪映射共用一个模型)
+    - 懒加载：第一次用到时才加载模型
+    - 合批：并发到达的 encode 请求合并成一次前向计算
+    - 计时：加载耗时打印出来，编码耗时只记进 stats (每句都打印会刷屏)
+    - available / encode 都可能阻塞 (加载模型、等待合批结果)，事件循环里要放到线程里调用
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL_NAME, batch_window=EMBED_BATCH_WINDOW):
+        self.model_name = model_name
+        self.batch_window = batch_window
+        self._model = None
+        self._load_failed = False
+        self._load_lock = threading.Lock()
+        self._worker_lock = threading.Lock()
+        self._requests = queue.Queue()
+        self._worker = None
+        self.stats = {"load_seconds": 0.0, "batches": 0, "requests": 0, "texts": 0, "encode_seconds": 0.0,
+                      "last_encode_ms": 0.0}
+
+    # ================= 📦 模型加载 =================
+    def _get_model(self):
+        if self._model is not None or self._load_failed: return self._model
+
+        with self._load_lock:
+            if self._model is not None or self._load_failed: return self._model
+
+            print(f"🧠 [向量服务] 正在加载语义模型 ({self.model_name})...")
+            start = time.perf_counter()
+            try:
+                from sentence_transformers import SentenceTransformer
+                # 第一次运行会自动从镜像站下载约 470MB 的模型文件
+                self._model = SentenceTransformer(self.model_name)
+                self.stats["load_seconds"] = time.perf_counter() - start
+                print(f"✅ [向量服务] 模型加载完毕！耗时 {self.stats['load_seconds']:.2f}s")
+            except ImportError:
+                print("⚠️ [向量服务] 未检测到 sentence-transformers 库，语义功能将降级。")
+                print("👉 建议运行: pip install sentence-transformers")
+                self._load_failed = True
+            except Exception as e:
+                print(f"⚠️ [向量服务] 模型加载失败: {e}")
+                print("💡 提示：如果是网络问题，请检查是否已配置 HF_ENDPOINT 镜像。")
+                self._load_failed = True
+        return self._model
+
+    @property
+    def available(self):
+        """模型是否可用 (会触发懒加载)"""
+        return self._get_model() is not None
+
+    def warmup(self):
+        """在后台线程提前加载模型，避免第一次使用时卡住主流程"""
+        threading.Thread(target=self._get_model, name="embedding-warmup", daemon=True).start()
+
+    # ================= 🔢 编码 =================
+    def encode(self, texts):
+        """
+        编码文本为归一化向量 (点积即余弦相似度)
+        :param texts: 单个字符串或字符串列表
+        :return: 单个字符串返回 (dim,)，列表返回 (n, dim) 的 float32 数组
+        """
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        if not self.available: raise RuntimeError("语义模型不可用")
+        if not batch: return np.zeros((0, 0), dtype=np.float32)
+
+        future = Future()
+        self._requests.put((batch, future))
+        self._ensure_worker()
+        vectors = future.result()
+        return vectors[0] if single else vectors
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive(): return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            pending = [self._requests.get()]
+            # 稍等片刻，把同一时刻其他调用方的请求一起带上
+            time.sleep(self.batch_window)
+            while True:
+                try:
+                    pending.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            all_texts = [t for texts, _ in pending for t in texts]
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(
+                    self._model.encode(all_texts, convert_to_numpy=True, normalize_embeddings=True),
+                    dtype=np.float32
+                )
+            except Exception as e:
+                for _, future in pending: future.set_exception(e)
+                continue
+            cost = time.perf_counter() - start
+
+            self.stats["batches"] += 1
+            self.stats["requests"] += len(pending)
+            self.stats["texts"] += len(all_texts)
+            self.stats["encode_seconds"] += cost
+            self.stats["last_encode_ms"] = cost * 1000
+
+            offset = 0
+            for texts, future in pending:
+                future.set_result(vectors[offset:offset + len(texts)])
+                offset += len(texts)
+
+
+_SERVICE = None
+_SERVICE_LOCK = threading.Lock()
+
+
+def get_embedding_service():
+    """获取进程内共享的向量服务 (单例)"""
+    global _SERVICE
+    if _SERVICE is None:
+        with _SERVICE_LOCK:
+            if _SERVICE is None:
+                _SERVICE = EmbeddingService()
+    return _SERVICE
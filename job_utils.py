@@ -0,0 +1,118 @@
+import asyncio
+import uuid
+from config import JOB_WORKERS, JOB_MAX_RETRIES
+from storage_utils import JsonlJournal
+
+
+class BackgroundJobQueue:
+    """
+    🧵 持久化的后台任务队列 (八卦提取、事实记录之类不影响当前回复的活)
+    - 提交：先追加到日志再入队，进程退出也不会丢
+    - 执行：固定数量的 worker 并发处理，失败按次数重试
+    - 恢复：启动时回放日志，把上次没做完的任务重新排上
+    """
+
+    def __init__(self, path, workers=JOB_WORKERS, max_retries=JOB_MAX_RETRIES):
+        self.journal = JsonlJournal(path)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.handlers = {}
+        self._queue = asyncio.Queue()
+        self._tasks = []
+        self.stats = {"done": 0, "failed": 0, "retried": 0, "resumed": 0}
+
+    def register(self, kind, handler):
+        """登记任务类型：handler 是 async 函数，参数即提交时的关键字参数"""
+        self.handlers[kind] = handler
+
+    def submit(self, kind, **args):
+        job = {"id": uuid.uuid4().hex[:12], "kind": kind, "args": args, "attempts": 0}
+        try:
+            self.journal.append(dict(job, op="add"))
+        except Exception as e:
+            print(f"⚠️ [后台任务] 写入任务日志失败 (本次仍会执行): {e}")
+        self._queue.put_nowait(job)
+        return job["id"]
+
+    def _recover(self):
+        """回放日志：留下已提交但没完成的任务，并把日志压缩成只剩它们"""
+        pending = {}
+        for record in self.journal.replay():
+            if record.get("op") == "add":
+                pending[record["id"]] = {k: record[k] for k in ("id", "kind", "args") if k in record}
+                pending[record["id"]]["attempts"] = 0
+            elif record.get("op") == "done":
+                pending.pop(record.get("id"), None)
+
+        self.journal.truncate()
+        for job in pending.values():
+            self.journal.append(dict(job, op="add"))
+            self._queue.put_nowait(job)
+        if pending:
+            self.stats["resumed"] = len(pending)
+            print(f"🧵 [后台任务] 恢复了 {len(pending)} 个上次没做完的任务")
+
+    def start(self):
+        self._recover()
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"job-worker-{i}"))
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            print(f"⚠️ [后台任务] 未知任务类型 {job['kind']}，已丢弃")
+            self._mark_done(job)
+            return
+        while True:
+            try:
+                await handler(**job["args"])
+                break
+            except asyncio.CancelledError:
+                raise  # 退出时被取消：日志里仍是未完成，下次启动继续
+            except Exception as e:
+                job["attempts"] += 1
+                if job["attempts"] > self.max_retries:
+                    self.stats["failed"] += 1
+                    print(f"❌ [后台任务] {job['kind']} 重试 {self.max_retries} 次仍失败，放弃: {e!r}")
+                    self._mark_done(job)
+                    return
+                self.stats["retried"] += 1
+                delay = 2 ** job["attempts"]
+                print(f"⚠️ [后台任务] {job['kind']} 失败 ({e!r})，{delay}s 后重试")
+                # 在 worker 里等：重试中的任务仍算"没做完"，drain() 不会提前返回
+                await asyncio.sleep(delay)
+        self.stats["done"] += 1
+        self._mark_done(job)
+
+    def _mark_done(self, job):
+        try:
+            self.journal.append({"op": "done", "id": job["id"]})
+        except Exception as e:
+            print(f"⚠️ [后台任务] 写入任务日志失败: {e}")
+
+    async def drain(self, timeout):
+        """等队列里的任务做完 (最多 timeout 秒)，worker 不停；返回是否全部做完"""
+        if not self._tasks: return self._queue.empty()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            print("🧵 [后台任务] 还有任务没做完，下次启动继续")
+            return False
+
+    async def close(self, timeout=0):
+        """等队列里的任务做完 (最多 timeout 秒)，没做完的留在日志里下次继续"""
+        if timeout: await self.drain(timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.journal.close()
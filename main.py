@@ -17,38 +17,93 @@ os.environ["NO_PROXY"] = "127.0.0.1,localhost"
 
 from config import (
     ACTIONS, SOVITS_ROOT, VTS_EXE_PATH, SOVITS_API_URL, VTS_PORT,
-    INPUT_TIMEOUT, DEFAULT_BACKGROUND, SCENE_MAP
+    INPUT_TIMEOUT, INPUT_TIMEOUT_MIN, SPECULATIVE_LLM, DEFAULT_BACKGROUND, SCENE_MAP,
+    JOB_QUEUE_DIR, JOB_DRAIN_TIMEOUT, SUMMARY_IDLE_DELAY
 )
 from vts_utils import VTSController
 from audio_utils import AudioManager
-from brain_utils import Brain
-from memory_utils import MemoryManager
+from brain_utils import AsyncBrain
+from memory_utils import create_memory_manager
 from sentiment_utils import SentimentEngine
+from embedding_utils import get_embedding_service
+from job_utils import BackgroundJobQueue
 
 # ================= ⚙️ 全局变量 =================
 CURRENT_SPEAK_TASK = None
 last_interaction_time = time.time()
 global_memory_mgr = None
+IDLE_WAKE_EVENT = asyncio.Event()  # 有互动时叫醒闲置监控
 
 
 # ================= 📨 输入缓冲管理器 =================
 class InputBufferManager:
-    def __init__(self, timeout=1.5):
+    """
+    📨 输入缓冲 (事件驱动)
+    - 每收到一段碎片就重启防抖计时器，静默期一结束立刻把整句放进 turns 队列，不再轮询
+    - 静默期随用户打字节奏自适应：碎片之间间隔的指数滑动平均 × 1.5，限制在 [min_timeout, timeout]
+    - 正在处理上一句时，新碎片先攒着，处理完再判断
+    """
+    CADENCE_ALPHA = 0.3  # 滑动平均里新样本的权重
+
+    def __init__(self, timeout=1.5, min_timeout=0.8, cadence=None, on_fragment=None):
         self.buffer = []
-        self.last_time = 0
-        self.timeout = timeout
-        self.is_processing = False
+        self.on_fragment = on_fragment  # 每收到一段碎片时回调 (参数为目前攒下的整句)
+        self.max_timeout = timeout
+        self.min_timeout = min_timeout
+        # 碎片间隔的滑动平均；没有历史数据时从上限起步
+        self.cadence = cadence if cadence is not None else (timeout - 0.3) / 1.5
+        self.turns = asyncio.Queue()
+        self._is_processing = False
+        self._timer = None
+        self._ready = False  # 静默期已到，但正在处理上一句
+        self._last_fragment = 0.0
+
+    @property
+    def timeout(self):
+        return max(self.min_timeout, min(self.max_timeout, self.cadence * 1.5 + 0.3))
+
+    @property
+    def is_processing(self):
+        return self._is_processing
+
+    @is_processing.setter
+    def is_processing(self, value):
+        self._is_processing = value
+        if not value and self._ready:
+            self._ready = False
+            self._fire()
 
     def add_message(self, text):
         if not text.strip(): return
+        now = time.monotonic()
+        if self._last_fragment:
+            # 间隔不长：同一句话被拆成了几段 (或上一句触发得太早)，按实际间隔学习；
+            # 间隔很长：说明上一句确实说完了，作为"打字很利索"的样本把静默期往下拉
+            gap = now - self._last_fragment
+            sample = gap if gap < self.max_timeout * 2 else 0.0
+            self.cadence += self.CADENCE_ALPHA * (sample - self.cadence)
+        self._last_fragment = now
+
         self.buffer.append(text)
-        self.last_time = time.time()
         print(f"👂 (收到碎片: {text}...)")
+        if self.on_fragment and not self._is_processing:
+            self.on_fragment("，".join(self.buffer))
+
+        # 重启防抖计时器
+        if self._timer: self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self.timeout, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        if not self.buffer: return
+        if self._is_processing:
+            self._ready = True
+            return
+        self.turns.put_nowait(self.pop_full_message())
 
-    def has_finished_speaking(self):
-        if not self.buffer: return False
-        if self.is_processing: return False
-        return (time.time() - self.last_time) > self.timeout
+    async def next_turn(self):
+        """等待下一句完整的输入"""
+        return await self.turns.get()
 
     def pop_full_message(self):
         if not self.buffer: return None
@@ -57,6 +112,188 @@ class InputBufferManager:
         return full_text
 
 
+# ================= 🔮 投机预处理 =================
+class SpeculativeTurn:
+    """
+    🔮 用户还在打字时，先按已收到的碎片准备这一轮 (检索记忆、组装上下文，可选提前调用 LLM)
+    - 每来一段新碎片：取消旧的，按新文本重来
+    - 整句到达：文本完全一致才复用，否则丢弃
+    """
+
+    def __init__(self, prepare):
+        self.prepare = prepare  # async (text) -> 准备结果
+        self.text = None
+        self.task = None
+        self.stats = {"hits": 0, "misses": 0, "restarts": 0}
+
+    def restart(self, text):
+        if self.task and self.text == text: return
+        if self.task: self.stats["restarts"] += 1
+        self.cancel()
+        self.text = text
+        self.task = asyncio.create_task(self.prepare(text))
+
+    def cancel(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.text = None
+
+    async def take(self, text):
+        """取出与 text 对应的准备结果 (没有或已失效返回 None)"""
+        task, spec_text = self.task, self.text
+        self.task, self.text = None, None
+        if task is None or spec_text != text:
+            if task: task.cancel()
+            self.stats["misses"] += 1
+            return None
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not task.cancelled(): raise  # 是当前协程自己被取消
+            result = None
+        except Exception as e:
+            print(f"⚠️ [投机] 预处理失败: {e}")
+            result = None
+        self.stats["hits" if result else "misses"] += 1
+        return result
+
+
+class RollingSummarizer:
+    """
+    🧶 聊天停顿 SUMMARY_IDLE_DELAY 秒后，在后台把新对话融合进长期记忆
+    每轮对话结束时 poke() 一下重新计时；退出归档前 close()，由归档接手剩下的部分
+    """
+
+    def __init__(self, brain, memory_mgr, idle_delay=SUMMARY_IDLE_DELAY):
+        self.brain = brain
+        self.memory_mgr = memory_mgr
+        self.idle_delay = idle_delay
+        self._timer = None
+        self.task = None
+
+    def poke(self):
+        if self._timer: self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self.idle_delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        if self.task and not self.task.done(): return
+        self.task = asyncio.create_task(self._fold())
+
+    async def _fold(self):
+        try:
+            await self.memory_mgr.fold_summary(self.brain)
+        except Exception as e:
+            print(f"⚠️ [记忆] 滚动总结失败: {e}")
+
+    async def close(self):
+        if self._timer: self._timer.cancel()
+        if self.task and not self.task.done():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+def _history_marker(memory_mgr):
+    """对话记录的版本标记：预处理之后记录有变化 (比如她自言自语了一句)，结果就作废"""
+    history = memory_mgr.data.get("chat_history", [])
+    return len(history), (history[-1].get("content") if history else None)
+
+
+async def prepare_turn(user_input, username, brain, memory_mgr, sentiment_engine, verbose=True, with_llm=False):
+    """
+    组装这一轮统一决策需要的全部上下文 (状态快照、记忆、关系、联想、RAG)
+    :return: {"context": 决策参数, "marker": 对话记录版本, "decision_task": 提前发起的 LLM 调用或 None}
+    """
+    log = print if verbose else (lambda *args, **kwargs: None)
+    marker = _history_marker(memory_mgr)
+    current_user_state = memory_mgr.get_user_state_obj()
+
+    # 1. 准备所有状态 (心情、地点、精力)
+    g_state = sentiment_engine.get_global_state()
+    current_snapshot = {
+        "location": g_state.get("current_location", "卧室"),
+        "activity": g_state.get("current_activity", "发呆"),
+        "item": g_state.get("current_item", "无"),
+        "energy": g_state["energy"],
+        "mood": g_state["mood"]
+    }
+
+    history_str = memory_mgr.get_formatted_history(limit=20)
+    memory_long_term = memory_mgr.data.get("summary", "暂无特殊回忆")
+    memory_global = memory_mgr.get_global_activity_log(limit=5)
+
+    # 🔥🔥🔥 V35.2 新增：提取关系与八卦数据 🔥🔥🔥
+    # A. 获取好感度描述 (标题+基础态度)
+    rel_title, rel_base_desc = memory_mgr.get_relationship_base_desc()
+    user_aff = current_user_state.affection
+
+    # 组装关系字符串
+    relationship_info_str = f"""
+                            - 名字: {username}
+                            - 好感度: {user_aff}
+                            - 等级: 【{rel_title}】
+                            - 基础态度: {rel_base_desc}
+                            """
+
+    # B. 获取关于该用户的社交八卦
+    social_context_str = memory_mgr.get_social_context(username)
+
+    # 1. 获取所有认识的人的名单
+    all_contacts = memory_mgr.get_known_users()
+    found_contacts = []
+
+    # 2. 遍历名单，看用户这句“话”里有没有提到谁
+    for name in all_contacts:
+        # 排除自己，只查别人
+        if name in user_input and name != username:
+            memo = memory_mgr.get_person_brief(name)
+            if memo:
+                found_contacts.append(memo)
+                log(f"🔍 [联想] 芙芙想起了: {name}")
+
+    if found_contacts:
+        related_memories_str = "你忽然想起了关于这些人的记忆：\n" + "\n".join(found_contacts)
+    else:
+        related_memories_str = "（话语中未提及其他熟人）"
+
+    # 🔥🔥🔥 V37.0 新增：获取上次聊天情报 🔥🔥🔥
+    last_chat_info_str = memory_mgr.get_last_chat_info()
+    log(f"⏰ [记忆] 上次互动: {last_chat_info_str.replace(chr(10), ' | ')}")
+
+    rag_memories_str = ""
+    if len(user_input) > 2:
+        log("🔦 [记忆] 正在翻阅旧日记...")
+        # 向量检索放到线程里，不卡事件循环
+        rag_memories_str = await asyncio.to_thread(memory_mgr.search_relevant_memories, user_input)
+        if not rag_memories_str:
+            rag_memories_str = "(未找到相关往事)"
+
+    context = dict(
+        user_text=user_input,
+        current_state_dict=current_snapshot,
+        sentiment_injection="",
+        history_str=history_str,
+        memory_long_term=memory_long_term,
+        memory_global=memory_global,
+        relationship_info=relationship_info_str,
+        social_context=social_context_str,
+        related_memories=related_memories_str,
+        last_chat_info=last_chat_info_str,
+        rag_context=rag_memories_str
+    )
+    decision_task = None
+    if with_llm:
+        decision_task = asyncio.create_task(brain.unified_decision_maker_async(**context))
+        try:
+            # 整句确认前先等它跑完；期间被取消则连同 LLM 请求一起取消
+            await asyncio.shield(decision_task)
+        except asyncio.CancelledError:
+            decision_task.cancel()
+            raise
+    return {"context": context, "marker": marker, "decision_task": decision_task}
+
+
 # ================= 🕵️‍♂️ 工具函数 =================
 def is_process_running(process_name):
     try:
@@ -144,32 +381,98 @@ def emergency_save():
     if global_memory_mgr:
         print("\n🚨 [紧急存档] 检测到程序异常中断，正在尝试强制保存...")
         global_memory_mgr.save()
+        global_memory_mgr.flush()
         print("✅ [紧急存档] 数据已写回磁盘。")
 
 
 atexit.register(emergency_save)
 
 
+IDLE_START_TIME = 30
+PROACTIVE_TALK_THRESHOLD = 120  # 120秒不说话触发常规搭话
+IDLE_ACTION_INTERVAL = 15
+
+
+def mark_interaction():
+    """记录一次互动，并叫醒闲置监控重新计算下一个时间点"""
+    global last_interaction_time
+    last_interaction_time = time.time()
+    IDLE_WAKE_EVENT.set()
+
+
+async def cancel_task(task):
+    """取消后台任务并等它真正结束 (已经结束的也会取走它的异常，避免 "never retrieved" 警告)"""
+    if task is None: return
+    if not task.done(): task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def _sleep_until(deadline, speak_task=None):
+    """
+    睡到 deadline (None 表示不限时)，或被互动事件 / 语音结束提前叫醒
+    :return: 是否被提前叫醒 (睡到点返回 False)
+    """
+    waiter = asyncio.create_task(IDLE_WAKE_EVENT.wait())
+    waiters = [waiter]
+    if speak_task and not speak_task.done(): waiters.append(speak_task)
+    timeout = None if deadline is None else max(0.0, deadline - time.time())
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+    IDLE_WAKE_EVENT.clear()
+    return bool(done)
+
+
 # [main.py]
 # [main.py] 中的 monitor_idle_status 函数
 async def monitor_idle_status(vts, audio_mgr, brain, memory_mgr, sentiment_engine, input_mgr):
+    """
+    ⏰ 闲置监控 (事件驱动)：每轮检查完后算出下一个可能发生事情的时间点
+    (生活流切换 / 闲置动作 / 主动搭话 / 精力恢复到门槛)，睡到那时或被互动叫醒，闲着时几乎不占 CPU
+    """
     global last_interaction_time, CURRENT_SPEAK_TASK
 
-    IDLE_START_TIME = 30
-    PROACTIVE_TALK_THRESHOLD = 120  # 120秒不说话触发常规搭话
-
     last_idle_action_time = 0
     has_triggered_talk = False
     idle_talk_sequence = 0
 
     last_detected_activity = sentiment_engine.get_global_state().get("current_activity", "")
 
-    while True:
-        await asyncio.sleep(1)
+    def next_deadline():
+        """算出下一个可能发生事情的时间点 (生活流切换 / 闲置动作 / 主动搭话)"""
+        next_switch = sentiment_engine.next_auto_switch_time(last_interaction_time)
+        idle_action_at = max(last_interaction_time + IDLE_START_TIME, last_idle_action_time + IDLE_ACTION_INTERVAL)
+        energy_ok = sentiment_engine.global_state_mgr.energy_reach_time(20)
+        if energy_ok: idle_action_at = max(idle_action_at, energy_ok)
+        deadline = min(next_switch, idle_action_at + 0.01)
+        if not has_triggered_talk:
+            talk_at = last_interaction_time + PROACTIVE_TALK_THRESHOLD + 0.01
+            energy_ok = sentiment_engine.global_state_mgr.energy_reach_time(30)
+            if energy_ok: deadline = min(deadline, max(talk_at, energy_ok))
+        return max(deadline, time.time() + 0.5)  # 防止忙等
+
+    deadline = time.time() + 1
 
-        # 1. 忙碌跳过
+    while True:
+        # 1. 忙碌 / 正在说话：等它结束 (结束时算作一次互动)；有互动时也会被提前叫醒
         if input_mgr.is_processing:
+            await _sleep_until(None)
             last_interaction_time = time.time()
+            woken = True
+        elif CURRENT_SPEAK_TASK and not CURRENT_SPEAK_TASK.done():
+            await _sleep_until(None, CURRENT_SPEAK_TASK)
+            last_interaction_time = time.time()
+            woken = True
+        else:
+            woken = await _sleep_until(deadline)
+
+        if woken:
+            # 重新开始计时：搭话机会恢复，下一个时间点从这次互动算起 (不再睡到旧的 deadline)
+            idle_talk_sequence = 0
+            has_triggered_talk = False
+            last_detected_activity = sentiment_engine.get_global_state().get("current_activity", "")
+            deadline = next_deadline()
             continue
 
         # ================= 生活流自动切换 =================
@@ -187,14 +490,14 @@ async def monitor_idle_status(vts, audio_mgr, brain, memory_mgr, sentiment_engin
         current_energy = g_state["energy"]
         current_act = g_state.get("current_activity", "")  # 再次确认最新状态
 
-        # 3. 极低好感/精力不说话
+        # 3. 极低好感/精力不说话 (只等生活流切换或精力恢复)
         if user_state.affection <= -50 or current_energy < 10:
             last_detected_activity = current_act
-            continue
-
-        # 4. 正在说话跳过
-        if CURRENT_SPEAK_TASK and not CURRENT_SPEAK_TASK.done():
-            last_interaction_time = time.time()
+            deadline = sentiment_engine.next_auto_switch_time(last_interaction_time)
+            if user_state.affection > -50:
+                energy_ok = sentiment_engine.global_state_mgr.energy_reach_time(10)
+                if energy_ok: deadline = min(deadline, energy_ok)
+            deadline = max(deadline, time.time() + 0.5)
             continue
 
         # 5. 计算沉默时间
@@ -208,16 +511,15 @@ async def monitor_idle_status(vts, audio_mgr, brain, memory_mgr, sentiment_engin
             last_detected_activity = current_act
 
         # 6. 闲置动作 (VTS)
-        if idle_duration > IDLE_START_TIME and (now - last_idle_action_time) > 15:
+        if idle_duration > IDLE_START_TIME and (now - last_idle_action_time) > IDLE_ACTION_INTERVAL:
             if current_energy > 20:
-                safe_actions = list(ACTIONS.keys())
+                safe_actions = list(vts.action_ids.keys())  # 只挑当前模型真的有的动作
                 if safe_actions:
                     await vts.trigger_action(random.choice(safe_actions))
             last_idle_action_time = now
 
         # 7. 🔥 主动搭话逻辑 (防复读 + 报备式) 🔥
         should_talk = is_switched or (idle_duration > PROACTIVE_TALK_THRESHOLD and not has_triggered_talk)
-
         if should_talk:
             if current_energy >= 30:
                 idle_talk_sequence += 1
@@ -273,7 +575,7 @@ async def monitor_idle_status(vts, audio_mgr, brain, memory_mgr, sentiment_engin
                 try:
                     last_chat_info_str = memory_mgr.get_last_chat_info()
 
-                    decision_result = brain.unified_decision_maker(
+                    decision_result = await brain.unified_decision_maker_async(
                         user_text=user_text_simulated,
                         current_state_dict=current_snapshot,
                         sentiment_injection=injection,
@@ -313,7 +615,6 @@ async def monitor_idle_status(vts, audio_mgr, brain, memory_mgr, sentiment_engin
 
                         print(f"\n🎭 芙宁娜(主动): {final_text}")
                         memory_mgr.add_history("assistant", final_text)
-                        memory_mgr.save()
                         CURRENT_SPEAK_TASK = asyncio.create_task(audio_mgr.speak(final_text, vts))
                         print_status_prompt(memory_mgr.current_user, memory_mgr, sentiment_engine)
 
@@ -327,6 +628,41 @@ async def monitor_idle_status(vts, audio_mgr, brain, memory_mgr, sentiment_engin
                     # 出错也暂时重置，防止死循环刷报错
                     last_interaction_time = time.time()
 
+        # 8. ⏰ 算出下一个需要醒来的时间点
+        deadline = next_deadline()
+
+
+def register_memory_jobs(jobs, brain, memory_mgr):
+    """🧵 登记对话之后的后台记忆任务 (八卦与性别、重要事实、公共事件)"""
+
+    async def extract_social(username, user_input):
+        known_users = memory_mgr.get_known_users()
+        gossip, gender_list = await brain.extract_social_gossip_async(user_input, username, known_users)
+        if gossip:
+            t, r, c = gossip
+            memory_mgr.update_social_relation(username, t, r, c)
+            print(f"🕸️ [八卦] 记住了 {username} {r} {t}")
+        for name, gender in gender_list or []:
+            if gender in ("male", "female"):
+                memory_mgr.update_user_gender(name, gender)
+
+    async def extract_fact(username, text):
+        fact = await brain.extract_important_fact_async(text, username)
+        if fact:
+            print(f"📝 [记忆] 记录重要事实: {fact}")
+            # 强制追加到 summary 里，这样她永远不会忘！
+            memory_mgr.data["summary"] = memory_mgr.data.get("summary", "") + f"\n- {fact} ({time.strftime('%Y-%m-%d')})"
+            memory_mgr.save()
+
+    async def extract_public_event(username, history):
+        public_event = await brain.extract_public_event_async(history, username)
+        if public_event: memory_mgr.add_global_event(username, public_event)
+
+    jobs.register("social", extract_social)
+    jobs.register("fact", extract_fact)
+    jobs.register("public_event", extract_public_event)
+
+
 async def listen_loop(input_mgr, username):
     print("🎤 [系统] 监听服务已启动 (输入 'exit' 退出)...")
     while True:
@@ -341,25 +677,37 @@ async def listen_loop(input_mgr, username):
 
 # ================= 🎬 主程序 =================
 async def main():
-    global CURRENT_SPEAK_TASK, last_interaction_time, global_memory_mgr
+    global CURRENT_SPEAK_TASK, global_memory_mgr
 
     print("\n📚 === 芙宁娜的记忆殿堂 ===")
     username = input("请输入你的名字 (读取存档): ").strip()
     if not username: username = "旅行者"
 
+    # 🧠 语义模型在后台加载，和启动外部服务并行
+    get_embedding_service().warmup()
     launch_services()
 
     vts = VTSController(port=VTS_PORT)
     audio_mgr = AudioManager()
     # ❌ 删除了 BGMManager，防止报错
 
-    brain = Brain()
-    memory_mgr = MemoryManager()
+    brain = AsyncBrain()
+    memory_mgr = create_memory_manager()
     global_memory_mgr = memory_mgr
     sentiment_engine = SentimentEngine()
-    input_mgr = InputBufferManager(timeout=INPUT_TIMEOUT)
-
     memory_mgr.load_user(username)
+    # 🧵 后台记忆任务 (按用户分开存，上次没做完的这次登录接着做)
+    jobs = BackgroundJobQueue(os.path.join(JOB_QUEUE_DIR, f"{username}.jsonl"))
+    register_memory_jobs(jobs, brain, memory_mgr)
+    jobs.start()
+    summarizer = RollingSummarizer(brain, memory_mgr)
+    rollup_task = None  # 旧日记的分层汇总：第一轮对话结束后才在后台开始，不和开场抢 LLM 并发名额
+    # 🔮 打字期间就开始准备这一轮 (整句到达时文本一致才复用)
+    speculation = SpeculativeTurn(lambda text: prepare_turn(
+        text, username, brain, memory_mgr, sentiment_engine, verbose=False, with_llm=SPECULATIVE_LLM))
+    input_mgr = InputBufferManager(timeout=INPUT_TIMEOUT, min_timeout=INPUT_TIMEOUT_MIN,
+                                   cadence=memory_mgr.data.get("typing_cadence"),
+                                   on_fragment=speculation.restart)
     user_state = memory_mgr.get_user_state_obj()
     g_state = sentiment_engine.get_global_state()
 
@@ -384,7 +732,7 @@ async def main():
         welcome = f"[傲娇] 又是你啊，{username}。"
         if user_state.affection >= 300:
             print("🤔 (芙芙正在回忆上次聊了什么...)")
-            dynamic_welcome = brain.generate_dynamic_welcome(
+            dynamic_welcome = await brain.generate_dynamic_welcome_async(
                 memory_mgr, g_state['mood'], g_state['energy'], g_state.get('current_activity', '发呆'),
                 g_state.get('current_location', '家里')
             )
@@ -395,6 +743,7 @@ async def main():
         memory_mgr.add_history("assistant", welcome)
 
     CURRENT_SPEAK_TASK = asyncio.create_task(audio_mgr.speak(welcome, vts))
+    filler_task = asyncio.create_task(audio_mgr.prepare_fillers())  # 排在欢迎语之后，后台预合成垫场语音
 
     # 🔥🔥🔥 修复点：这里彻底删除了 bgm_mgr 参数，解决你的截图报错 🔥🔥🔥
     monitor_task = asyncio.create_task(
@@ -405,197 +754,141 @@ async def main():
 
     try:
         while True:
-            await asyncio.sleep(0.1)
-            memory_mgr.data["last_interaction_timestamp"] = time.time()
-
-            if input_mgr.has_finished_speaking():
-                user_input = input_mgr.pop_full_message()
-
-                # --- 🆕 新增：打断检测逻辑 (补全截图功能) ---
-                if CURRENT_SPEAK_TASK and not CURRENT_SPEAK_TASK.done():
-                    print("🛑 [系统] 检测到用户打断！")
+            # 静默期结束的那一刻就会拿到整句话
+            user_input = await input_mgr.next_turn()
+            memory_mgr.set_fields(last_interaction_timestamp=time.time(),
+                                  typing_cadence=round(input_mgr.cadence, 3))
 
-                    # 1. 物理打断：停止当前语音
-                    audio_mgr.stop()
-                    CURRENT_SPEAK_TASK.cancel()
+            # --- 🆕 新增：打断检测逻辑 (补全截图功能) ---
+            if CURRENT_SPEAK_TASK and not CURRENT_SPEAK_TASK.done():
+                print("🛑 [系统] 检测到用户打断！")
 
-                    # 2. 情感反应：获取生气/被打断的反应
-                    # check_blacklist_state 是黑名单，这里应该用 get_interruption_reaction
-                    mood_penalty, emo_icon, anger_reply = sentiment_engine.get_interruption_reaction()
+                # 1. 物理打断：停止当前语音 (预处理结果用不上了)
+                speculation.cancel()
+                audio_mgr.stop()
+                CURRENT_SPEAK_TASK.cancel()
 
-                    # 3. 输出反应
-                    print(f"{emo_icon} 芙宁娜(被打断): {anger_reply}")
-                    memory_mgr.add_history("assistant", anger_reply)  # 写入记忆，让她记得自己生气了
+                # 2. 情感反应：获取生气/被打断的反应
+                # check_blacklist_state 是黑名单，这里应该用 get_interruption_reaction
+                mood_penalty, emo_icon, anger_reply = sentiment_engine.get_interruption_reaction()
 
-                    # 4. 立即播放生气的语音
-                    CURRENT_SPEAK_TASK = asyncio.create_task(audio_mgr.speak(anger_reply, vts))
+                # 3. 输出反应
+                print(f"{emo_icon} 芙宁娜(被打断): {anger_reply}")
+                memory_mgr.add_history("assistant", anger_reply)  # 写入记忆，让她记得自己生气了
 
-                    # 5. 打印状态条并跳过本次正常的 AI 思考
-                    print_status_prompt(username, memory_mgr, sentiment_engine)
-                    last_interaction_time = time.time()
-                    input_mgr.is_processing = False
-                    continue  # <--- 跳过后续的 deepseek 思考，直接进入下一轮循环
-                # ---------------------------------------------
-
-                if user_input.lower() in ["quit", "exit", "退出", "再见", "拜拜"]:
-                    print("\n💾 [系统] 正在整理记忆并生成日记，请稍候...")
-                    # 这里的 brain 参数是主程序里初始化的那个 brain 对象
-                    memory_mgr.archive_session(brain)
-                    break
-
-                input_mgr.is_processing = True
-                last_interaction_time = time.time()
-                print(f"\n📝 [用户] {user_input}")
-
-                # ============================================
-                # 🚀 V35.0 核心：注入状态 + 统一决策 (优化延迟)
-                # ============================================
-
-                # ✅✅✅ 关键修复：在这里先获取 user_state，防止 UnboundLocalError ✅✅✅
-                current_user_state = memory_mgr.get_user_state_obj()
+                # 4. 立即播放生气的语音
+                CURRENT_SPEAK_TASK = asyncio.create_task(audio_mgr.speak(anger_reply, vts))
 
-                # 1. 准备所有状态 (心情、地点、精力)
-                g_state = sentiment_engine.get_global_state()
-                current_snapshot = {
-                    "location": g_state.get("current_location", "卧室"),
-                    "activity": g_state.get("current_activity", "发呆"),
-                    "item": g_state.get("current_item", "无"),
-                    "energy": g_state["energy"],
-                    "mood": g_state["mood"]
-                }
-
-                history_str = memory_mgr.get_formatted_history(limit=20)
-                memory_long_term = memory_mgr.data.get("summary", "暂无特殊回忆")
-                memory_global = memory_mgr.get_global_activity_log(limit=5)
-
-                # 🔥🔥🔥 V35.2 新增：提取关系与八卦数据 🔥🔥🔥
-                # A. 获取好感度描述 (标题+基础态度)
-                rel_title, rel_base_desc = memory_mgr.get_relationship_base_desc()
-                user_aff = current_user_state.affection  # ✅ 现在这里可以正常运行了
-
-                # 组装关系字符串
-                relationship_info_str = f"""
-                                - 名字: {username}
-                                - 好感度: {user_aff}
-                                - 等级: 【{rel_title}】
-                                - 基础态度: {rel_base_desc}
-                                """
-
-                # B. 获取关于该用户的社交八卦
-                social_context_str = memory_mgr.get_social_context(username)
-
-                related_memories_str = ""
-                # 1. 获取所有认识的人的名单
-                all_contacts = memory_mgr.get_known_users()
-                found_contacts = []
-
-                # 2. 遍历名单，看用户这句“话”里有没有提到谁
-                for name in all_contacts:
-                    # 排除自己，只查别人
-                    if name in user_input and name != username:
-                        memo = memory_mgr.get_person_brief(name)
-                        if memo:
-                            found_contacts.append(memo)
-                            print(f"🔍 [联想] 芙芙想起了: {name}")
-
-                if found_contacts:
-                    related_memories_str = "你忽然想起了关于这些人的记忆：\n" + "\n".join(found_contacts)
-                else:
-                    related_memories_str = "（话语中未提及其他熟人）"
-
-                    # ✅【修正后】逻辑跳出了 else，无论有没有提到人，都会执行下面的思考逻辑
-
-                    # 🔥🔥🔥 V37.0 新增：获取上次聊天情报 🔥🔥🔥
-                last_chat_info_str = memory_mgr.get_last_chat_info()
-                print(f"⏰ [记忆] 上次互动: {last_chat_info_str.replace(chr(10), ' | ')}")
-
-                rag_memories_str = ""
-                if len(user_input) > 2:
-                    print("🔦 [记忆] 正在翻阅旧日记...")
-                    rag_memories_str = memory_mgr.search_relevant_memories(user_input)
-                    if not rag_memories_str:
-                        rag_memories_str = "(未找到相关往事)"
-
-                # 3. 🧠 调用统一决策机
-                print("⏳ (芙宁娜正在思考与行动...)")
-                decision_result = brain.unified_decision_maker(
-                    user_text=user_input,
-                    current_state_dict=current_snapshot,
-                    sentiment_injection="",
-                    history_str=history_str,
-                    memory_long_term=memory_long_term,
-                    memory_global=memory_global,
-                    relationship_info=relationship_info_str,
-                    social_context=social_context_str,
-                    related_memories=related_memories_str,
-                    last_chat_info=last_chat_info_str,
-                    rag_context=rag_memories_str
-                )
-
-                final_text = decision_result["reply_text"]
-                print(
-                    f"🧠 [状态] {decision_result['next_state']['activity']} @ {decision_result['next_state']['location']}")
-
-                # 4. 后处理：更新数值
-                # [A] 记录旧的好感度
-                old_affection = current_user_state.affection
-
-                # [B] 执行更新
-                new_user_state, current_act = sentiment_engine.apply_decision_and_update(
-                    user_input,
-                    current_user_state,
-                    decision_result
-                )
-
-                # [C] 记录新的好感度
-                new_affection = new_user_state.affection
-
-                # [D] 强制更新最后活跃时间
-                import datetime
-                new_user_state.last_active_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-
-                memory_mgr.save_user_state(new_user_state)
-
-                # 5. 输出 & 播放
-                memory_mgr.add_history("assistant", final_text)
-                memory_mgr.save()
-                print(f"\r🎭 芙宁娜: {final_text}")
-
-                CURRENT_SPEAK_TASK = asyncio.create_task(audio_mgr.speak(final_text, vts))
-
-                # 🔥🔥🔥 [核心插入点] 检查等级变化 🔥🔥🔥
-                # 必须放在 speak 之后，利用异步任务去检查，不卡顿主流程
-                asyncio.create_task(handle_level_change(
-                    vts, audio_mgr, brain, memory_mgr,
-                    username,  # 传入当前的用户名
-                    old_affection,  # 旧好感
-                    new_affection  # 新好感
-                ))
-
-                # 6. 八卦提取 (异步不阻塞)
-                known_users = memory_mgr.get_known_users()
-                gossip, gender_list = brain.extract_social_gossip(user_input, username, known_users)
-                if gossip:
-                    t, r, c = gossip
-                    memory_mgr.update_social_relation(username, t, r, c)
-                    print(f"🕸️ [八卦] 记住了 {username} {r} {t}")
-
-                if "带回去" in user_input or "收养" in user_input:
-                    fact = brain.extract_important_fact(f"芙宁娜决定：{final_text}", username)
-                    if fact:
-                        print(f"📝 [记忆] 记录重要事实: {fact}")
-                        # 强制追加到 summary 里，这样她永远不会忘！
-                        memory_mgr.data["summary"] += f"\n- {fact} ({time.strftime('%Y-%m-%d')})"
-                        memory_mgr.save()
-                last_interaction_time = time.time()
-                input_mgr.is_processing = False
+                # 5. 打印状态条并跳过本次正常的 AI 思考
                 print_status_prompt(username, memory_mgr, sentiment_engine)
+                input_mgr.is_processing = False
+                mark_interaction()
+                continue  # <--- 跳过后续的 deepseek 思考，直接进入下一轮循环
+            # ---------------------------------------------
+
+            if user_input.lower() in ["quit", "exit", "退出", "再见", "拜拜"]:
+                print("\n💾 [系统] 正在整理记忆并生成日记，请稍候...")
+                speculation.cancel()
+                await cancel_task(rollup_task)  # 别让它占着 LLM 并发名额，归档的三个调用要马上发出去
+                await jobs.drain(JOB_DRAIN_TIMEOUT)  # 先让后台的事实提取写完 summary，归档再融合
+                await summarizer.close()  # 还没融合的部分交给归档一次处理
+                # 这里的 brain 参数是主程序里初始化的那个 brain 对象
+                await memory_mgr.archive_session(brain)
+                break
+
+            input_mgr.is_processing = True
+            mark_interaction()
+            print(f"\n📝 [用户] {user_input}")
+
+            # ============================================
+            # 🚀 V35.0 核心：注入状态 + 统一决策 (优化延迟)
+            # ============================================
+
+            # ✅✅✅ 关键修复：在这里先获取 user_state，防止 UnboundLocalError ✅✅✅
+            current_user_state = memory_mgr.get_user_state_obj()
+
+            # 1~2. 准备上下文：打字期间已按同样的文本预处理过就直接复用
+            prepared = await speculation.take(user_input)
+            if prepared and prepared["marker"] != _history_marker(memory_mgr):
+                if prepared["decision_task"]: prepared["decision_task"].cancel()
+                prepared = None  # 预处理之后对话记录变了，结果作废
+            if prepared:
+                print("⚡ [投机] 命中预处理结果，跳过记忆检索")
+            else:
+                prepared = await prepare_turn(user_input, username, brain, memory_mgr, sentiment_engine)
+
+            # 3. 🧠 调用统一决策机
+            print("⏳ (芙宁娜正在思考与行动...)")
+            # 回复边生成边念：每生成完一句就送去合成
+            reply_queue = asyncio.Queue()
+            CURRENT_SPEAK_TASK = asyncio.create_task(audio_mgr.speak_stream(reply_queue, vts, mask_latency=True))
+            if prepared["decision_task"]:
+                decision_result = await prepared["decision_task"]
+                reply_queue.put_nowait(decision_result["reply_text"])
+                reply_queue.put_nowait(None)
+            else:
+                decision_result = await brain.unified_decision_maker_stream(reply_queue, **prepared["context"])
+
+            final_text = decision_result["reply_text"]
+            print(
+                f"🧠 [状态] {decision_result['next_state']['activity']} @ {decision_result['next_state']['location']}")
+
+            # 4. 后处理：更新数值
+            # [A] 记录旧的好感度
+            old_affection = current_user_state.affection
+
+            # [B] 执行更新
+            new_user_state, current_act = sentiment_engine.apply_decision_and_update(
+                user_input,
+                current_user_state,
+                decision_result
+            )
+
+            # [C] 记录新的好感度
+            new_affection = new_user_state.affection
+
+            # [D] 强制更新最后活跃时间
+            import datetime
+            new_user_state.last_active_date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+
+            memory_mgr.save_user_state(new_user_state)
+
+            # 5. 输出 & 播放
+            memory_mgr.add_history("assistant", final_text)
+            print(f"\r🎭 芙宁娜: {final_text}")
+
+            # 🔥🔥🔥 [核心插入点] 检查等级变化 🔥🔥🔥
+            # 必须放在 speak 之后，利用异步任务去检查，不卡顿主流程
+            asyncio.create_task(handle_level_change(
+                vts, audio_mgr, brain, memory_mgr,
+                username,  # 传入当前的用户名
+                old_affection,  # 旧好感
+                new_affection  # 新好感
+            ))
+
+            # 6. 八卦 / 重要事实提取 (排进后台任务队列，不阻塞下一轮对话，退出也不会丢)
+            jobs.submit("social", username=username, user_input=user_input)
+            if "带回去" in user_input or "收养" in user_input:
+                jobs.submit("fact", username=username, text=f"芙宁娜决定：{final_text}")
+            await memory_mgr.compress_memory_if_needed(brain, jobs)
+            summarizer.poke()
+            if rollup_task is None:
+                rollup_task = asyncio.create_task(memory_mgr.compress_global_diary_if_needed(brain))
+            input_mgr.is_processing = False
+            mark_interaction()
+            print_status_prompt(username, memory_mgr, sentiment_engine)
 
     except KeyboardInterrupt:
         print("\n🛑 强制退出...")
     finally:
+        # 日记汇总做到一半也没关系：已经合好的层都落盘了，剩下的下次启动接着做
+        await cancel_task(rollup_task)
+        await cancel_task(filler_task)
+        await jobs.close(timeout=JOB_DRAIN_TIMEOUT)
         if vts: await vts.close()
         if hasattr(memory_mgr, "save"): memory_mgr.save()
+        memory_mgr.flush()
+        sentiment_engine.flush()
         print("👋 程序已关闭")
 
 
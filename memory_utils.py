@@ -3,9 +3,100 @@ import os
 import time
 import datetime
 import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from sentiment_utils import UserState
-from sentence_transformers import SentenceTransformer, util
-import torch
+from embedding_utils import get_embedding_service
+from storage_utils import JsonDocument, JsonlJournal, atomic_write_json
+from config import (
+    DIARY_FLUSH_INTERVAL, MEMORY_BACKEND, ARCHIVE_TIMEOUT, SUMMARY_FOLD_MESSAGES, SUMMARY_FOLD_MAX_MESSAGES,
+    ROLLUP_KEEP_MONTHS, ROLLUP_DIRECT_CHARS
+)
+
+
+class DiaryVectorIndex:
+    """
+    🗂️ 单个用户的日记向量索引 (持久化到 saves/rag_index/<用户名>.npz)
+    以条目文本的哈希为键：启动时只补算新增条目，写日记时增量追加，
+    检索时只需编码一次问题 + 一次矩阵乘法。
+    """
+
+    def __init__(self, index_path, model_name):
+        self.index_path = index_path
+        self.model_name = model_name
+        self.keys = []
+        self.texts = []
+        self.vectors = None  # (n, dim) 已归一化的向量矩阵
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def load(self):
+        if not os.path.exists(self.index_path): return
+        try:
+            with np.load(self.index_path, allow_pickle=False) as f:
+                # 换了模型，旧向量就不能用了，直接作废重算
+                if str(f["model"]) != self.model_name: return
+                self.keys = [str(k) for k in f["keys"]]
+                self.texts = [str(t) for t in f["texts"]]
+                self.vectors = f["vectors"].astype(np.float32)
+        except Exception as e:
+            print(f"⚠️ [RAG] 索引文件损坏，将重新构建: {e}")
+            self.keys, self.texts, self.vectors = [], [], None
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f, model=np.array(self.model_name), keys=np.array(self.keys, dtype=str),
+                texts=np.array(self.texts, dtype=str),
+                vectors=self.vectors if self.vectors is not None else np.zeros((0, 0), dtype=np.float32)
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def sync(self, corpus, embedder):
+        """
+        让索引与日记内容对齐：已有向量直接复用，只编码缺失的条目，删除已不存在的条目
+        """
+        cached = {}
+        if self.vectors is not None:
+            cached = {k: self.vectors[i] for i, k in enumerate(self.keys)}
+
+        keys = [self._key(t) for t in corpus]
+        missing = [t for t, k in zip(corpus, keys) if k not in cached]
+        if missing:
+            print(f"🗂️ [RAG] 正在为 {len(missing)} 条新日记建立索引...")
+            for k, vec in zip([self._key(t) for t in missing], embedder.encode(missing)):
+                cached[k] = vec
+
+        if keys == self.keys and not missing: return
+
+        self.keys = keys
+        self.texts = list(corpus)
+        self.vectors = np.stack([cached[k] for k in keys]) if keys else None
+        self.save()
+
+    def add(self, text, embedder):
+        vec = embedder.encode([text])
+        self.keys.append(self._key(text))
+        self.texts.append(text)
+        self.vectors = vec if self.vectors is None else np.vstack([self.vectors, vec])
+        self.save()
+
+    def search(self, query_vec, top_k):
+        """返回 [(相似度, 文本), ...]，按相似度降序"""
+        if self.vectors is None or not self.keys: return []
+        scores = self.vectors @ query_vec
+        k = min(top_k, len(scores))
+        top_idx = np.argpartition(-scores, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-scores[top_idx])]
+        return [(float(scores[i]), self.texts[i]) for i in top_idx]
 
 
 class MemoryManager:
@@ -17,6 +108,11 @@ class MemoryManager:
         self.current_user = None
         self.data = {}
         self.global_diary_path = os.path.join(save_dir, "global_diary.json")
+        self.rag_index_dir = os.path.join(save_dir, "rag_index")
+        self.rag_index = None
+        self.journal_dir = os.path.join(save_dir, "journal")
+        self.journal = None
+        self.diary_archive_dir = os.path.join(save_dir, "diary_archive")
 
         # 1. 初始化日记
         self._init_global_diary()
@@ -43,13 +139,10 @@ class MemoryManager:
         # 3. 同步老用户基本信息
         self.sync_legacy_users()
 
-        print("🧠 [记忆] 正在初始化 RAG 检索神经...")
-        try:
-            self.rag_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-            print("✅ [记忆] RAG 检索引擎就绪！")
-        except:
-            print("⚠️ [记忆] RAG 模型加载失败，主动回忆功能将不可用。")
-            self.rag_model = None
+        # 4. RAG 检索神经 (与情绪映射共用同一个向量模型，用到时才加载)
+        self.embedder = get_embedding_service()
+        # 新日记的向量编码放到这个单线程里按顺序做，写日记的地方 (多在事件循环里) 不用等模型
+        self._index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-index")
 
     def _load_json_or_reset(self, path, default_data):
         if not os.path.exists(path):
@@ -75,50 +168,58 @@ class MemoryManager:
             return f"在【{loc}】涉及物品【{items_str}】：{event}"
         return str(content)  # 旧版直接返回字符串
 
-    def search_relevant_memories(self, query_text, threshold=0.35, top_k=3):
+    def _diary_entry_text(self, entry):
+        """RAG 语料格式: "2026-01-28 20:00: 和白竹去了海边..." """
+        return f"{entry.get('date', '')}: {self._format_entry_content(entry.get('content', ''))}"
+
+    def _get_user_entries(self, username):
+        """某个用户的全部个人日记 (按写入顺序，含已汇总归档的原文)"""
+        live = self.diary.data.get("relationships", {}).get(username, {}).get("entries", [])
+        return self._diary_archive(username).replay() + live
+
+    def _diary_archive(self, username):
+        """已汇总的原始日记 (追加式，只给 RAG 检索用)"""
+        return JsonlJournal(os.path.join(self.diary_archive_dir, f"{username}.jsonl"))
+
+    def _load_rag_index(self, username):
         """
-        🔥 RAG 核心：根据用户说的话，去搜以前的日记
-        :param query_text: 用户当前说的话
-        :param threshold: 相似度阈值 (0~1)，低于这个就不提取，防止瞎联想
+        📂 读取用户的向量索引，并补齐上次运行后新增的日记 (只编码缺失的部分)
         """
-        if not self.rag_model or not query_text: return ""
+        self.rag_index = None
+        if not self.embedder.available:
+            print("⚠️ [记忆] RAG 模型不可用，主动回忆功能将关闭。")
+            return
 
         try:
-            # 1. 准备数据源：只搜【当前用户】的日记 entries
-            # 因为 global_diary.json 才是存长期记忆的地方
-            with open(self.global_diary_path, "r", encoding="utf-8") as f:
-                diary_data = json.load(f)
+            index = DiaryVectorIndex(os.path.join(self.rag_index_dir, f"{username}.npz"), self.embedder.model_name)
+            index.load()
 
-            user_entries = []
-            # 兼容性读取：读取当前用户的 entries
-            rels = diary_data.get("relationships", {})
-            if self.current_user in rels:
-                user_entries = rels[self.current_user].get("entries", [])
+            user_entries = self._get_user_entries(username)
 
-            if not user_entries: return ""
-
-            # 2. 提取文本内容列表
-            # 格式: "2026-01-28: 和白竹去了海边..."
-            corpus = [f"{e['date']}: {e['content']}" for e in user_entries]
-
-            # 3. 向量计算 (语义搜索)
-            # 编码用户的当前问题
-            query_embedding = self.rag_model.encode(query_text, convert_to_tensor=True)
-            # 编码所有日记 (为了速度，实际生产中这里应该预计算并缓存，但你日记少，实时算也很快)
-            corpus_embeddings = self.rag_model.encode(corpus, convert_to_tensor=True)
+            index.sync([self._diary_entry_text(e) for e in user_entries], self.embedder)
+            self.rag_index = index
+            print(f"🗂️ [RAG] 索引就绪: {len(index)} 条日记")
+        except Exception as e:
+            print(f"⚠️ [RAG] 索引加载失败，主动回忆功能将不可用: {e}")
 
-            # 4. 计算相似度 (Cosine Similarity)
-            cos_scores = util.cos_sim(query_embedding, corpus_embeddings)[0]
+    def search_relevant_memories(self, query_text, threshold=0.35, top_k=3):
+        """
+        🔥 RAG 核心：根据用户说的话，去搜以前的日记
+        :param query_text: 用户当前说的话
+        :param threshold: 相似度阈值 (0~1)，低于这个就不提取，防止瞎联想
+        """
+        if not self.rag_index or not query_text: return ""
 
-            # 5. 取出前 Top K
-            # torch.topk 会返回分数和索引
-            top_results = torch.topk(cos_scores, k=min(top_k, len(corpus)))
+        try:
+            # 1. 只编码用户的当前问题，日记向量已在索引中预先算好
+            query_embedding = self.embedder.encode(query_text)
 
+            # 2. 一次矩阵乘法算出与所有日记的相似度 (向量已归一化，点积即余弦相似度)
             found_memories = []
-            for score, idx in zip(top_results.values, top_results.indices):
+            for score, text in self.rag_index.search(query_embedding, top_k):
                 if score > threshold:
-                    found_memories.append(corpus[idx])
-                    print(f"🔦 [RAG] 捞回记忆 (匹配度 {score:.2f}): {corpus[idx][:20]}...")
+                    found_memories.append(text)
+                    print(f"🔦 [RAG] 捞回记忆 (匹配度 {score:.2f}): {text[:20]}...")
 
             if found_memories:
                 return "\n".join(found_memories)
@@ -207,8 +308,7 @@ class MemoryManager:
         返回格式: "2026-01-30 23:50 [白竹]: 聊了关于蛋糕的事..."
         """
         try:
-            default = {"summary": "", "relationships": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
+            data = self.diary.data
 
             all_entries = []
 
@@ -236,20 +336,40 @@ class MemoryManager:
                 content = self._format_entry_content(e['content'])
                 log_text += f"- {e['date']} 【{e['username']}】: {content}\n"
 
+            # 5. 最近的原始日记不够数时，用汇总补上 (旧日记已压成汇总)
+            if len(recent) < limit:
+                log_text += self._format_rollup_log(
+                    {name: info.get("rollups", {}) for name, info in data.get("relationships", {}).items()},
+                    limit - len(recent)
+                )
+
             return log_text if log_text else "(近期无其他访客)"
 
         except Exception as e:
             print(f"⚠️ 读取全局日志失败: {e}")
             return "(读取失败)"
 
+    def _format_rollup_log(self, rollups_by_user, limit):
+        """按时间倒序列出各用户最近的日/周汇总 (每条截短，控制提示词长度)"""
+        items = []
+        for name, rollups in rollups_by_user.items():
+            for tier in ("daily", "weekly"):
+                for r in rollups.get(tier, []):
+                    items.append((self._rollup_sort_key(tier, r["period"]), tier, r, name))
+        items.sort(key=lambda x: x[0], reverse=True)
+
+        log_text = ""
+        for _, tier, r, name in items[:limit]:
+            text = r["text"] if len(r["text"]) <= 100 else r["text"][:100] + "..."
+            log_text += f"- {r['period']} 【{name}】({self.ROLLUP_NAMES[tier]}回顾): {text}\n"
+        return log_text
+
     def get_person_brief(self, target_name):
         """
         🔥 联想检索：获取某个特定路人的简报
         """
         try:
-            with open(self.global_diary_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                rels = data.get("relationships", {})
+            rels = self.diary.data.get("relationships", {})
 
             if target_name in rels:
                 info = rels[target_name]
@@ -259,6 +379,9 @@ class MemoryManager:
                 impression = info.get("impression", "")
                 if not impression and info.get("entries"):
                     impression = info["entries"][-1]["content"]
+                if not impression:
+                    latest = self._latest_rollup(info.get("rollups", {}))
+                    if latest: impression = latest["text"]
 
                 if not impression: impression = "没什么特别的印象。"
 
@@ -269,9 +392,21 @@ class MemoryManager:
             return None
 
     def _init_global_diary(self):
-        # 确保 relationships 存在
+        """
+        📄 日记常驻内存：读操作不碰磁盘，写操作标记脏数据后由后台合并刷盘
+        """
         default = {"summary": "", "relationships": {}, "social_graph": {}}
-        self._load_json_or_reset(self.global_diary_path, default)
+        self.diary = JsonDocument(self.global_diary_path, default, flush_interval=DIARY_FLUSH_INTERVAL)
+        # 确保 relationships 存在
+        with self.diary.lock:
+            for key, value in default.items():
+                if key not in self.diary.data:
+                    self.diary.data[key] = value
+                    self.diary.mark_dirty()
+
+    def flush(self):
+        """💾 立即把内存中的日记写回磁盘 (退出前调用)"""
+        self.diary.flush()
 
     # 🔥🔥🔥 核心新增：数据迁移逻辑 (一次性整理旧日记) 🔥🔥🔥
     def migrate_entries_structure(self):
@@ -279,7 +414,7 @@ class MemoryManager:
         将旧版的顶层 entries 列表，拆分到每个用户的 relationships 字典中
         """
         try:
-            data = self._load_json_or_reset(self.global_diary_path, {"relationships": {}})
+            data = self.diary.data
 
             # 如果存在旧版的顶层 entries
             if "entries" in data and isinstance(data["entries"], list) and len(data["entries"]) > 0:
@@ -308,8 +443,7 @@ class MemoryManager:
                 # 迁移完成后，删除顶层 entries，防止冗余
                 del data["entries"]
 
-                with open(self.global_diary_path, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
+                self.diary.mark_dirty()
                 print(f"✅ [系统] 迁移完成！已将 {count} 条日记归档到个人专属名册。")
 
         except Exception as e:
@@ -331,7 +465,7 @@ class MemoryManager:
 
     def sync_legacy_users(self):
         try:
-            diary_data = self._load_json_or_reset(self.global_diary_path, {"relationships": {}})
+            diary_data = self.diary.data
             changes_count = 0
 
             for filename in os.listdir(self.save_dir):
@@ -349,21 +483,21 @@ class MemoryManager:
 
                         # 如果不在名册里，初始化结构
                         if username not in diary_data["relationships"]:
-                            diary_data["relationships"][username] = {
-                                "affection": affection,
-                                "title": title,
-                                "last_interaction": datetime.datetime.fromtimestamp(
-                                    user_data.get("created_at", time.time())).strftime("%Y-%m-%d %H:%M"),
-                                "impression": summary,
-                                "entries": []  # 🔥 初始化个人日记本
-                            }
+                            with self.diary.lock:
+                                diary_data["relationships"][username] = {
+                                    "affection": affection,
+                                    "title": title,
+                                    "last_interaction": datetime.datetime.fromtimestamp(
+                                        user_data.get("created_at", time.time())).strftime("%Y-%m-%d %H:%M"),
+                                    "impression": summary,
+                                    "entries": []  # 🔥 初始化个人日记本
+                                }
                             changes_count += 1
                     except Exception as e:
                         pass
 
             if changes_count > 0:
-                with open(self.global_diary_path, "w", encoding="utf-8") as f:
-                    json.dump(diary_data, f, ensure_ascii=False, indent=4)
+                self.diary.mark_dirty()
                 print(f"✅ [系统] 名册同步完成，补录 {changes_count} 人。")
 
         except Exception as e:
@@ -377,20 +511,19 @@ class MemoryManager:
         gender: "male", "female", "unknown"
         """
         try:
-            default = {"summary": "", "relationships": {}, "social_graph": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
+            with self.diary.lock:
+                data = self.diary.data
 
-            if "relationships" not in data: data["relationships"] = {}
-            if username not in data["relationships"]:
-                data["relationships"][username] = {"entries": []}
+                if "relationships" not in data: data["relationships"] = {}
+                if username not in data["relationships"]:
+                    data["relationships"][username] = {"entries": []}
 
-            # 如果已经有性别且不是 unknown，通常不覆盖（除非显式更正），这里简单处理为直接覆盖
-            old_gender = data["relationships"][username].get("gender", "unknown")
-            if old_gender != gender and gender != "unknown":
+                # 如果已经有性别且不是 unknown，通常不覆盖（除非显式更正），这里简单处理为直接覆盖
+                old_gender = data["relationships"][username].get("gender", "unknown")
+                if old_gender == gender or gender == "unknown": return
                 data["relationships"][username]["gender"] = gender
-                with open(self.global_diary_path, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                print(f"⚧️ [性别识别] 更新了【{username}】的性别: {gender}")
+                self.diary.mark_dirty()
+            print(f"⚧️ [性别识别] 更新了【{username}】的性别: {gender}")
 
         except Exception as e:
             print(f"⚠️ 性别更新失败: {e}")
@@ -398,30 +531,26 @@ class MemoryManager:
     def get_user_gender(self, username):
         """获取用户性别，默认为 unknown"""
         try:
-            with open(self.global_diary_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                return data.get("relationships", {}).get(username, {}).get("gender", "unknown")
+            return self.diary.data.get("relationships", {}).get(username, {}).get("gender", "unknown")
         except:
             return "unknown"
 
     def update_social_relation(self, source_user, target_user, relation_desc, gossip_content):
         """记录 A 对 B 的看法"""
         try:
-            default = {"summary": "", "relationships": {}, "social_graph": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
-
-            if "social_graph" not in data: data["social_graph"] = {}
-            if source_user not in data["social_graph"]: data["social_graph"][source_user] = {}
-
-            # 记录：白竹 -> 黑球 = 喜欢
-            data["social_graph"][source_user][target_user] = {
-                "relation": relation_desc,
-                "content": gossip_content,
-                "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-            }
-
-            with open(self.global_diary_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            with self.diary.lock:
+                data = self.diary.data
+
+                if "social_graph" not in data: data["social_graph"] = {}
+                if source_user not in data["social_graph"]: data["social_graph"][source_user] = {}
+
+                # 记录：白竹 -> 黑球 = 喜欢
+                data["social_graph"][source_user][target_user] = {
+                    "relation": relation_desc,
+                    "content": gossip_content,
+                    "time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+                }
+                self.diary.mark_dirty()
             print(f"🕸️ [社交网络] 已记录: 【{source_user}】->【{target_user}】 ({relation_desc})")
 
         except Exception as e:
@@ -430,9 +559,7 @@ class MemoryManager:
     def get_social_context(self, current_user):
         """获取关于当前用户的八卦 (别人怎么看他 + 他怎么看别人)"""
         try:
-            default = {"summary": "", "relationships": {}, "social_graph": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
-            graph = data.get("social_graph", {})
+            graph = self.diary.data.get("social_graph", {})
 
             gossip_text = ""
 
@@ -458,6 +585,9 @@ class MemoryManager:
         用于判断吃醋、护短等逻辑
         """
         try:
+            # 当前用户以内存为准 (最新的变化可能还在追加日志里)
+            if username == self.current_user:
+                return self.data.get("user_state", {}).get("affection", 0)
             # 直接读取目标的存档文件
             file_path = os.path.join(self.save_dir, f"{username}.json")
             if os.path.exists(file_path):
@@ -470,61 +600,202 @@ class MemoryManager:
 
     def add_global_event(self, username, content):
         try:
-            default = {"summary": "", "relationships": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
+            with self.diary.lock:
+                data = self.diary.data
 
-            if "relationships" not in data: data["relationships"] = {}
-            # 确保用户存在
-            if username not in data["relationships"]:
-                data["relationships"][username] = {"entries": []}
-            if "entries" not in data["relationships"][username]:
-                data["relationships"][username]["entries"] = []
-
-            today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-            new_entry = {"date": today, "content": content}
+                if "relationships" not in data: data["relationships"] = {}
+                # 确保用户存在
+                if username not in data["relationships"]:
+                    data["relationships"][username] = {"entries": []}
+                if "entries" not in data["relationships"][username]:
+                    data["relationships"][username]["entries"] = []
 
-            data["relationships"][username]["entries"].append(new_entry)
+                today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+                new_entry = {"date": today, "content": content}
 
-            with open(self.global_diary_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+                data["relationships"][username]["entries"].append(new_entry)
+                self.diary.mark_dirty()
 
         except Exception as e:
             print(f"⚠️ 个人日记写入失败: {e}")
+            return
 
-    def update_global_social_status(self, username, affection, title, summary):
-        try:
-            default = {"summary": "", "relationships": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
+        # 🗂️ 当前用户的索引增量追加 (其他用户的索引会在下次 load_user 时补齐)
+        if username == self.current_user: self._append_to_index(self._diary_entry_text(new_entry))
+
+    def _append_to_index(self, text):
+        """把一条新日记加进当前用户的向量索引 (后台线程里编码，调用方立即返回)"""
+        index = self.rag_index
+        if index is None: return
+
+        def run():
+            try:
+                index.add(text, self.embedder)
+            except Exception as e:
+                print(f"⚠️ [RAG] 索引追加失败: {e}")
 
-            if "relationships" not in data: data["relationships"] = {}
+        self._index_executor.submit(run)
 
-            # 确保不覆盖 entries，只更新属性
-            if username not in data["relationships"]:
-                data["relationships"][username] = {"entries": []}
-            elif "entries" not in data["relationships"][username]:
-                data["relationships"][username]["entries"] = []
+    def update_global_social_status(self, username, affection, title, summary):
+        try:
+            with self.diary.lock:
+                data = self.diary.data
 
-            # 更新属性
-            data["relationships"][username]["affection"] = affection
-            data["relationships"][username]["title"] = title
-            data["relationships"][username]["last_interaction"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
-            data["relationships"][username]["impression"] = summary
+                if "relationships" not in data: data["relationships"] = {}
 
-            with open(self.global_diary_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+                # 确保不覆盖 entries，只更新属性
+                if username not in data["relationships"]:
+                    data["relationships"][username] = {"entries": []}
+                elif "entries" not in data["relationships"][username]:
+                    data["relationships"][username]["entries"] = []
+
+                # 更新属性
+                data["relationships"][username]["affection"] = affection
+                data["relationships"][username]["title"] = title
+                data["relationships"][username]["last_interaction"] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+                data["relationships"][username]["impression"] = summary
+                self.diary.mark_dirty()
             print(f"🌍 [世界记忆] 已更新【{username}】的社交档案")
         except Exception as e:
             print(f"⚠️ 社交名册更新失败: {e}")
 
-    # 暂时禁用全局压缩，防止打乱个人条目
+    # ================= 🗜️ 日记分层汇总 =================
+    # 每个用户的汇总按层级存放，period 分别是 "2026-10-17" / "2026-W41" / "2026-10" / "更早"
+    ROLLUP_TIERS = ("daily", "weekly", "monthly", "earlier")
+    ROLLUP_NAMES = {"daily": "当天", "weekly": "那一周", "monthly": "那个月", "earlier": "更早以前"}
+
+    @staticmethod
+    def _rollup_sort_key(tier, period):
+        """不同层级的 period 换算成可比较的日期字符串"""
+        if tier == "weekly":
+            year, week = period.split("-W")
+            return datetime.date.fromisocalendar(int(year), int(week), 1).isoformat()
+        if tier == "monthly": return f"{period}-01"
+        if tier == "earlier": return ""
+        return period
+
+    def _latest_rollup(self, rollups):
+        """最近的一条汇总 (没有返回 None)"""
+        items = [(self._rollup_sort_key(tier, r["period"]), r) for tier in self.ROLLUP_TIERS for r in rollups.get(tier, [])]
+        return max(items, key=lambda x: x[0])[1] if items else None
+
+    def _load_rollups(self, username):
+        rollups = self.diary.data.get("relationships", {}).get(username, {}).get("rollups", {})
+        return {tier: list(rollups.get(tier, [])) for tier in self.ROLLUP_TIERS}
+
+    def _save_rollups(self, username, rollups):
+        with self.diary.lock:
+            rels = self.diary.data.setdefault("relationships", {})
+            rels.setdefault(username, {"entries": []})["rollups"] = rollups
+            self.diary.mark_dirty()
+
+    def _unrolled_entries(self, username):
+        """还没汇总的原始日记"""
+        return list(self.diary.data.get("relationships", {}).get(username, {}).get("entries", []))
+
+    def _mark_rolled(self, username, entries):
+        """原文先追加进归档 (RAG 还能搜到)，再从常驻的日记文件里移除"""
+        archive = self._diary_archive(username)
+        try:
+            for entry in entries: archive.append(entry)
+        finally:
+            archive.close()
+        rolled = {id(e) for e in entries}
+        with self.diary.lock:
+            info = self.diary.data.get("relationships", {}).get(username, {})
+            info["entries"] = [e for e in info.get("entries", []) if id(e) not in rolled]
+            self.diary.mark_dirty()
+
+    async def _merge_rollup_items(self, brain, items, current=""):
+        """把若干条日记 / 下层汇总合成一段 (失败返回 None)"""
+        if not current and len(items) == 1 and len(items[0]["content"]) <= ROLLUP_DIRECT_CHARS:
+            return items[0]["content"]  # 就一条短的，没必要再总结
+        base = current or "(无)"
+        text = await brain.summarize_global_diary_async(items, base)
+        if not text or text == base: return None  # summarize_global_diary 失败时原样返回旧总结
+        return text
+
+    async def _promote_rollups(self, brain, username, src, dst, key_fn):
+        """
+        把 src 层里已经 "过期" 的汇总并入 dst 层
+        :param key_fn: period -> 目标 period (返回 None 表示还不该并)
+        """
+        rollups = self._load_rollups(username)
+        groups = {}
+        for r in rollups[src]:
+            key = key_fn(r["period"])
+            if key is not None: groups.setdefault(key, []).append(r)
+
+        for key, members in sorted(groups.items()):
+            existing = next((r for r in rollups[dst] if r["period"] == key), None)
+            items = [{"date": r["period"], "user": username, "content": r["text"]} for r in members]
+            text = await self._merge_rollup_items(brain, items, existing["text"] if existing else "")
+            if text is None: continue
+
+            rollups = self._load_rollups(username)  # 等 LLM 期间可能有别的改动，重新读一次
+            count = sum(r.get("count", 0) for r in members) + (existing.get("count", 0) if existing else 0)
+            merged = {r["period"] for r in members}
+            rollups[src] = [r for r in rollups[src] if r["period"] not in merged]
+            rollups[dst] = [r for r in rollups[dst] if r["period"] != key] + [{"period": key, "text": text, "count": count}]
+            rollups[dst].sort(key=lambda r: self._rollup_sort_key(dst, r["period"]))
+            self._save_rollups(username, rollups)
+
+    async def _rollup_user(self, brain, username, today):
+        # 1. 原始日记 -> 日汇总 (今天的还在发生，先不动)
+        by_day = {}
+        for entry in self._unrolled_entries(username):
+            day = str(entry.get("date", ""))[:10]
+            if day and day < today.isoformat():
+                by_day.setdefault(day, []).append(entry)
+
+        for day, entries in sorted(by_day.items()):
+            items = [{"date": e.get("date", day), "user": username, "content": self._format_entry_content(e.get("content", ""))}
+                     for e in entries]
+            text = await self._merge_rollup_items(brain, items)
+            if text is None: continue
+            rollups = self._load_rollups(username)
+            rollups["daily"].append({"period": day, "text": text, "count": len(entries)})
+            self._save_rollups(username, rollups)
+            self._mark_rolled(username, entries)
+
+        # 2. 上周以前的日汇总 -> 周汇总；上个月以前的周汇总 -> 月汇总；太久远的月汇总 -> "更早"
+        this_year, this_week, _ = today.isocalendar()
+        this_week_key = f"{this_year}-W{this_week:02d}"
+        this_month_key = today.strftime("%Y-%m")
+        months = today.year * 12 + today.month - 1 - ROLLUP_KEEP_MONTHS
+        keep_from = f"{months // 12:04d}-{months % 12 + 1:02d}"
+
+        def week_of(period):
+            year, week, _ = datetime.date.fromisoformat(period).isocalendar()
+            key = f"{year}-W{week:02d}"
+            return key if key < this_week_key else None
+
+        def month_of(period):
+            key = self._rollup_sort_key("weekly", period)[:7]
+            return key if key < this_month_key else None
+
+        await self._promote_rollups(brain, username, "daily", "weekly", week_of)
+        await self._promote_rollups(brain, username, "weekly", "monthly", month_of)
+        await self._promote_rollups(brain, username, "monthly", "earlier", lambda p: "更早" if p < keep_from else None)
+
     async def compress_global_diary_if_needed(self, brain):
-        pass
+        """
+        🗜️ 日记分层汇总 (启动后在后台跑)：
+        原始日记 -> 日汇总 -> 周汇总 -> 月汇总 -> 更早，每层只保留有限几条，
+        日记文件和提示词的体积不再随使用时间增长
+        """
+        today = datetime.date.today()
+        for username in self.get_known_users():
+            try:
+                await self._rollup_user(brain, username, today)
+            except Exception as e:
+                print(f"⚠️ [日记汇总] 【{username}】汇总失败: {e}")
+        print("🗜️ [日记汇总] 旧日记整理完毕")
 
     # 🔥🔥🔥 核心修改：读取逻辑升级 (优先读个人日记) 🔥🔥🔥
     def get_recent_global_events(self):
         try:
-            default = {"summary": "", "relationships": {}}
-            data = self._load_json_or_reset(self.global_diary_path, default)
+            data = self.diary.data
             text = ""
 
             # 1. 历史总摘要
@@ -552,6 +823,12 @@ class MemoryManager:
                         readable_content = self._format_entry_content(latest['content'])
                         text += f"- 关于【{name}】: {readable_content} ({latest['date']})\n"
                         has_news = True
+                    else:
+                        # 原始日记都汇总了：展示最近的汇总
+                        latest = self._latest_rollup(info.get("rollups", {}))
+                        if latest:
+                            text += f"- 关于【{name}】: {latest['text']} ({latest['period']})\n"
+                            has_news = True
 
                 if not has_news: text += "(暂无)\n"
                 text += "\n"
@@ -563,7 +840,9 @@ class MemoryManager:
                     aff = info.get('affection', 0)
                     title = info.get('title', '陌生人')
                     impression = info.get('impression', '暂无详细记录')
-                    entries_count = len(info.get("entries", []))
+                    rollups = info.get("rollups", {})
+                    entries_count = len(info.get("entries", [])) + sum(
+                        r.get("count", 0) for tier in self.ROLLUP_TIERS for r in rollups.get(tier, []))
 
                     short_impression = impression[:30] + "..." if len(impression) > 30 else impression
                     text += f"- 【{name}】 ({title} | 💾 独家记忆:{entries_count}条): {short_impression}\n"
@@ -589,6 +868,17 @@ class MemoryManager:
         if "user_state" not in self.data:
             self.data["user_state"] = default_state
 
+        # 📝 回放上次运行留下的追加日志，然后合并进快照
+        if self.journal: self.journal.close()
+        self.journal = JsonlJournal(os.path.join(self.journal_dir, f"{username}.jsonl"))
+        replayed = self._replay_journal()
+        if replayed:
+            print(f"📝 [记忆] 从日志恢复了 {replayed} 条未归档的记录")
+            self.save()
+
+        self._init_summary_mark()
+        self._load_rag_index(username)
+
         lvl, title, _ = self.calculate_status()
         print(f"📖 [记忆] 读取成功: {username} (Lv.{lvl} {title})")
 
@@ -597,7 +887,12 @@ class MemoryManager:
 
     def save_user_state(self, state_obj: UserState):
         self.data["user_state"] = state_obj.to_dict()
-        self.save()
+        self._journal_append({"op": "state", "user_state": self.data["user_state"]})
+
+    def set_fields(self, **fields):
+        """更新存档里的零散字段 (上次互动时间、打字节奏等)，和对话一样只追加日志"""
+        self.data.update(fields)
+        self._journal_append({"op": "fields", "fields": fields})
 
     def update_affection(self, delta):
         state = self.get_user_state_obj()
@@ -605,29 +900,121 @@ class MemoryManager:
         self.save_user_state(state)
 
     def save(self):
+        """
+        💾 写出完整快照并清空追加日志 (启动、归档、退出时调用；每轮对话只追加日志)
+        """
         if self.current_user and self.data:
             file_path = os.path.join(self.save_dir, f"{self.current_user}.json")
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=4)
+            atomic_write_json(file_path, self.data)
+            if self.journal: self.journal.truncate()
+
+    # ================= 📝 追加日志 =================
+    def _journal_append(self, record):
+        """每条记录带递增序号，快照里记下已合并到的序号，防止重复回放"""
+        if not self.journal: return
+        seq = self.data.get("journal_seq", 0) + 1
+        self.data["journal_seq"] = seq
+        try:
+            self.journal.append(dict(record, seq=seq))
+        except Exception as e:
+            print(f"⚠️ [记忆] 日志追加失败，改为写完整快照: {e}")
+            self.save()
 
-    def add_history(self, role, content):
+    def _append_chat(self, msg):
         if "chat_history" not in self.data: self.data["chat_history"] = []
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.data["chat_history"].append(msg)
+        if len(self.data["chat_history"]) > 100:
+            self.data["chat_history"] = self.data["chat_history"][-100:]
 
-        self.data["chat_history"].append({
+    def _replay_journal(self):
+        applied_seq = self.data.get("journal_seq", 0)
+        count = 0
+        for record in self.journal.replay():
+            seq = record.get("seq", 0)
+            if seq <= applied_seq: continue  # 已经在快照里了
+            op = record.get("op")
+            if op == "chat":
+                self._append_chat({k: record[k] for k in ("role", "content", "timestamp") if k in record})
+            elif op == "state":
+                self.data["user_state"] = record.get("user_state", self.data.get("user_state", {}))
+            elif op == "fields":
+                self.data.update(record.get("fields", {}))
+            applied_seq = seq
+            count += 1
+        self.data["journal_seq"] = applied_seq
+        return count
+
+    def add_history(self, role, content):
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        msg = {
             "role": role,
             "content": content,
             "timestamp": timestamp
-        })
-        if len(self.data["chat_history"]) > 100:
-            self.data["chat_history"] = self.data["chat_history"][-100:]
-
-        self.save()
+        }
+        self._append_chat(msg)
+        self._journal_append(dict(msg, op="chat"))
 
     def get_recent_history(self, limit=60):
         # 获取最近记录，即使归档了，现在因为保留了尾部，所以能接上
         return self.data.get("chat_history", [])[-limit:]
 
+    # ================= 🧶 滚动记忆总结 =================
+    @staticmethod
+    def _summary_mark_of(msg):
+        return {"timestamp": msg.get("timestamp"), "content": msg.get("content")}
+
+    def _init_summary_mark(self):
+        """
+        summary_mark 记录已经融合进 summary 的最后一条对话 (高水位)
+        老存档没有这个字段：之前的记录在上次退出归档时已经融合过，直接把水位设到末尾
+        """
+        if "summary_mark" in self.data: return
+        history = self.data.get("chat_history", [])
+        self.data["summary_mark"] = self._summary_mark_of(history[-1]) if history else {}
+
+    def get_unsummarized_history(self):
+        """水位之后、还没融合进长期记忆的对话 (水位那条已被修剪掉时，剩下的全都是新的)"""
+        history = self.data.get("chat_history", [])
+        mark = self.data.get("summary_mark") or {}
+        for i in range(len(history) - 1, -1, -1):
+            if self._summary_mark_of(history[i]) == mark:
+                return history[i + 1:]
+        return history
+
+    def advance_summary_mark(self, new_summary, folded, based_on=None):
+        """
+        记忆融合成功：更新 summary，并把水位推进到 folded 的最后一条
+        :param based_on: 融合时读到的旧 summary；等 LLM 期间后台任务追加的事实 (在它后面的部分) 会接回去
+        """
+        current = self.data.get("summary") or ""
+        if based_on is not None and current != based_on:
+            if current.startswith(based_on):
+                new_summary += current[len(based_on):]
+            else:
+                print("⚠️ [记忆] 融合期间 summary 被改写，未能接回新增内容")
+        self.data["summary"] = new_summary
+        if folded: self.data["summary_mark"] = self._summary_mark_of(folded[-1])
+
+    async def fold_summary(self, brain, min_messages=SUMMARY_FOLD_MESSAGES, max_messages=SUMMARY_FOLD_MAX_MESSAGES):
+        """
+        🧶 把水位之后的新对话融合进长期记忆 (聊天空闲时在后台调用)
+        每次最多带 max_messages 条，剩下的留给下一次，提示词长度有上限
+        :return: 是否融合成功
+        """
+        pending = self.get_unsummarized_history()
+        if len(pending) < min_messages: return False
+
+        username = self.current_user
+        chunk = pending[:max_messages]
+        based_on = self.data.get("summary") or ""
+        new_summary = await brain.merge_memory_summary_async(username, based_on or "暂无记录", chunk)
+        if not new_summary or username != self.current_user: return False
+
+        self.advance_summary_mark(new_summary, chunk, based_on)
+        self.save()
+        print(f"🧶 [记忆] 已把 {len(chunk)} 条新对话融合进长期记忆")
+        return True
+
     def calculate_status(self):
         state = self.get_user_state_obj()
         score = state.affection
@@ -660,105 +1047,92 @@ class MemoryManager:
         else:
             return f"Lv.{lvl} {title}", f"### 💖【强制态度：深爱】\n{username}是你的灵魂伴侣，展现温柔粘人的一面。"
 
-    async def compress_memory_if_needed(self, brain):
+    async def compress_memory_if_needed(self, brain, jobs=None):
         # 实时对话中的小修剪，防止上下文过长炸内存
         # 🔥 修改：阈值调大，避免在归档前就把历史删光了
-        history = self.data["chat_history"]
+        history = self.data.get("chat_history", [])
         if len(history) > 200:  # 只有超过 200 条才开始在运行时修剪
             print("🧹 [记忆] 实时对话过长，正在后台修剪...")
             chunk = history[:30]
             self.data["chat_history"] = history[30:]
+            self.save()
 
+            if jobs is not None:
+                # 提取公共事件交给后台任务队列 (chunk 随任务一起落盘，退出也不会丢)
+                jobs.submit("public_event", username=self.current_user, history=chunk)
+                return
             public_event = await asyncio.to_thread(brain.extract_public_event, chunk, self.current_user)
             if public_event: self.add_global_event(self.current_user, public_event)
-            self.save()
 
-    def archive_session(self, brain):
+    async def archive_session(self, brain, timeout=ARCHIVE_TIMEOUT):
+        """
+        📚 退出时归档：结构化日记、散场新闻、记忆融合三个 LLM 调用同时发出
+        - 每个调用单独限时，谁先回来谁先落盘 (某一项失败/超时不影响其他项)
+        - 总耗时取决于最慢的那一个，而不是三者之和
+        """
         history = self.data.get("chat_history", [])
         if not history: return
 
         print("📚 [记忆] 正在进行结构化归档与记忆融合...")
-        current_summary = self.data.get("summary", "暂无记录")
+        based_on = self.data.get("summary") or ""
+        username = self.current_user
+        # 聊天期间已经滚动融合过的部分不用再融合
+        unsummarized = self.get_unsummarized_history()
 
-        # ================= 🔥 1. 新增：生成结构化日记 (JSON格式) 🔥 =================
+        # 计算时间范围
         try:
-            # 计算时间范围
-            try:
-                start_ts = history[0].get("timestamp", datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
-                start_time = start_ts[11:16] if len(start_ts) > 16 else "刚刚"
-            except:
-                start_time = "刚刚"
-            end_time = datetime.datetime.now().strftime("%H:%M")
-
-            # 🧠 调用新的结构化生成器 (返回字典)
-            # 注意：请确保 brain_utils.py 里已经有了 generate_structured_diary 函数
-            structured_entry = brain.generate_structured_diary(
-                self.current_user, start_time, end_time, history
-            )
-
-            if structured_entry:
-                # 🛠️ 使用工具函数把字典转成好读的字符串，打印出来看看
-                readable_log = self._format_entry_content(structured_entry)
-                print(f"📜 [新日记] {readable_log}")
-
-                # 💾 存入 global_diary.json (现在存进去的是一个包含 people/event 等字段的字典)
-                self.add_global_event(self.current_user, structured_entry)
-        except AttributeError:
-            print("⚠️ Brain 类缺少 generate_structured_diary 方法，跳过日记生成。")
-        except Exception as e:
-            print(f"⚠️ 日记生成跳过: {e}")
+            start_ts = history[0].get("timestamp", datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+            start_time = start_ts[11:16] if len(start_ts) > 16 else "刚刚"
+        except:
+            start_time = "刚刚"
+        end_time = datetime.datetime.now().strftime("%H:%M")
 
-        # ================= 🔄 2. 原有逻辑：动态计算保留条数 (完全保留) =================
+        # 动态计算保留条数
         user_state = self.get_user_state_obj()
         aff = user_state.affection
         keep_count = 50 + int(max(0, aff) * 0.15)
         keep_count = min(keep_count, 200)  # 上限 200
 
-        # ================= 📰 3. 原有逻辑：提取公共事件 (完全保留) =================
-        try:
-            public_event = brain.extract_public_event(history, self.current_user)
-            if public_event and "None" not in public_event:
-                self.add_global_event(self.current_user, public_event)
-                print(f"🗞️ [散场新闻] 已写入【{self.current_user}】的专属日记: {public_event}")
-        except Exception as e:
-            print(f"⚠️ 事件提取跳过: {e}")
-
-        # ================= 🧠 4. 原有逻辑：LLM 记忆融合 (完全保留) =================
-        try:
-            # 整理本次对话文本
-            dialogue_text = ""
-            for msg in history:
-                role = "芙宁娜" if msg['role'] == 'assistant' else "用户"
-                dialogue_text += f"{role}: {msg['content']}\n"
-
-            # 提示词：要求 AI 将新旧信息合并
-            prompt = f"""
-你正在更新芙宁娜对用户【{self.current_user}】的长期记忆。
-请将【旧的记忆总结】与【新的对话经历】合并，生成一份更新后的、更全面的记忆总结。
-
-【旧的记忆总结】：
-{current_summary}
-
-【新的对话经历】：
-{dialogue_text}
-
-**要求**：
-1. 不要遗漏旧记忆中的关键信息（如用户身份、过去的重大事件）。
-2. 将新对话中的关键进展（好感度变化、承诺、发生的事件、约定的事）补充进去。
-3. 如果新旧信息有冲突，以【新对话】为准。
-4. 字数控制在 500 字以内，采用第三人称叙述。
-"""
-
-            response = brain.client.chat.completions.create(
-                model="deepseek-chat", messages=[{"role": "user", "content": prompt}],
-                max_tokens=600, temperature=0.5
-            )
-            new_summary = response.choices[0].message.content
-
-            # 更新数据
-            self.data["summary"] = new_summary
-
-            # ================= ✂️ 5. 原有逻辑：动态保留尾部记录 (完全保留) =================
+        async def run_step(name, coro, commit):
+            try:
+                result = await asyncio.wait_for(coro, timeout)
+            except asyncio.TimeoutError:
+                print(f"⏱️ [归档] {name} 超过 {timeout}s 未完成，跳过")
+                return False
+            except Exception as e:
+                print(f"⚠️ {name}跳过: {e}")
+                return False
+            try:
+                return commit(result)
+            except Exception as e:
+                print(f"⚠️ {name}写入失败: {e}")
+                return False
+
+        # ================= 📜 1. 结构化日记 (JSON格式) =================
+        def commit_diary(structured_entry):
+            if not structured_entry: return False
+            # 🛠️ 使用工具函数把字典转成好读的字符串，打印出来看看
+            readable_log = self._format_entry_content(structured_entry)
+            print(f"📜 [新日记] {readable_log}")
+            # 💾 存入 global_diary.json (现在存进去的是一个包含 people/event 等字段的字典)
+            self.add_global_event(username, structured_entry)
+            return True
+
+        # ================= 📰 2. 散场新闻 (公共事件) =================
+        def commit_public_event(public_event):
+            if not public_event or "None" in public_event: return False
+            self.add_global_event(username, public_event)
+            print(f"🗞️ [散场新闻] 已写入【{username}】的专属日记: {public_event}")
+            return True
+
+        # ================= 🧠 3. LLM 记忆融合 =================
+        def commit_summary(new_summary):
+            if unsummarized:
+                if not new_summary: return False  # LLM 返回空：不能拿空串覆盖长期记忆
+                # 更新数据
+                self.advance_summary_mark(new_summary, unsummarized, based_on)
+
+            # ✂️ 动态保留尾部记录 (融合成功才修剪，失败的话留着下次再融合)
             if len(history) > keep_count:
                 self.data["chat_history"] = history[-keep_count:]
                 print(f"✂️ [记忆] 已修剪对话历史，保留最近 {keep_count} 条 (当前好感: {aff})")
@@ -769,12 +1143,25 @@ class MemoryManager:
 
             # 同步到世界名册
             lvl, title, _ = self.calculate_status()
-            self.update_global_social_status(self.current_user, user_state.affection, title, new_summary)
-
-            print(f"✅ [记忆] 结构化归档完毕！")
-
-        except Exception as e:
-            print(f"❌ 归档失败: {e}")
+            self.update_global_social_status(username, user_state.affection, title, self.data.get("summary", ""))
+            return True
+
+        async def merge_summary():
+            if not unsummarized: return None  # 全部融合过了，不用再调 LLM
+            return await brain.merge_memory_summary_async(username, based_on or "暂无记录", unsummarized)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            run_step("日记生成", brain.generate_structured_diary_async(username, start_time, end_time, history),
+                     commit_diary),
+            run_step("事件提取", brain.extract_public_event_async(history, username), commit_public_event),
+            run_step("记忆融合", merge_summary(), commit_summary),
+        )
+        cost = time.perf_counter() - start
+        if results[2]:
+            print(f"✅ [记忆] 结构化归档完毕！(耗时 {cost:.1f}s)")
+        else:
+            print(f"❌ 归档失败: 记忆融合未完成，对话记录保留到下次 (耗时 {cost:.1f}s)")
 
     def get_title_by_affection(self, affection):
         """
@@ -802,10 +1189,16 @@ class MemoryManager:
     def get_known_users(self):
         """🔥 获取所有认识的用户列表 (用于八卦检索)"""
         try:
-            with open(self.global_diary_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                # 安全获取 relationships 的 keys
-                return list(data.get("relationships", {}).keys())
+            # 安全获取 relationships 的 keys
+            return list(self.diary.data.get("relationships", {}).keys())
         except Exception as e:
             print(f"⚠️ 读取用户列表失败: {e}")
-            return []
\ No newline at end of file
+            return []
+
+
+def create_memory_manager(save_dir="saves"):
+    """根据 config.MEMORY_BACKEND 创建对应的记忆管理器"""
+    if MEMORY_BACKEND == "sqlite":
+        from sqlite_memory_utils import SQLiteMemoryManager
+        return SQLiteMemoryManager(save_dir)
+    return MemoryManager(save_dir)
@@ -0,0 +1,117 @@
+import re
+
+# DeepSeek 官方换算：1 个中文字符约 0.6 token，1 个英文字符约 0.3 token
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]")
+CJK_TOKEN_RATIO = 0.6
+OTHER_TOKEN_RATIO = 0.3
+
+
+def estimate_tokens(text):
+    """📏 本地快速估算 token 数 (不调分词器，误差在一成左右，够做预算用)"""
+    if not text: return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return int(cjk * CJK_TOKEN_RATIO + (len(text) - cjk) * OTHER_TOKEN_RATIO) + 1
+
+
+def trim_to_tokens(text, max_tokens, keep="head"):
+    """
+    ✂️ 按行裁剪到 max_tokens 以内
+    :param keep: "head" 保留开头 (人设、摘要)，"tail" 保留结尾 (对话记录，越新越重要)
+    """
+    if estimate_tokens(text) <= max_tokens: return text
+    lines = text.splitlines()
+    if keep == "tail": lines.reverse()
+
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > max_tokens:
+            if not kept:
+                # 单独一行就超了：按字数截断
+                ratio = max_tokens / max(cost, 1)
+                n = int(len(line) * ratio)
+                if n > 0: kept.append(line[-n:] if keep == "tail" else line[:n])
+            break
+        kept.append(line)
+        used += cost
+
+    if keep == "tail": kept.reverse()
+    return "\n".join(kept)
+
+
+class ContextSection:
+    def __init__(self, name, text, priority, max_tokens=None, keep="head", min_tokens=0, required=False):
+        """
+        :param priority: 越大越重要，超预算时从最小的开始裁
+        :param max_tokens: 本段自己的上限 (不管总预算够不够都先裁到这里)
+        :param min_tokens: 裁到这个长度还不够就整段丢掉
+        :param required: 必保段 (用户这句话本身)，只受自己的上限约束，总预算不够也不动
+        """
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.keep = keep
+        self.min_tokens = min_tokens
+        self.required = required
+        self.status = "完整"
+
+    @property
+    def tokens(self):
+        return estimate_tokens(self.text)
+
+
+class ContextPacker:
+    """
+    📦 按 token 预算装填提示词的各个段落
+    1. 每段先裁到自己的上限
+    2. 总量超出预算时，从优先级最低的段开始：先按行裁剪，裁不下就整段丢弃
+    """
+
+    def __init__(self, budget, fixed_text=""):
+        """
+        :param budget: 整个提示词的输入预算 (token)
+        :param fixed_text: 提示词模板里不可裁剪的部分 (指令、格式说明)，先从预算里扣掉
+        """
+        self.budget = budget
+        self.fixed_tokens = estimate_tokens(fixed_text)
+        self.sections = []
+
+    def add(self, name, text, priority, **options):
+        self.sections.append(ContextSection(name, text, priority, **options))
+        return self
+
+    def pack(self):
+        """返回 {段名: 装填后的文本}"""
+        for s in self.sections:
+            if s.max_tokens is not None and s.tokens > s.max_tokens:
+                s.text = trim_to_tokens(s.text, s.max_tokens, s.keep)
+                s.status = "裁剪"
+
+        overflow = self.total_tokens - self.budget
+        for s in sorted(self.sections, key=lambda x: x.priority):
+            if overflow <= 0: break
+            if s.required: continue
+            before = s.tokens
+            target = before - overflow
+            if target < max(s.min_tokens, 1):
+                s.text, s.status = "", "丢弃"
+            else:
+                s.text, s.status = trim_to_tokens(s.text, target, s.keep), "裁剪"
+            overflow -= before - s.tokens
+        return {s.name: s.text for s in self.sections}
+
+    @property
+    def total_tokens(self):
+        return self.fixed_tokens + sum(s.tokens for s in self.sections)
+
+    def token_counts(self):
+        return {s.name: s.tokens for s in self.sections}
+
+    def report(self):
+        """一行汇总：总量 / 预算 + 每段的 token 数 (被裁或丢弃的打上标记)"""
+        parts = []
+        for s in self.sections:
+            mark = "" if s.status == "完整" else f"({s.status})"
+            parts.append(f"{s.name} {s.tokens}{mark}")
+        return f"~{self.total_tokens}/{self.budget} tokens | 固定 {self.fixed_tokens} | " + " | ".join(parts)
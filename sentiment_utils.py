@@ -9,15 +9,28 @@ from config import (
     MOOD_DECAY_RATE, ENERGY_RECOVER_RATE, ENERGY_COST_PER_CHAT,
     ENERGY_LOW_THRESHOLD, SAVES_DIR, SCENE_MAP,
     FURINA_ACTIVITIES, STATUS_CHANGE_INTERVAL,
-    ITEM_CONSTRAINTS
+    ITEM_CONSTRAINTS, GLOBAL_STATE_FLUSH_INTERVAL
 )
+from storage_utils import JsonDocument
 
 
 class GlobalStateManager:
+    """
+    🌍 芙宁娜的全局状态 (心情/精力/当前活动)
+    - 心情、精力的自然恢复/衰减不再定时写回，而是读取时按 last_update_time 推算 (纯计算，无 I/O)
+    - 修改时先把到此刻为止的自然变化结算进基准值，再标记脏数据，由 JsonDocument 合并写盘
+    """
+
     def __init__(self):
         self.filepath = os.path.join(SAVES_DIR, "global_state.json")
+        os.makedirs(SAVES_DIR, exist_ok=True)
         self._load()
 
+    @property
+    def data(self):
+        """存档里的基准值 (心情/精力是 last_update_time 时刻的值)"""
+        return self.doc.data
+
     # 🔥🔥🔥 [新方法] 核心逻辑提取：根据当前时间推荐活动 🔥🔥🔥
     def predict_activity_by_time(self):
         """
@@ -79,99 +92,113 @@ class GlobalStateManager:
         return new_act, new_loc
 
     def _load(self):
-        if not os.path.exists(self.filepath):
-            # 初始化：直接调用复用的逻辑
-            initial_act, initial_loc = self.predict_activity_by_time()
-
-            self.data = {
-                "mood": 50.0,
-                "energy": 80.0,
-                "current_activity": initial_act,
-                "current_location": initial_loc,
-                "current_item": "无",
-                "travel_target": None,
-                "travel_start_time": 0,
-                "last_active_timestamp": time.time(),
-                "last_update_time": time.time(),
-                "last_switch_time": time.time(),
-                "dialogue_count": 0
-            }
-            self._save()
-        else:
-            try:
-                with open(self.filepath, "r", encoding="utf-8") as f:
-                    self.data = json.load(f)
-                    if "last_switch_time" not in self.data: self.data["last_switch_time"] = time.time()
-                    if "dialogue_count" not in self.data: self.data["dialogue_count"] = 0
-
-                # 🔥🔥🔥 [离线重置] 检测是否离开太久 🔥🔥🔥
-                last_active = self.data.get("last_active_timestamp", 0)
-                now = time.time()
-                # 计算小时差
-                hours_passed = (now - last_active) / 3600.0
-
-                # 如果离线超过 2 小时，强制刷新到当前时间段的状态！
-                if hours_passed > 2:
-                    print(f"🕰️ [系统] 检测到离线 {hours_passed:.1f} 小时，正在推演芙宁娜的新生活...")
-
-                    # ✅ 复用逻辑！
-                    new_act, new_loc = self.predict_activity_by_time()
-
-                    self.data["current_activity"] = new_act
-                    self.data["current_location"] = new_loc
-                    self.data["last_switch_time"] = now
-                    self.data["dialogue_count"] = 0  # 重置对话计数
-                    self._save()
-
-            except Exception as e:
-                print(f"⚠️ 存档加载异常: {e}")
-                new_act, new_loc = self.predict_activity_by_time()
-                self.data = {
-                    "mood": 50.0, "energy": 80.0,
-                    "current_activity": new_act,
-                    "current_location": new_loc,
-                    "current_item": "无", "travel_target": None,
-                    "last_switch_time": time.time()
-                }
-
-    def _save(self):
-        with open(self.filepath, "w", encoding="utf-8") as f:
-            json.dump(self.data, f, indent=4, ensure_ascii=False)
+        # 初始化：直接调用复用的逻辑
+        initial_act, initial_loc = self.predict_activity_by_time()
+        default_data = {
+            "mood": 50.0,
+            "energy": 80.0,
+            "current_activity": initial_act,
+            "current_location": initial_loc,
+            "current_item": "无",
+            "travel_target": None,
+            "travel_start_time": 0,
+            "last_active_timestamp": time.time(),
+            "last_update_time": time.time(),
+            "last_switch_time": time.time(),
+            "dialogue_count": 0
+        }
+        self.doc = JsonDocument(self.filepath, default_data, flush_interval=GLOBAL_STATE_FLUSH_INTERVAL)
+        if self.data is default_data:
+            self.doc.mark_dirty()  # 新存档：尽快落盘
+            return
+
+        # 老存档补字段
+        for key, value in default_data.items():
+            if key not in self.data:
+                self.data[key] = value
+                self.doc.mark_dirty()
+
+        # 🔥🔥🔥 [离线重置] 检测是否离开太久 🔥🔥🔥
+        last_active = self.data.get("last_active_timestamp", 0)
+        now = time.time()
+        # 计算小时差
+        hours_passed = (now - last_active) / 3600.0
 
-    def get_state(self):
-        self._update_time_based_changes()
-        return self.data
+        # 如果离线超过 2 小时，强制刷新到当前时间段的状态！
+        if hours_passed > 2:
+            print(f"🕰️ [系统] 检测到离线 {hours_passed:.1f} 小时，正在推演芙宁娜的新生活...")
 
-    def update(self, mood_delta=0, energy_delta=0):
-        self._update_time_based_changes()
-        self.data["mood"] = max(0, min(100, self.data["mood"] + mood_delta))
-        self.data["energy"] = max(0, min(100, self.data["energy"] + energy_delta))
-        self._save()
-        return self.data
+            # ✅ 复用逻辑！
+            new_act, new_loc = self.predict_activity_by_time()
+            self.set_fields(
+                current_activity=new_act,
+                current_location=new_loc,
+                last_switch_time=now,
+                dialogue_count=0  # 重置对话计数
+            )
 
-    def _update_time_based_changes(self):
-        now = time.time()
-        last_time = self.data.get("last_update_time", now)
-        minutes_passed = (now - last_time) / 60.0
+    def flush(self):
+        self.doc.flush()
+
+    @staticmethod
+    def _time_based_values(data, now):
+        """推算 now 时刻的心情与精力 (纯计算，不修改 data)"""
+        mood, energy = data["mood"], data["energy"]
+        minutes_passed = (now - data.get("last_update_time", now)) / 60.0
+        if minutes_passed <= 0: return mood, energy
+
+        current_act = data.get("current_activity", "")
+        is_sleeping = "睡" in current_act or "梦" in current_act
+
+        if is_sleeping:
+            if mood < 60: mood = min(60, mood + 0.5 * minutes_passed)
+        else:
+            if mood > 50:
+                mood = max(50, mood - MOOD_DECAY_RATE * minutes_passed)
+            elif mood < 50:
+                mood = min(50, mood + MOOD_DECAY_RATE * minutes_passed)
 
-        if minutes_passed > 0:
-            current_act = self.data.get("current_activity", "")
-            is_sleeping = "睡" in current_act or "梦" in current_act
+        recover_mult = 6.0 if is_sleeping else 1.0
+        energy = min(100, energy + ENERGY_RECOVER_RATE * minutes_passed * recover_mult)
+        return mood, energy
 
-            current_mood = self.data["mood"]
-            if is_sleeping:
-                if current_mood < 60: self.data["mood"] = min(60, current_mood + 0.5 * minutes_passed)
-            else:
-                if current_mood > 50:
-                    self.data["mood"] = max(50, current_mood - MOOD_DECAY_RATE * minutes_passed)
-                elif current_mood < 50:
-                    self.data["mood"] = min(50, current_mood + MOOD_DECAY_RATE * minutes_passed)
+    def _settle(self, now):
+        """把到 now 为止的自然变化结算进基准值 (调用方需持有 doc.lock)"""
+        self.data["mood"], self.data["energy"] = self._time_based_values(self.data, now)
+        self.data["last_update_time"] = now
 
-            recover_mult = 6.0 if is_sleeping else 1.0
-            self.data["energy"] = min(100, self.data["energy"] + ENERGY_RECOVER_RATE * minutes_passed * recover_mult)
+    def get_state(self):
+        """当前状态的快照 (心情/精力已按时间推算，修改它不会影响存档)"""
+        with self.doc.lock:
+            state = dict(self.data)
+        state["mood"], state["energy"] = self._time_based_values(state, time.time())
+        return state
+
+    def energy_reach_time(self, threshold):
+        """精力自然恢复到 threshold 的时间戳 (已达到返回当前时间，永远达不到返回 None)"""
+        state = self.get_state()
+        now = time.time()
+        if state["energy"] >= threshold: return now
+        if threshold > 100: return None
+        is_sleeping = "睡" in state.get("current_activity", "") or "梦" in state.get("current_activity", "")
+        rate = ENERGY_RECOVER_RATE * (6.0 if is_sleeping else 1.0)  # 每分钟
+        if rate <= 0: return None
+        return now + (threshold - state["energy"]) / rate * 60.0
 
-            self.data["last_update_time"] = now
-            self._save()
+    def update(self, mood_delta=0, energy_delta=0):
+        with self.doc.lock:
+            self._settle(time.time())
+            self.data["mood"] = max(0, min(100, self.data["mood"] + mood_delta))
+            self.data["energy"] = max(0, min(100, self.data["energy"] + energy_delta))
+            self.doc.mark_dirty()
+        return self.get_state()
+
+    def set_fields(self, **fields):
+        """修改活动/地点等字段 (先按旧状态结算自然变化，睡觉与否影响恢复速度)"""
+        with self.doc.lock:
+            self._settle(time.time())
+            self.data.update(fields)
+            self.doc.mark_dirty()
 
 
 @dataclass
@@ -224,6 +251,9 @@ class SentimentEngine:
     def get_global_state(self):
         return self.global_state_mgr.get_state()
 
+    def flush(self):
+        self.global_state_mgr.flush()
+
     def _detect_intent(self, text):
         detected_intents = []
         if any(w in text for w in self.keywords["neg"]): detected_intents.append("hostile")
@@ -232,6 +262,16 @@ class SentimentEngine:
         if any(w in text for w in ["晚安", "再见", "拜拜", "睡了", "走了"]): detected_intents.append("farewell")
         return detected_intents
 
+    def next_auto_switch_time(self, last_interaction_ts):
+        """attempt_auto_switch 最早可能成功的时间戳 (与其中的锁定 / 冷却判断一致)"""
+        g_state = self.global_state_mgr.data
+        current_count = g_state.get("dialogue_count", 0)
+        lock_duration = 10 if current_count >= 5 else 120
+        deadline = last_interaction_ts + lock_duration
+        if current_count < 5:
+            deadline = max(deadline, g_state.get("last_switch_time", 0) + STATUS_CHANGE_INTERVAL)
+        return deadline
+
     def attempt_auto_switch(self, last_interaction_ts):
         """
         🔥 尝试自动切换状态 (复用 GlobalStateManager 的逻辑)
@@ -264,10 +304,12 @@ class SentimentEngine:
         # 4. 执行更新
         current_hour = datetime.datetime.now().hour
         print(f"🔄 [生活流] 芙宁娜决定换个事做({current_hour}点|已聊{current_count}轮): {current_act} -> {new_act}")
-        self.global_state_mgr.data["current_activity"] = new_act
-        self.global_state_mgr.data["current_location"] = new_loc
-        self.global_state_mgr.data["last_switch_time"] = now
-        self.global_state_mgr.data["dialogue_count"] = 0
+        self.global_state_mgr.set_fields(
+            current_activity=new_act,
+            current_location=new_loc,
+            last_switch_time=now,
+            dialogue_count=0
+        )
         self.global_state_mgr.update(mood_delta=5)
 
         return True, new_act, new_loc
@@ -309,14 +351,12 @@ class SentimentEngine:
 
         # 计数器逻辑
         current_count = g_state.get("dialogue_count", 0)
-        if next_act == current_act:
-            self.global_state_mgr.data["dialogue_count"] = current_count + 1
-        else:
-            self.global_state_mgr.data["dialogue_count"] = 0
-
-        self.global_state_mgr.data["current_location"] = next_loc
-        self.global_state_mgr.data["current_activity"] = next_act
-        self.global_state_mgr.data["current_item"] = next_item
+        self.global_state_mgr.set_fields(
+            dialogue_count=current_count + 1 if next_act == current_act else 0,
+            current_location=next_loc,
+            current_activity=next_act,
+            current_item=next_item
+        )
 
         energy_cost = 2
         intents = self._detect_intent(text)
@@ -372,7 +412,7 @@ async def handle_level_change(vts, audio_mgr, brain, memory_mgr, username, old_a
         2. 警告他如果再这样下去，就要把他拉黑了。
         """
     try:
-        decision = brain.unified_decision_maker(
+        decision = await brain.unified_decision_maker_async(
             user_text="(系统触发等级变动事件)",
             current_state_dict={"energy": 50, "mood": 50},
             sentiment_injection=injection,
@@ -386,7 +426,6 @@ async def handle_level_change(vts, audio_mgr, brain, memory_mgr, username, old_a
         reply = decision["reply_text"]
         print(f"✨ 芙宁娜(等级感言): {reply}")
         memory_mgr.add_history("assistant", reply)
-        memory_mgr.save()
         while audio_mgr.is_playing:  # 假设你有这个标记，如果没有，见下一步
             await asyncio.sleep(0.5)
         await audio_mgr.speak(reply, vts)
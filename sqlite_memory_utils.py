@@ -0,0 +1,553 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import datetime
+from memory_utils import MemoryManager
+from sentiment_utils import UserState
+from storage_utils import JsonlJournal
+
+# 用户存档里这些字段有独立的列，其余字段统一放进 extra (JSON)
+_USER_COLUMNS = ("username", "created_at", "user_state", "summary", "chat_history")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    username         TEXT PRIMARY KEY,
+    created_at       REAL,
+    user_state       TEXT,              -- UserState (JSON)，只在读过存档的用户身上有值
+    affection        REAL DEFAULT 0,    -- 实时好感 (随 user_state 更新)
+    summary          TEXT DEFAULT '',
+    extra            TEXT DEFAULT '{}', -- 存档里的其他字段 (JSON)
+    roster_affection REAL DEFAULT 0,    -- 名册上的好感 (归档时同步)
+    title            TEXT,
+    impression       TEXT,
+    gender           TEXT DEFAULT 'unknown',
+    last_interaction TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_roster_affection ON users(roster_affection DESC);
+
+CREATE TABLE IF NOT EXISTS chat_turns (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    username  TEXT NOT NULL,
+    role      TEXT NOT NULL,
+    content   TEXT NOT NULL,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_chat_turns_user ON chat_turns(username, id);
+
+CREATE TABLE IF NOT EXISTS diary_entries (
+    id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    date     TEXT NOT NULL,
+    content  TEXT NOT NULL,             -- 原始内容 (JSON：字符串或结构化字典)
+    location TEXT,
+    event    TEXT,
+    rolled   INTEGER DEFAULT 0          -- 1 = 已并入日汇总 (提示词不再直接读，RAG 仍可检索)
+);
+CREATE INDEX IF NOT EXISTS idx_diary_user ON diary_entries(username, id);
+CREATE INDEX IF NOT EXISTS idx_diary_date ON diary_entries(date);
+CREATE INDEX IF NOT EXISTS idx_diary_location ON diary_entries(location);
+
+CREATE TABLE IF NOT EXISTS entry_people (
+    entry_id INTEGER NOT NULL REFERENCES diary_entries(id) ON DELETE CASCADE,
+    person   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entry_people ON entry_people(person);
+
+CREATE TABLE IF NOT EXISTS entry_items (
+    entry_id INTEGER NOT NULL REFERENCES diary_entries(id) ON DELETE CASCADE,
+    item     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entry_items ON entry_items(item);
+
+CREATE TABLE IF NOT EXISTS social_edges (
+    source   TEXT NOT NULL,
+    target   TEXT NOT NULL,
+    relation TEXT,
+    content  TEXT,
+    time     TEXT,
+    PRIMARY KEY (source, target)
+);
+CREATE INDEX IF NOT EXISTS idx_social_edges_target ON social_edges(target);
+
+CREATE TABLE IF NOT EXISTS diary_rollups (
+    username TEXT NOT NULL,
+    tier     TEXT NOT NULL,             -- daily / weekly / monthly / earlier
+    period   TEXT NOT NULL,             -- 2026-10-17 / 2026-W41 / 2026-10 / 更早
+    text     TEXT NOT NULL,
+    count    INTEGER DEFAULT 0,         -- 覆盖了多少条原始日记
+    PRIMARY KEY (username, tier, period)
+);
+"""
+
+
+def open_database(db_path):
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    _upgrade_schema(conn)
+    return conn
+
+
+def _upgrade_schema(conn):
+    """老数据库补上后来新增的列"""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(diary_entries)")}
+    if "rolled" not in columns:
+        conn.execute("ALTER TABLE diary_entries ADD COLUMN rolled INTEGER DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_diary_rolled ON diary_entries(username, rolled, id)")
+    conn.commit()
+
+
+def _ensure_user(conn, username):
+    conn.execute("INSERT OR IGNORE INTO users (username, created_at) VALUES (?, ?)", (username, time.time()))
+
+
+def _insert_entry(conn, username, date, content, rolled=0):
+    """写入一条日记，结构化日记同时拆出地点/人物/物品，方便按字段检索"""
+    location = event = None
+    people, items = [], []
+    if isinstance(content, dict):
+        location = content.get("location")
+        event = content.get("event")
+        people = [p for p in content.get("people", []) if isinstance(p, str)]
+        items = [i for i in content.get("items", []) if isinstance(i, str)]
+
+    cur = conn.execute(
+        "INSERT INTO diary_entries (username, date, content, location, event, rolled) VALUES (?, ?, ?, ?, ?, ?)",
+        (username, date, json.dumps(content, ensure_ascii=False), location, event, rolled)
+    )
+    entry_id = cur.lastrowid
+    conn.executemany("INSERT INTO entry_people (entry_id, person) VALUES (?, ?)", [(entry_id, p) for p in people])
+    conn.executemany("INSERT INTO entry_items (entry_id, item) VALUES (?, ?)", [(entry_id, i) for i in items])
+    return entry_id
+
+
+def migrate_json_to_sqlite(save_dir, conn):
+    """
+    📦 一次性迁移：把 saves/*.json + global_diary.json 导入 SQLite
+    原 JSON 文件保留不动，作为备份。
+    """
+    diary_path = os.path.join(save_dir, "global_diary.json")
+    user_count = entry_count = edge_count = 0
+
+    with conn:
+        # 1. 用户存档 (合并尚未归档的追加日志)
+        for filename in os.listdir(save_dir):
+            if not filename.endswith(".json") or filename.startswith("global_"): continue
+            username = filename[:-len(".json")]
+            try:
+                with open(os.path.join(save_dir, filename), "r", encoding="utf-8") as f:
+                    user_data = json.load(f)
+            except Exception as e:
+                print(f"⚠️ [迁移] 跳过损坏的存档 {filename}: {e}")
+                continue
+
+            history = list(user_data.get("chat_history", []))
+            user_state = user_data.get("user_state", UserState().to_dict())
+            applied_seq = user_data.get("journal_seq", 0)
+            for record in JsonlJournal(os.path.join(save_dir, "journal", f"{username}.jsonl")).replay():
+                if record.get("seq", 0) <= applied_seq: continue
+                if record.get("op") == "chat":
+                    history.append({k: record[k] for k in ("role", "content", "timestamp") if k in record})
+                elif record.get("op") == "state":
+                    user_state = record.get("user_state", user_state)
+                elif record.get("op") == "fields":
+                    user_data.update(record.get("fields", {}))
+
+            extra = {k: v for k, v in user_data.items() if k not in _USER_COLUMNS and k != "journal_seq"}
+            _ensure_user(conn, username)
+            conn.execute(
+                "UPDATE users SET created_at = ?, user_state = ?, affection = ?, summary = ?, extra = ? "
+                "WHERE username = ?",
+                (user_data.get("created_at", time.time()), json.dumps(user_state, ensure_ascii=False),
+                 user_state.get("affection", 0), user_data.get("summary", ""),
+                 json.dumps(extra, ensure_ascii=False), username)
+            )
+            conn.execute("DELETE FROM chat_turns WHERE username = ?", (username,))
+            conn.executemany(
+                "INSERT INTO chat_turns (username, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(username, h.get("role", "user"), h.get("content", ""), h.get("timestamp")) for h in history]
+            )
+            user_count += 1
+
+        # 2. 世界日记：名册 + 个人日记 + 社交网络
+        if os.path.exists(diary_path):
+            with open(diary_path, "r", encoding="utf-8") as f:
+                diary = json.load(f)
+
+            relationships = diary.get("relationships", {})
+            # 兼容最老的顶层 entries 格式
+            for entry in diary.get("entries", []) if isinstance(diary.get("entries"), list) else []:
+                relationships.setdefault(entry.get("user", "未知"), {}).setdefault("entries", []).append(entry)
+
+            for username, info in relationships.items():
+                _ensure_user(conn, username)
+                conn.execute(
+                    "UPDATE users SET roster_affection = ?, title = ?, impression = ?, gender = ?, "
+                    "last_interaction = ? WHERE username = ?",
+                    (info.get("affection", 0), info.get("title"), info.get("impression"),
+                     info.get("gender", "unknown"), info.get("last_interaction"), username)
+                )
+                conn.execute("DELETE FROM diary_entries WHERE username = ?", (username,))
+                # 已汇总归档的原文先导入 (标记为已汇总)，再导入还没汇总的
+                for entry in JsonlJournal(os.path.join(save_dir, "diary_archive", f"{username}.jsonl")).replay():
+                    _insert_entry(conn, username, entry.get("date", ""), entry.get("content", ""), rolled=1)
+                    entry_count += 1
+                for entry in info.get("entries", []):
+                    _insert_entry(conn, username, entry.get("date", ""), entry.get("content", ""))
+                    entry_count += 1
+
+                conn.execute("DELETE FROM diary_rollups WHERE username = ?", (username,))
+                for tier, rollups in info.get("rollups", {}).items():
+                    conn.executemany(
+                        "INSERT INTO diary_rollups (username, tier, period, text, count) VALUES (?, ?, ?, ?, ?)",
+                        [(username, tier, r["period"], r["text"], r.get("count", 0)) for r in rollups]
+                    )
+
+            conn.execute("DELETE FROM social_edges")
+            for source, targets in diary.get("social_graph", {}).items():
+                for target, edge in targets.items():
+                    conn.execute(
+                        "INSERT INTO social_edges (source, target, relation, content, time) VALUES (?, ?, ?, ?, ?)",
+                        (source, target, edge.get("relation"), edge.get("content"), edge.get("time"))
+                    )
+                    edge_count += 1
+
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('diary_summary', ?)",
+                         (diary.get("summary", ""),))
+
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated_at', ?)",
+                     (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+
+    print(f"✅ [迁移] JSON -> SQLite 完成：{user_count} 份存档，{entry_count} 条日记，{edge_count} 条社交关系。")
+
+
+class SQLiteMemoryManager(MemoryManager):
+    """
+    🗄️ SQLite 版记忆管理器 (与 MemoryManager 接口一致)
+    用户、对话、日记、日记字段、社交关系都有独立的表和索引，
+    每轮对话的读写都是一次带索引的查询，不再整文件解析。
+    """
+
+    def __init__(self, save_dir="saves"):
+        self.db_path = os.path.join(save_dir, "furina.db")
+        super().__init__(save_dir)
+
+    # ================= 🔌 连接与迁移 =================
+    def _init_global_diary(self):
+        self._db_lock = threading.RLock()
+        self.db = open_database(self.db_path)
+        if self._get_meta("json_migrated_at") is None:
+            print("📦 [系统] 首次使用 SQLite 存储，正在从 JSON 存档迁移...")
+            migrate_json_to_sqlite(self.save_dir, self.db)
+
+    def _execute(self, sql, params=()):
+        with self._db_lock, self.db:
+            return self.db.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def _get_meta(self, key, default=None):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0]["value"] if rows else default
+
+    def flush(self):
+        pass  # 每次写入都已提交
+
+    def migrate_entries_structure(self):
+        pass  # 迁移器已处理旧版顶层 entries
+
+    def sync_legacy_users(self):
+        pass  # 迁移器已导入所有老用户
+
+    # ================= 👤 用户存档 =================
+    def load_user(self, username):
+        self.current_user = username
+        with self._db_lock, self.db:
+            _ensure_user(self.db, username)
+            row = self.db.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+            history = self.db.execute(
+                "SELECT role, content, timestamp FROM ("
+                "  SELECT id, role, content, timestamp FROM chat_turns WHERE username = ? ORDER BY id DESC LIMIT 200"
+                ") ORDER BY id", (username,)
+            ).fetchall()
+
+        self.data = json.loads(row["extra"] or "{}")
+        self.data.update({
+            "username": username,
+            "created_at": row["created_at"],
+            "user_state": json.loads(row["user_state"]) if row["user_state"] else UserState().to_dict(),
+            "summary": row["summary"] or "",
+            "chat_history": [dict(h) for h in history]
+        })
+
+        self._init_summary_mark()
+        self._load_rag_index(username)
+
+        lvl, title, _ = self.calculate_status()
+        print(f"📖 [记忆] 读取成功: {username} (Lv.{lvl} {title})")
+
+    def save(self):
+        """写出完整用户记录 (对话历史以内存中的为准，归档修剪后的结果会同步到表里)"""
+        if not self.current_user or not self.data: return
+        extra = {k: v for k, v in self.data.items() if k not in _USER_COLUMNS}
+        user_state = self.data.get("user_state", {})
+        history = self.data.get("chat_history", [])
+        with self._db_lock, self.db:
+            self.db.execute(
+                "UPDATE users SET user_state = ?, affection = ?, summary = ?, extra = ? WHERE username = ?",
+                (json.dumps(user_state, ensure_ascii=False), user_state.get("affection", 0),
+                 self.data.get("summary", ""), json.dumps(extra, ensure_ascii=False), self.current_user)
+            )
+            self.db.execute("DELETE FROM chat_turns WHERE username = ?", (self.current_user,))
+            self.db.executemany(
+                "INSERT INTO chat_turns (username, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                [(self.current_user, h["role"], h["content"], h.get("timestamp")) for h in history]
+            )
+
+    def _journal_append(self, record):
+        """每条对话 / 状态变化直接落库 (单行插入或更新)"""
+        op = record.get("op")
+        if op == "chat":
+            self._execute(
+                "INSERT INTO chat_turns (username, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                (self.current_user, record["role"], record["content"], record.get("timestamp"))
+            )
+        elif op == "state":
+            user_state = record["user_state"]
+            self._execute(
+                "UPDATE users SET user_state = ?, affection = ? WHERE username = ?",
+                (json.dumps(user_state, ensure_ascii=False), user_state.get("affection", 0), self.current_user)
+            )
+        elif op == "fields":
+            # 零散字段都存在 extra 里 (set_fields 已经先更新了 self.data)
+            extra = {k: v for k, v in self.data.items() if k not in _USER_COLUMNS}
+            self._execute("UPDATE users SET extra = ? WHERE username = ?",
+                          (json.dumps(extra, ensure_ascii=False), self.current_user))
+
+    def get_user_affection(self, username):
+        try:
+            rows = self._query("SELECT affection FROM users WHERE username = ?", (username,))
+            return rows[0]["affection"] if rows else 0
+        except Exception:
+            return 0
+
+    # ================= 📔 日记 =================
+    @staticmethod
+    def _row_to_entry(row):
+        return {"date": row["date"], "content": json.loads(row["content"])}
+
+    def _get_user_entries(self, username):
+        rows = self._query("SELECT date, content FROM diary_entries WHERE username = ? ORDER BY id", (username,))
+        return [self._row_to_entry(r) for r in rows]
+
+    def add_global_event(self, username, content):
+        today = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+        try:
+            with self._db_lock, self.db:
+                _ensure_user(self.db, username)
+                _insert_entry(self.db, username, today, content)
+        except Exception as e:
+            print(f"⚠️ 个人日记写入失败: {e}")
+            return
+
+        if username == self.current_user:
+            self._append_to_index(self._diary_entry_text({"date": today, "content": content}))
+
+    # ================= 🗜️ 日记分层汇总 (汇总算法见 MemoryManager) =================
+    def _unrolled_entries(self, username):
+        rows = self._query(
+            "SELECT id, date, content FROM diary_entries WHERE username = ? AND rolled = 0 ORDER BY id", (username,)
+        )
+        return [dict(self._row_to_entry(r), id=r["id"]) for r in rows]
+
+    def _mark_rolled(self, username, entries):
+        """原文留在表里 (RAG 用)，只打上已汇总的标记"""
+        with self._db_lock, self.db:
+            self.db.executemany("UPDATE diary_entries SET rolled = 1 WHERE id = ?", [(e["id"],) for e in entries])
+
+    def _load_rollups(self, username):
+        rollups = {tier: [] for tier in self.ROLLUP_TIERS}
+        for r in self._query("SELECT tier, period, text, count FROM diary_rollups WHERE username = ?", (username,)):
+            if r["tier"] in rollups:
+                rollups[r["tier"]].append({"period": r["period"], "text": r["text"], "count": r["count"]})
+        for tier, items in rollups.items():
+            items.sort(key=lambda r: self._rollup_sort_key(tier, r["period"]))
+        return rollups
+
+    def _save_rollups(self, username, rollups):
+        with self._db_lock, self.db:
+            self.db.execute("DELETE FROM diary_rollups WHERE username = ?", (username,))
+            self.db.executemany(
+                "INSERT INTO diary_rollups (username, tier, period, text, count) VALUES (?, ?, ?, ?, ?)",
+                [(username, tier, r["period"], r["text"], r.get("count", 0))
+                 for tier in self.ROLLUP_TIERS for r in rollups.get(tier, [])]
+            )
+
+    def _all_rollups(self):
+        by_user = {}
+        for r in self._query("SELECT DISTINCT username FROM diary_rollups"):
+            by_user[r["username"]] = self._load_rollups(r["username"])
+        return by_user
+
+    def get_global_activity_log(self, limit=10):
+        try:
+            rows = self._query(
+                "SELECT username, date, content FROM diary_entries WHERE rolled = 0 "
+                "ORDER BY date DESC, id DESC LIMIT ?", (limit,)
+            )
+            log_text = ""
+            for r in rows:
+                content = self._format_entry_content(json.loads(r["content"]))
+                log_text += f"- {r['date']} 【{r['username']}】: {content}\n"
+            # 最近的原始日记不够数时，用汇总补上
+            if len(rows) < limit:
+                log_text += self._format_rollup_log(self._all_rollups(), limit - len(rows))
+            return log_text if log_text else "(近期无其他访客)"
+        except Exception as e:
+            print(f"⚠️ 读取全局日志失败: {e}")
+            return "(读取失败)"
+
+    def get_person_brief(self, target_name):
+        try:
+            rows = self._query(
+                "SELECT roster_affection, title, impression FROM users WHERE username = ?", (target_name,)
+            )
+            if not rows: return None
+            info = rows[0]
+            impression = info["impression"] or ""
+            if not impression:
+                latest = self._query(
+                    "SELECT content FROM diary_entries WHERE username = ? AND rolled = 0 ORDER BY id DESC LIMIT 1",
+                    (target_name,)
+                )
+                if latest: impression = json.loads(latest[0]["content"])
+            if not impression:
+                latest = self._latest_rollup(self._load_rollups(target_name))
+                if latest: impression = latest["text"]
+            if not impression: impression = "没什么特别的印象。"
+            return f"- 【{target_name}】 (好感:{int(info['roster_affection'] or 0)} | 身份:{info['title'] or '陌生人'}): {impression}"
+        except Exception as e:
+            print(f"⚠️ 检索失败: {e}")
+            return None
+
+    def get_recent_global_events(self):
+        try:
+            text = ""
+            summary = self._get_meta("diary_summary", "")
+            if summary:
+                text += f"📜 【历史总集】:\n{summary}\n\n"
+
+            people = self._query(
+                "SELECT u.username, u.title, u.impression, "
+                "  (SELECT COUNT(*) FROM diary_entries d WHERE d.username = u.username) AS entries_count, "
+                "  (SELECT d.date || char(0) || d.content FROM diary_entries d "
+                "     WHERE d.username = u.username AND d.rolled = 0 ORDER BY d.id DESC LIMIT 1) AS latest "
+                "FROM users u ORDER BY u.roster_affection DESC"
+            )
+            if people:
+                text += "🆕 【近期见闻】:\n"
+                has_news = False
+                for p in people:
+                    if p["latest"]:
+                        date, content = p["latest"].split("\0", 1)
+                        readable_content = self._format_entry_content(json.loads(content))
+                        text += f"- 关于【{p['username']}】: {readable_content} ({date})\n"
+                        has_news = True
+                    else:
+                        latest = self._latest_rollup(self._load_rollups(p["username"]))
+                        if latest:
+                            text += f"- 关于【{p['username']}】: {latest['text']} ({latest['period']})\n"
+                            has_news = True
+                if not has_news: text += "(暂无)\n"
+                text += "\n"
+
+                text += "👥 【人际关系名册】:\n"
+                for p in people:
+                    impression = p["impression"] if p["impression"] is not None else "暂无详细记录"
+                    short_impression = impression[:30] + "..." if len(impression) > 30 else impression
+                    text += f"- 【{p['username']}】 ({p['title'] or '陌生人'} | 💾 独家记忆:{p['entries_count']}条): {short_impression}\n"
+
+            return text if text else "生活很平静。"
+        except Exception:
+            return "暂无新鲜事"
+
+    # ================= 👥 名册与社交网络 =================
+    def get_known_users(self):
+        try:
+            return [r["username"] for r in self._query("SELECT username FROM users")]
+        except Exception as e:
+            print(f"⚠️ 读取用户列表失败: {e}")
+            return []
+
+    def update_global_social_status(self, username, affection, title, summary):
+        try:
+            with self._db_lock, self.db:
+                _ensure_user(self.db, username)
+                self.db.execute(
+                    "UPDATE users SET roster_affection = ?, title = ?, impression = ?, last_interaction = ? "
+                    "WHERE username = ?",
+                    (affection, title, summary, datetime.datetime.now().strftime("%Y-%m-%d %H:%M"), username)
+                )
+            print(f"🌍 [世界记忆] 已更新【{username}】的社交档案")
+        except Exception as e:
+            print(f"⚠️ 社交名册更新失败: {e}")
+
+    def update_user_gender(self, username, gender):
+        try:
+            if gender == "unknown" or self.get_user_gender(username) == gender: return
+            with self._db_lock, self.db:
+                _ensure_user(self.db, username)
+                self.db.execute("UPDATE users SET gender = ? WHERE username = ?", (gender, username))
+            print(f"⚧️ [性别识别] 更新了【{username}】的性别: {gender}")
+        except Exception as e:
+            print(f"⚠️ 性别更新失败: {e}")
+
+    def get_user_gender(self, username):
+        try:
+            rows = self._query("SELECT gender FROM users WHERE username = ?", (username,))
+            return (rows[0]["gender"] or "unknown") if rows else "unknown"
+        except Exception:
+            return "unknown"
+
+    def update_social_relation(self, source_user, target_user, relation_desc, gossip_content):
+        try:
+            self._execute(
+                "INSERT OR REPLACE INTO social_edges (source, target, relation, content, time) VALUES (?, ?, ?, ?, ?)",
+                (source_user, target_user, relation_desc, gossip_content,
+                 datetime.datetime.now().strftime("%Y-%m-%d %H:%M"))
+            )
+            print(f"🕸️ [社交网络] 已记录: 【{source_user}】->【{target_user}】 ({relation_desc})")
+        except Exception as e:
+            print(f"⚠️ 社交关系更新失败: {e}")
+
+    def get_social_context(self, current_user):
+        try:
+            gossip_text = ""
+            # 1. 别人怎么看我 (Incoming)
+            for r in self._query("SELECT source, relation, content FROM social_edges WHERE target = ?", (current_user,)):
+                gossip_text += f"- 👂 【传闻】{r['source']} 对你的态度是：{r['relation']} (\"{r['content']}\")\n"
+            # 2. 我怎么看别人 (Outgoing)
+            for r in self._query("SELECT target, relation FROM social_edges WHERE source = ?", (current_user,)):
+                gossip_text += f"- 💭 【记忆】你曾表示对 {r['target']} 的态度是：{r['relation']}\n"
+            return gossip_text if gossip_text else "暂无关于你的流言蜚语。"
+        except Exception:
+            return "暂无情报"
+
+
+if __name__ == "__main__":
+    # 手动执行一次迁移：python sqlite_memory_utils.py [存档目录]
+    import sys
+    target_dir = sys.argv[1] if len(sys.argv) > 1 else "saves"
+    migrate_json_to_sqlite(target_dir, open_database(os.path.join(target_dir, "furina.db")))
@@ -0,0 +1,143 @@
+import atexit
+import json
+import os
+import threading
+import time
+
+
+def atomic_write_text(path, payload):
+    """
+    💾 原子写入：先写临时文件再替换，写到一半崩溃也不会留下残缺的存档
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_json(path, data, indent=4):
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=indent))
+
+
+def atomic_write_bytes(path, payload):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class JsonDocument:
+    """
+    📄 常驻内存的 JSON 文档 (写回式持久化)
+    - 读：直接读 self.data，不碰磁盘
+    - 写：修改 self.data 后调用 mark_dirty()，后台定时器把一段时间内的所有修改
+      合并成一次原子重写 (每个周期最多写一次)
+    - 退出：close() / atexit 时强制刷盘
+    """
+
+    def __init__(self, path, default_data, flush_interval=2.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()  # 修改 data 时必须持有，防止刷盘线程序列化到一半
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+        self.data = self._load(default_data)
+        atexit.register(self.flush)
+
+    def _load(self, default_data):
+        if not os.path.exists(self.path):
+            self._dirty = True  # 文件不存在：下一次刷盘时创建
+            return default_data
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            # 文件损坏：先备份现场，避免被默认值覆盖后彻底丢失
+            backup = f"{self.path}.corrupt_{int(time.time())}"
+            print(f"⚠️ [存储] {os.path.basename(self.path)} 解析失败 ({e})，已备份到 {os.path.basename(backup)}")
+            try:
+                os.replace(self.path, backup)
+            except OSError:
+                pass
+            self._dirty = True
+            return default_data
+
+    def mark_dirty(self):
+        """标记有修改，安排一次延迟刷盘 (已安排则合并)"""
+        with self.lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """立即把内存中的修改写回磁盘 (没有修改则什么也不做)"""
+        with self._write_lock:
+            with self.lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty: return
+                payload = json.dumps(self.data, ensure_ascii=False, indent=4)
+                self._dirty = False
+            try:
+                atomic_write_text(self.path, payload)
+            except Exception as e:
+                print(f"❌ [存储] 写入 {os.path.basename(self.path)} 失败: {e}")
+                self.mark_dirty()  # 稍后重试
+
+    def close(self):
+        self.flush()
+
+
+class JsonlJournal:
+    """
+    📝 追加式日志 (每条记录一行 JSON)
+    - 写：只在文件末尾追加一行并 flush，代价与历史长度无关
+    - 崩溃：最多丢失最后一行，回放时自动跳过写了一半的行
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+    def replay(self):
+        """按写入顺序读出所有完整的记录"""
+        if not os.path.exists(self.path): return []
+        records = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line: continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"⚠️ [存储] 跳过 {os.path.basename(self.path)} 中损坏的一行")
+        return records
+
+    def truncate(self):
+        """快照已落盘后清空日志"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -3,10 +3,124 @@ import websockets
 import json
 import os
 import time
-from config import ACTIONS
+import uuid
+from config import ACTIONS, ACTION_COOLDOWN, ACTION_GLOBAL_COOLDOWN, VTS_REQUEST_TIMEOUT, VTS_PARAM_FPS
+
+
+class VTSAPIError(Exception):
+    """VTS 返回了 APIError"""
+
+    def __init__(self, message_type, error_id, message):
+        super().__init__(f"{message_type} 失败 (errorID={error_id}): {message}")
+        self.message_type = message_type
+        self.error_id = error_id
+
+
+class ParameterFrameScheduler:
+    """
+    🎞️ 参数合帧器：把各处写入的参数 (眼球、嘴型、面部角度、呼吸...) 合并成一帧，按固定帧率发送
+    - set() 只改内存里的目标值，不发消息；同一帧内的多次写入只发最后一次
+    - 与上一帧完全相同的参数不重发，整帧没变化就跳过
+    - VTS 约 1 秒收不到某个参数就会把它交还给面捕：hold 时间内的参数会定期补发保活，
+      过了 hold 时间不再发送，自然交还
+    - 没有任何参数要发时停下节拍，等下一次写入再恢复 (闲着时不空转)
+    """
+    KEEPALIVE = 0.5  # 参数未变化时的补发间隔 (秒)
+    DEFAULT_HOLD = 1.0  # 写入一次默认接管多久 (秒)
+
+    def __init__(self, vts, fps=VTS_PARAM_FPS):
+        self.vts = vts
+        self.interval = 1.0 / fps
+        self._targets = {}  # 参数ID -> (目标值, 接管截止时间)
+        self._sources = {}  # 参数ID -> 每帧发送前调用的取值函数 (返回 None 表示结束)
+        self._sent = {}  # 参数ID -> (上次发送的值, 发送时间)
+        self._task = None
+        self._wake = asyncio.Event()  # 有新写入时叫醒停着的节拍
+        self.stats = {"frames": 0, "skipped": 0, "parked": 0}
+
+    def set(self, param_id, value, hold=None):
+        expires = time.monotonic() + (self.DEFAULT_HOLD if hold is None else hold)
+        self._targets[param_id] = (round(float(value), 4), expires)
+        self._wake.set()
+
+    def set_many(self, values, hold=None):
+        for param_id, value in values.items():
+            self.set(param_id, value, hold)
+
+    def set_source(self, param_id, source):
+        """绑定取值函数：每帧发送前现取当前值 (用于口型等需要跟随时钟的参数)"""
+        self._sources[param_id] = source
+        self._wake.set()
+
+    def clear_source(self, param_id):
+        self._sources.pop(param_id, None)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel()
+
+    def _build_frame(self, now):
+        for param_id, source in list(self._sources.items()):
+            value = source()
+            if value is None:
+                del self._sources[param_id]
+            else:
+                self._targets[param_id] = (round(float(value), 4), now + self.DEFAULT_HOLD)
+
+        frame = []
+        for param_id, (value, expires) in list(self._targets.items()):
+            if now > expires:
+                del self._targets[param_id]
+                self._sent.pop(param_id, None)
+                continue
+            last = self._sent.get(param_id)
+            if last is None or last[0] != value or now - last[1] >= self.KEEPALIVE:
+                frame.append({"id": param_id, "value": value})
+                self._sent[param_id] = (value, now)
+        return frame
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            if not self._targets and not self._sources:
+                # 没东西可发：停下来等写入 (set / set_many / set_source 会叫醒)
+                self.stats["parked"] += 1
+                self._wake.clear()
+                await self._wake.wait()
+                next_tick = loop.time()
+
+            # 按绝对时间对齐节拍，发送耗时不会累积成漂移
+            next_tick += self.interval
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                next_tick = loop.time()  # 落后太多就不追帧了
+
+            frame = self._build_frame(time.monotonic())
+            if not frame:
+                self.stats["skipped"] += 1
+                continue
+            self.stats["frames"] += 1
+            try:
+                await self.vts.send("InjectParameterDataRequest", {"mode": "set", "parameterValues": frame})
+            except Exception as e:
+                print(f"⚠️ [VTS] 参数帧发送失败: {e}")
 
 
 class VTSController:
+    """
+    🎭 VTS 控制器
+    - 后台读取任务持续接收 VTS 的回应，按 requestID 分发给对应的 Future (socket 里不会积压未读消息)
+    - request(): 发送并等待结果，APIError 以 VTSAPIError 抛出
+    - send(): 发出即返回，出错时只打印日志
+    - 动作调度：连接时读取模型热键表校验 ACTIONS；触发动作经过冷却 / 去重，表情开关状态有记录
+    """
+
     def __init__(self, port=8001):
         self.port = port
         self.uri = f"ws://127.0.0.1:{port}"
@@ -15,108 +129,278 @@ class VTSController:
         self.plugin_name = "Furina_Final"
         self.developer = "User"
         self.API_NAME = "VTubeStudioPublicAPI"
+        self.request_timeout = VTS_REQUEST_TIMEOUT
+        self._reader_task = None
+        self._pending = {}  # requestID -> (Future, messageType, 发送时间)
+        self.latency = {}  # messageType -> {"count", "total_ms", "last_ms"}
+        self.params = ParameterFrameScheduler(self)
+
+        # 🎬 动作调度
+        self.hotkeys = {}  # hotkeyID -> {"name", "type", "file"} (当前模型的热键表)
+        self.action_ids = dict(ACTIONS)  # 动作名 -> hotkeyID (校验后)
+        self.active_toggles = set()  # 当前处于开启状态的表情热键
+        self._last_fired = {}  # hotkeyID -> 上次触发时间
+        self._last_any_fired = 0.0
 
     async def connect(self):
         """连接 VTS (带心跳保活)"""
         print(f"🔌 [VTS] 正在连接端口 {self.port}...")
         try:
+            if self._reader_task: self._reader_task.cancel()
             self.ws = await websockets.connect(self.uri, ping_interval=20, ping_timeout=30)
+            self._reader_task = asyncio.create_task(self._reader(self.ws))
             print("✅ [VTS] WebSocket 连接成功！")
 
             if os.path.exists("token.txt"):
                 with open("token.txt", "r") as f:
                     self.token = f.read().strip()
                 if await self.authenticate():
+                    await self._on_authenticated()
                     return True
 
             print("👋 [VTS] Token 无效，尝试重新申请...")
             await self.request_new_token()
-            return await self.authenticate()
+            if not await self.authenticate(): return False
+            await self._on_authenticated()
+            return True
 
         except Exception as e:
             print(f"❌ [VTS] 连接失败: {e}")
             return False
 
+    async def _on_authenticated(self):
+        self.params.start()
+        try:
+            await self.refresh_hotkeys()
+        except Exception as e:
+            print(f"⚠️ [VTS] 读取热键表失败，直接使用配置里的 ID: {e}")
+
     async def _safe_send(self, req):
-        """🛡️ 安全发送函数 (自动重连)"""
+        """🛡️ 安全发送函数 (自动重连)，返回是否发送成功"""
         if not self.ws:
             print("⚠️ [VTS] 连接未建立，尝试连接...")
-            if not await self.connect(): return
+            if not await self.connect(): return False
 
         try:
             await self.ws.send(json.dumps(req))
+            return True
         except (websockets.exceptions.ConnectionClosedError, websockets.exceptions.ConnectionClosedOK, BrokenPipeError):
             print("🚨 [VTS] 检测到连接断开！正在紧急重连...")
             if await self.connect():
                 print("🔄 [VTS] 重连成功！补发指令...")
                 try:
                     await self.ws.send(json.dumps(req))
+                    return True
                 except Exception as e:
                     print(f"❌ [VTS] 补发失败: {e}")
             else:
                 print("❌ [VTS] 重连失败，放弃本次指令。")
         except Exception as e:
             print(f"⚠️ [VTS] 发送指令异常: {e}")
+        return False
 
-    async def request_new_token(self):
+    # ================= 📬 请求 / 回应 分发 =================
+    async def _reader(self, ws):
+        """后台读取任务：每条回应按 requestID 交给等待它的 Future"""
+        try:
+            async for message in ws:
+                try:
+                    resp = json.loads(message)
+                except json.JSONDecodeError:
+                    continue
+                entry = self._pending.pop(resp.get("requestID"), None)
+                if entry is None: continue
+                future, message_type, sent_at = entry
+                cost_ms = (time.perf_counter() - sent_at) * 1000
+                stat = self.latency.setdefault(message_type, {"count": 0, "total_ms": 0.0, "last_ms": 0.0})
+                stat["count"] += 1
+                stat["total_ms"] += cost_ms
+                stat["last_ms"] = cost_ms
+                if not future.done(): future.set_result(resp)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            # 连接断了：让所有还在等回应的请求立即失败，而不是等到超时
+            for request_id, (future, _, _) in list(self._pending.items()):
+                if not future.done(): future.set_exception(ConnectionError("VTS 连接已断开"))
+            self._pending.clear()
+
+    async def _submit(self, message_type, data):
+        """发送一个请求，返回等待其回应的 Future (发送失败返回 None)"""
+        request_id = f"{message_type}_{uuid.uuid4().hex[:12]}"
         req = {
-            "apiName": self.API_NAME, "apiVersion": "1.0", "requestID": "token_req",
-            "messageType": "AuthenticationTokenRequest",
-            "data": {"pluginName": self.plugin_name, "pluginDeveloper": self.developer}
+            "apiName": self.API_NAME, "apiVersion": "1.0", "requestID": request_id,
+            "messageType": message_type,
+            "data": data or {}
         }
-        await self.ws.send(json.dumps(req))
+        future = self._register(request_id, message_type)
+        if not await self._safe_send(req):
+            self._pending.pop(request_id, None)
+            return None
+        if request_id not in self._pending:
+            # 发送途中断线重连过，旧连接的等待表已清空：在新连接上重新登记
+            if future.done() and not future.cancelled(): future.exception()
+            future = self._register(request_id, message_type)
+        return future
+
+    def _register(self, request_id, message_type):
+        """登记一个等待回应的 Future；它结束时 (收到回应 / 超时被取消) 自动从等待表移除"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, message_type, time.perf_counter())
+
+        def forget(f):
+            entry = self._pending.get(request_id)
+            if entry is not None and entry[0] is f: del self._pending[request_id]
+
+        future.add_done_callback(forget)
+        return future
+
+    async def request(self, message_type, data=None, timeout=None):
+        """
+        发送请求并等待 VTS 回应
+        :param timeout: 默认 VTS_REQUEST_TIMEOUT；传 0 表示一直等 (例如等用户点击授权)
+        :return: 回应中的 data 字段
+        """
+        future = await self._submit(message_type, data)
+        if future is None: raise ConnectionError("VTS 未连接")
+        if timeout is None: timeout = self.request_timeout
+        resp = await asyncio.wait_for(future, timeout=timeout or None)
+        if resp.get("messageType") == "APIError":
+            error = resp.get("data", {})
+            raise VTSAPIError(message_type, error.get("errorID"), error.get("message"))
+        return resp.get("data", {})
+
+    async def send(self, message_type, data=None):
+        """发出即返回，不等待回应 (回应仍会被读取，出错时打印日志；超时没回应就不再等)"""
+        future = await self._submit(message_type, data)
+        if future is not None:
+            future.add_done_callback(lambda f: self._log_send_result(message_type, f))
+            expire = asyncio.get_running_loop().call_later(self.request_timeout, future.cancel)
+            future.add_done_callback(lambda f: expire.cancel())
+
+    @staticmethod
+    def _log_send_result(message_type, future):
+        if future.cancelled(): return
+        if future.exception() is not None: return  # 连接断开，_safe_send 已经提示过
+        resp = future.result()
+        if resp.get("messageType") == "APIError":
+            error = resp.get("data", {})
+            print(f"⚠️ [VTS] {message_type} 失败 (errorID={error.get('errorID')}): {error.get('message')}")
+
+    async def request_new_token(self):
         print("🚨 请在 VTS 点击 Allow...")
-        while True:
-            resp = json.loads(await self.ws.recv())
-            if "authenticationToken" in resp.get("data", {}):
-                self.token = resp["data"]["authenticationToken"]
-                with open("token.txt", "w") as f: f.write(self.token)
-                print("🎉 Token 获取成功！")
-                break
+        data = await self.request(
+            "AuthenticationTokenRequest",
+            {"pluginName": self.plugin_name, "pluginDeveloper": self.developer},
+            timeout=0  # 等用户点击
+        )
+        self.token = data["authenticationToken"]
+        with open("token.txt", "w") as f: f.write(self.token)
+        print("🎉 Token 获取成功！")
 
     async def authenticate(self):
-        req = {
-            "apiName": self.API_NAME, "apiVersion": "1.0", "requestID": "auth",
-            "messageType": "AuthenticationRequest",
-            "data": {"pluginName": self.plugin_name, "pluginDeveloper": self.developer,
-                     "authenticationToken": self.token}
-        }
-        if self.ws:
-            await self.ws.send(json.dumps(req))
-            resp = json.loads(await self.ws.recv())
-            return resp.get("data", {}).get("authenticated")
-        return False
+        if not self.ws: return False
+        try:
+            data = await self.request(
+                "AuthenticationRequest",
+                {"pluginName": self.plugin_name, "pluginDeveloper": self.developer,
+                 "authenticationToken": self.token}
+            )
+        except VTSAPIError as e:
+            print(f"⚠️ [VTS] 认证被拒绝: {e}")
+            return False
+        return data.get("authenticated")
 
-    async def trigger_action(self, action_name):
-        hotkey_id = ACTIONS.get(action_name)
-        if not hotkey_id: return
-        req = {
-            "apiName": self.API_NAME, "apiVersion": "1.0", "requestID": f"act_{action_name}",
-            "messageType": "HotkeyTriggerRequest",
-            "data": {"hotkeyID": hotkey_id}
+    # ================= 🎬 动作调度 =================
+    async def refresh_hotkeys(self):
+        """读取当前模型的热键表，校验 ACTIONS 并同步表情开关状态"""
+        data = await self.request("HotkeysInCurrentModelRequest")
+        self.hotkeys = {
+            hk["hotkeyID"]: {"name": hk.get("name", ""), "type": hk.get("type", ""), "file": hk.get("file", "")}
+            for hk in data.get("availableHotkeys", [])
         }
-        await self._safe_send(req)
+        ids_by_name = {info["name"]: hotkey_id for hotkey_id, info in self.hotkeys.items()}
+
+        self.action_ids = {}
+        missing = []
+        for action, hotkey_id in ACTIONS.items():
+            if hotkey_id in self.hotkeys:
+                self.action_ids[action] = hotkey_id
+            elif action in ids_by_name:
+                # ID 失效 (模型热键重建过)，但有同名热键：按名字找回
+                self.action_ids[action] = ids_by_name[action]
+            else:
+                missing.append(action)
+        print(f"🎬 [VTS] 模型共有 {len(self.hotkeys)} 个热键，可用动作 {len(self.action_ids)}/{len(ACTIONS)}")
+        if missing: print(f"⚠️ [VTS] 以下动作在当前模型里找不到热键，已禁用: {', '.join(missing)}")
+
+        # 同步已经开着的表情，避免第一次触发反而把它关掉
+        self.active_toggles = set()
+        try:
+            state = await self.request("ExpressionStateRequest", {"details": False})
+            active_files = {e["file"] for e in state.get("expressions", []) if e.get("active")}
+            self.active_toggles = {
+                hotkey_id for hotkey_id, info in self.hotkeys.items()
+                if info["type"] == "ToggleExpression" and info["file"] in active_files
+            }
+        except Exception as e:
+            print(f"⚠️ [VTS] 读取表情状态失败: {e}")
+
+    async def trigger_action(self, action_name, force=False):
+        """
+        触发动作 (经过冷却与去重)
+        :param force: 跳过全局动作间隔 (回复自带的情绪动作、连招)；同一热键的冷却仍然生效，
+                      但当前没开着的表情开关除外 (上一句说完刚被 clear_expressions 关掉，这句要能再开)
+        :return: 是否真的发出了触发
+        """
+        hotkey_id = self.action_ids.get(action_name)
+        if not hotkey_id: return False
+
+        now = time.monotonic()
+        is_toggle = self.hotkeys.get(hotkey_id, {}).get("type") == "ToggleExpression"
+        # 1. 同一个热键冷却中 (不同动作名可能共用一个热键，一起算)
+        reopen = force and is_toggle and hotkey_id not in self.active_toggles
+        if not reopen and now - self._last_fired.get(hotkey_id, -ACTION_COOLDOWN) < ACTION_COOLDOWN: return False
+        # 2. 全局间隔：动作挤在一起时只保留第一个
+        if not force and now - self._last_any_fired < ACTION_GLOBAL_COOLDOWN: return False
+
+        # 3. 表情开关：已经开着就不再触发 (再触发一次会把它关掉)；开新表情前先关掉旧的
+        if is_toggle and hotkey_id in self.active_toggles: return False
+
+        # 先登记再发送，并发的重复触发在这里就会被拦下
+        self._last_fired[hotkey_id] = now
+        self._last_any_fired = now
+        if is_toggle:
+            for old_id in list(self.active_toggles):
+                await self.send("HotkeyTriggerRequest", {"hotkeyID": old_id})
+            self.active_toggles = {hotkey_id}
+        await self.send("HotkeyTriggerRequest", {"hotkeyID": hotkey_id})
+        return True
+
+    async def clear_expressions(self):
+        """关掉所有开着的表情 (按记录的开关状态逐个关闭)"""
+        for hotkey_id in list(self.active_toggles):
+            await self.send("HotkeyTriggerRequest", {"hotkeyID": hotkey_id})
+        self.active_toggles = set()
 
     async def trigger_combo(self, action_list, delay=1.0):
         print(f"🤸 执行连招: {action_list}")
         for action in action_list:
-            await self.trigger_action(action)
+            await self.trigger_action(action, force=True)
             if action != action_list[-1]:
                 await asyncio.sleep(delay)
 
     async def move_eyes(self, x, y):
-        req = {
-            "apiName": self.API_NAME, "apiVersion": "1.0", "requestID": "EyeMove",
-            "messageType": "InjectParameterDataRequest",
-            "data": {
-                "mode": "set",
-                "parameterValues": [
-                    {"id": "ParamEyeBallX", "value": x},
-                    {"id": "ParamEyeBallY", "value": y}
-                ]
-            }
-        }
-        await self._safe_send(req)
+        # 只写入目标值，由合帧器在下一帧统一发送
+        self.params.set_many({"ParamEyeBallX": x, "ParamEyeBallY": y})
+
+    def start_lip_sync(self, mouth_source):
+        """口型跟随音频：mouth_source() 返回当前应张嘴的程度 (0~1)"""
+        self.params.set_source("ParamMouthOpenY", mouth_source)
+
+    def stop_lip_sync(self):
+        self.params.clear_source("ParamMouthOpenY")
+        self.params.set("ParamMouthOpenY", 0, hold=0.3)  # 合上嘴后交还给面捕
 
     async def look_at_camera(self):
         await self.move_eyes(0, 0)
@@ -128,7 +412,9 @@ class VTSController:
         await self.move_eyes(0, -0.8)
 
     async def close(self):
+        self.params.stop()
         if self.ws: await self.ws.close()
+        if self._reader_task: self._reader_task.cancel()
 
     async def set_background(self, filename):
         """
@@ -138,14 +424,4 @@ class VTSController:
         # ✅ 修复：使用 self.ws 而不是 self.websocket
         if not self.ws: return
 
-        req = {
-            "apiName": "VTubeStudioPublicAPI",
-            "apiVersion": "1.0",
-            "requestID": f"BGChange_{int(time.time())}",
-            "messageType": "ChangeBackgroundRequest",
-            "data": {
-                "backgroundName": filename
-            }
-        }
-        # 使用 _safe_send 确保稳定
-        await self._safe_send(req)
\ No newline at end of file
+        await self.send("ChangeBackgroundRequest", {"backgroundName": filename})